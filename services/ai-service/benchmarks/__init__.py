@@ -0,0 +1,23 @@
+"""
+Offline benchmarks for the AI service.
+
+Run from ``services/ai-service``; no Azure resources are needed:
+
+    python -m benchmarks.load     # /process-chat under increasing concurrency
+    python -m benchmarks.micro    # context, system prompt and filter parsing
+    python -m benchmarks.replay capture.jsonl.gz   # captured production traffic
+
+The agent and Cosmos DB are replaced by the local stand-ins in
+``benchmarks.fakes``.
+"""
+
+from typing import List
+import math
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
@@ -0,0 +1,228 @@
+"""
+Local stand-ins for the Agent Framework and Cosmos DB.
+
+``install()`` must run before ``config``, ``main`` or ``services`` are
+imported: it fills in placeholder Azure settings and registers a fake
+``agent_framework`` package whose ``AzureAIAgentClient`` streams a canned
+answer with a configurable time to first token and token rate.
+``use_in_memory_cosmos()`` then points the Cosmos storage backend (used by
+``STORAGE_BACKEND=cosmos`` and ``tiered``) at ``InMemoryContainer`` instances.
+"""
+
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import os
+import re
+import sys
+import types
+
+# Placeholder settings; nothing connects to them
+_ENVIRONMENT = {
+    "AI_FOUNDRY_PROJECT_ENDPOINT": "https://benchmark.services.ai.azure.com/api/projects/benchmark",
+    "COSMOS_ENDPOINT": "https://benchmark.documents.azure.com:443/",
+    "COSMOS_CONNECTION_STRING": "AccountEndpoint=https://benchmark.documents.azure.com:443/;AccountKey=YmVuY2htYXJr",
+    "AZURE_STORAGE_CONNECTION_STRING": "UseDevelopmentStorage=true",
+    "LOG_LEVEL": "WARNING",
+}
+
+ANSWER = (
+    "## 👟 Great picks for you\n\n"
+    "Based on what's on your screen, here are a few options:\n\n"
+    "- **[Canvas Sneakers](#shoe-004)** — 💰 $59.99, light and breathable for everyday wear\n"
+    "- **[Urban Runner](#shoe-007)** — ✨ 20% off, cushioned sole for long walks\n"
+    "- **[Classic Oxford](#shoe-001)** — a smart option if you need something dressier\n\n"
+    "🎯 I'd start with the Canvas Sneakers: they match your preference for casual styles "
+    "and stay within your budget. Scroll down for more colors.\n\n"
+    "```filters\n{\"category\": \"casual\", \"max_price\": 100, \"sort\": \"price_asc\"}\n```\n"
+)
+
+
+class AgentProfile:
+    """Timing of the fake model, shared by all fake clients."""
+
+    ttft_ms: float = 300.0
+    tokens_per_second: float = 80.0
+    answer: str = ANSWER
+    # Shortest pause between streamed chunks; tokens arriving faster are batched
+    min_chunk_interval_ms: float = 10.0
+
+
+def _tokens(text: str) -> List[str]:
+    """Split text into ~4 character pieces standing in for model tokens."""
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeAzureAIAgentClient:
+    """Accepts the real client's arguments; the agent exists after the first run."""
+
+    def __init__(self, agent_id: Optional[str] = None, **kwargs: Any):
+        self.agent_id = agent_id
+        self.runs = 0
+
+    async def close(self):
+        pass
+
+
+class FakeChatAgent:
+    def __init__(self, chat_client: FakeAzureAIAgentClient, instructions: str = "", **kwargs: Any):
+        self.chat_client = chat_client
+        self.instructions = instructions
+
+    async def run_stream(self, message: str) -> AsyncIterator[FakeChunk]:
+        client = self.chat_client
+        client.runs += 1
+        if client.agent_id is None:
+            client.agent_id = f"fake-agent-{id(client):x}"
+
+        await asyncio.sleep(AgentProfile.ttft_ms / 1000)
+        tokens = _tokens(AgentProfile.answer)
+        per_token = 1 / AgentProfile.tokens_per_second if AgentProfile.tokens_per_second > 0 else 0.0
+        batch = max(1, round(AgentProfile.min_chunk_interval_ms / 1000 / per_token)) if per_token else len(tokens)
+
+        yield FakeChunk(tokens[0])
+        for start in range(1, len(tokens), batch):
+            piece = tokens[start:start + batch]
+            await asyncio.sleep(per_token * len(piece))
+            yield FakeChunk("".join(piece))
+
+
+def install(ttft_ms: Optional[float] = None, tokens_per_second: Optional[float] = None):
+    """Register the fake Agent Framework and placeholder settings."""
+    for name, value in _ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    if ttft_ms is not None:
+        AgentProfile.ttft_ms = ttft_ms
+    if tokens_per_second is not None:
+        AgentProfile.tokens_per_second = tokens_per_second
+
+    package = types.ModuleType("agent_framework")
+    azure = types.ModuleType("agent_framework.azure")
+    package.ChatAgent = FakeChatAgent
+    azure.AzureAIAgentClient = FakeAzureAIAgentClient
+    package.azure = azure
+    sys.modules["agent_framework"] = package
+    sys.modules["agent_framework.azure"] = azure
+
+    # The service imports config relative to its own directory
+    service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if service_dir not in sys.path:
+        sys.path.insert(0, service_dir)
+
+
+_EQUALS = re.compile(r"c\.(\w+)\s*=\s*(@\w+)")
+_ORDER_BY = re.compile(r"ORDER BY c\.(\w+)(?:\s+(ASC|DESC))?", re.IGNORECASE)
+_TOP = re.compile(r"TOP\s+(@\w+|\d+)", re.IGNORECASE)
+
+
+class InMemoryContainer:
+    """
+    The subset of ``azure.cosmos.aio.ContainerProxy`` used by the services.
+
+    Queries support ``TOP``, ``c.field = @param`` conditions joined by AND
+    and a single ``ORDER BY``. Every call waits ``latency_ms`` to stand in
+    for the network round trip.
+    """
+
+    def __init__(self, name: str, partition_key_field: str = "userId", latency_ms: float = 0.0):
+        self.name = name
+        self.partition_key_field = partition_key_field
+        self.latency_ms = latency_ms
+        # partition key -> id -> document
+        self._partitions: Dict[Any, Dict[str, Dict[str, Any]]] = {}
+        self.calls = 0
+
+    def __len__(self) -> int:
+        return sum(len(partition) for partition in self._partitions.values())
+
+    async def _round_trip(self):
+        self.calls += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        else:
+            await asyncio.sleep(0)
+
+    async def read_item(self, item: str, partition_key: Any, **kwargs: Any) -> Dict[str, Any]:
+        await self._round_trip()
+        document = self._partitions.get(partition_key, {}).get(item)
+        if document is None:
+            from azure.cosmos import exceptions
+            raise exceptions.CosmosResourceNotFoundError(message=f"{item} not found")
+        return dict(document)
+
+    async def upsert_item(self, body: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        await self._round_trip()
+        return self._store(body)
+
+    async def create_item(self, body: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        return await self.upsert_item(body)
+
+    async def execute_item_batch(self, batch_operations: List[Tuple], partition_key: Any, **kwargs: Any) -> List[Dict[str, Any]]:
+        await self._round_trip()
+        results = []
+        for operation in batch_operations:
+            kind, args = operation[0], operation[1]
+            if kind not in ("upsert", "create", "replace"):
+                raise ValueError(f"Unsupported batch operation: {kind}")
+            results.append(self._store(args[0]))
+        return results
+
+    def query_items(
+        self,
+        query: str,
+        parameters: Optional[List[Dict[str, Any]]] = None,
+        partition_key: Any = None,
+        **kwargs: Any
+    ) -> AsyncIterator[Dict[str, Any]]:
+        values = {p["name"]: p["value"] for p in parameters or []}
+        conditions = [(field, values.get(param)) for field, param in _EQUALS.findall(query)]
+
+        async def results():
+            await self._round_trip()
+            if partition_key is None:
+                partitions = list(self._partitions.values())
+            else:
+                partitions = [self._partitions.get(partition_key, {})]
+            matches = [
+                document for partition in partitions for document in partition.values()
+                if all(document.get(field) == value for field, value in conditions)
+            ]
+            order = _ORDER_BY.search(query)
+            if order:
+                descending = (order.group(2) or "").upper() == "DESC"
+                matches.sort(key=lambda d: d.get(order.group(1)) or "", reverse=descending)
+            top = _TOP.search(query)
+            if top:
+                limit = top.group(1)
+                matches = matches[:int(values.get(limit, 0) if limit.startswith("@") else limit)]
+            for document in matches:
+                yield dict(document)
+
+        return results()
+
+    def _store(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        document = dict(body)
+        self._partitions.setdefault(document.get(self.partition_key_field), {})[document["id"]] = document
+        return dict(document)
+
+
+def use_in_memory_cosmos(latency_ms: float = 0.0) -> Dict[str, InMemoryContainer]:
+    """Point the Cosmos storage backend at in-memory containers (call after importing it)."""
+    from services import storage
+
+    containers = {
+        "chat-sessions": InMemoryContainer("chat-sessions", "userId", latency_ms),
+        "preferences": InMemoryContainer("preferences", "userId", latency_ms),
+    }
+
+    async def close():
+        pass
+
+    storage.get_container = containers.__getitem__
+    storage.get_cosmos_client = lambda: None
+    storage.close_cosmos_client = close
+    return containers
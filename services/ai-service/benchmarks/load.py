@@ -0,0 +1,177 @@
+"""
+Load benchmark for ``/process-chat``.
+
+Drives the FastAPI app in-process (no sockets) with the fake agent and
+in-memory Cosmos containers, at increasing concurrency and with synthetic
+snapshots of 10, 100 and 1,000 products. Each concurrent client runs chat
+sessions of a few turns, sending its full snapshot with every message as the
+widget does. For each level it reports latency percentiles, throughput and
+event loop lag (how late a 5 ms timer fires while the load runs).
+
+    python -m benchmarks.load
+    python -m benchmarks.load --sizes 1000 --concurrency 1 8 32 --ttft-ms 0 --json results.json
+    STORAGE_BACKEND=tiered python -m benchmarks.load --cosmos-latency-ms 20
+"""
+
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from benchmarks import fakes, percentile
+
+fakes.install()
+
+import httpx  # noqa: E402
+import main  # noqa: E402
+from benchmarks.snapshots import MESSAGES, make_snapshot  # noqa: E402
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic timer fires on the running event loop."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> List[float]:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        return self.lags
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - start - self.interval) * 1000)
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    size: int,
+    concurrency: int,
+    requests: int,
+    turns_per_session: int,
+    use_cache: bool
+) -> Dict[str, Any]:
+    """Send ``requests`` chats from ``concurrency`` clients and summarize them."""
+    snapshot = make_snapshot(size)
+    issued = itertools.count()
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+
+    async def chat_client(worker: int):
+        user_id = f"bench-{size}-{concurrency}-{worker}"
+        session_id = None
+        turn = 0
+        while True:
+            n = next(issued)
+            if n >= requests:
+                return
+            if turn == turns_per_session:
+                session_id, turn = None, 0
+            body = {
+                "user_id": user_id,
+                # Numbered so retries/idempotency never merge distinct requests
+                "message": f"{MESSAGES[n % len(MESSAGES)]} (#{n})",
+                "dom_snapshot": snapshot,
+                "session_id": session_id,
+                "use_cache": use_cache,
+            }
+            start = time.perf_counter()
+            response = await client.post("/process-chat", json=body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                session_id = response.json()["session_id"]
+                turn += 1
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(chat_client(worker) for worker in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    lags = await monitor.stop()
+
+    return {
+        "products": size,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status != 200),
+        "statuses": statuses,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "loop_lag_p50_ms": percentile(lags, 50),
+        "loop_lag_p99_ms": percentile(lags, 99),
+        "loop_lag_max_ms": max(lags, default=0.0),
+    }
+
+
+def print_row(result: Dict[str, Any]):
+    print(
+        f"{result['products']:>8} {result['concurrency']:>5} {result['requests']:>6} {result['errors']:>5}"
+        f" {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}"
+        f" {result['throughput_rps']:>8.1f}"
+        f" {result['loop_lag_p50_ms']:>8.2f} {result['loop_lag_p99_ms']:>8.2f} {result['loop_lag_max_ms']:>8.2f}",
+        flush=True
+    )
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    containers = fakes.use_in_memory_cosmos(args.cosmos_latency_ms)
+    transport = httpx.ASGITransport(app=main.app)
+    results = []
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            print(
+                f"{'products':>8} {'conc':>5} {'reqs':>6} {'errs':>5}"
+                f" {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}"
+                f" {'lag p50':>8} {'lag p99':>8} {'lag max':>8}"
+            )
+            for size in args.sizes:
+                for concurrency in args.concurrency:
+                    requests = args.requests or max(20, concurrency * 4)
+                    result = await run_level(
+                        client, size, concurrency, requests, args.turns_per_session, args.use_cache
+                    )
+                    results.append(result)
+                    print_row(result)
+    print(f"\nStorage: {main.chat_service.storage.stats()}")
+    print("Cosmos calls: " + ", ".join(f"{name}={c.calls}" for name, c in containers.items()))
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Products per snapshot")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64], help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=0, help="Requests per level (default: 4 per client, at least 20)")
+    parser.add_argument("--turns-per-session", type=int, default=4)
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="Fake model time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="Fake model generation speed")
+    parser.add_argument("--cosmos-latency-ms", type=float, default=5.0, help="Simulated Cosmos round trip")
+    parser.add_argument("--use-cache", action="store_true", help="Allow response cache hits")
+    parser.add_argument("--json", help="Write results to this file")
+    return parser.parse_args()
+
+
+def main_cli():
+    args = parse_args()
+    fakes.AgentProfile.ttft_ms = args.ttft_ms
+    fakes.AgentProfile.tokens_per_second = args.tokens_per_second
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
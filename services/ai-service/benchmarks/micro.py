@@ -0,0 +1,154 @@
+"""
+Microbenchmarks for the per-request formatting and parsing hot spots.
+
+- ``DOMSnapshotProvider.get_context`` for 10, 100 and 1,000 products, with a
+  warm product line cache (same provider) and a cold one (new provider)
+- ``ChatService._build_system_prompt`` for a returning user (preference
+  block reused) and for a new preference set per call (block built)
+- ``ChatService._extract_filters`` on answers with and without a filters block,
+  and the one-shot regex it replaced for comparison
+- ``FilterBlockParser`` fed an answer in 4-character chunks, as on the stream
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --min-time 2 --json micro.json
+"""
+
+from typing import Any, Callable, Dict, List
+import argparse
+import asyncio
+import json
+import re
+import time
+
+from benchmarks import fakes, percentile
+
+fakes.install()
+
+from benchmarks.snapshots import make_snapshot  # noqa: E402
+from config import configure_logging, get_settings  # noqa: E402
+from services.chat_service import ChatService  # noqa: E402
+from services.context_provider import DOMSnapshotProvider  # noqa: E402
+from services.filter_parser import FilterBlockParser, validate_filters  # noqa: E402
+
+# The pre-streaming extraction: one regex over the finished message
+_FILTERS_BLOCK = re.compile(r"```filters\s*\n(.*?)\n```", re.DOTALL)
+
+
+def regex_extract(message: str):
+    match = _FILTERS_BLOCK.search(message)
+    filters = validate_filters(json.loads(match.group(1))) if match else None
+    text = re.sub(r"\n{3,}", "\n\n", _FILTERS_BLOCK.sub("", message)).strip()
+    return text, filters
+
+
+def feed_in_chunks(message: str, size: int = 4):
+    parser = FilterBlockParser()
+    for start in range(0, len(message), size):
+        parser.feed(message[start:start + size])
+    parser.close()
+    return parser.text, parser.filters
+
+
+def measure(name: str, call: Callable[[], Any], min_time: float) -> Dict[str, Any]:
+    """Time ``call`` repeatedly for at least ``min_time`` seconds after a warm-up."""
+    for _ in range(3):
+        call()
+    timings: List[float] = []
+    deadline = time.perf_counter() + min_time
+    while time.perf_counter() < deadline or len(timings) < 10:
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    result = {
+        "name": name,
+        "calls": len(timings),
+        "mean_us": sum(timings) / len(timings),
+        "p50_us": percentile(timings, 50),
+        "p99_us": percentile(timings, 99),
+    }
+    print(
+        f"{name:<44} {result['calls']:>8} {result['mean_us']:>11.1f} {result['p50_us']:>11.1f} {result['p99_us']:>11.1f}",
+        flush=True
+    )
+    return result
+
+
+def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    loop = asyncio.new_event_loop()
+    results = []
+    print(f"{'benchmark':<44} {'calls':>8} {'mean us':>11} {'p50 us':>11} {'p99 us':>11}")
+
+    provider = DOMSnapshotProvider()
+    contexts = {}
+    for size in args.sizes:
+        snapshot = make_snapshot(size)
+        contexts[size] = loop.run_until_complete(provider.get_context(snapshot))
+        results.append(measure(
+            f"get_context[{size} products, warm]",
+            lambda: loop.run_until_complete(provider.get_context(snapshot)),
+            args.min_time
+        ))
+        results.append(measure(
+            f"get_context[{size} products, cold]",
+            lambda: loop.run_until_complete(DOMSnapshotProvider().get_context(snapshot)),
+            args.min_time
+        ))
+
+    service = ChatService()
+    preferences = {
+        "userId": "bench-user",
+        "is_b2b": False,
+        "preferred_categories": ["casual", "athletic"],
+        "hidden_categories": ["formal"],
+    }
+    for size in args.sizes:
+        context = contexts[size]
+        results.append(measure(
+            f"_build_system_prompt[{size} products]",
+            lambda: service._build_system_prompt(preferences, context),
+            args.min_time
+        ))
+    # A preference block is memoized by the fields it renders, so a new user
+    # needs preferences no one had before to time building it
+    users = iter(range(10 ** 9))
+
+    def new_user_preferences() -> Dict[str, Any]:
+        n = next(users)
+        return {**preferences, "is_b2b": bool(n % 2), "hidden_categories": ["formal", f"style-{n}"]}
+
+    results.append(measure(
+        f"_build_system_prompt[{args.sizes[-1]} products, new user]",
+        lambda: service._build_system_prompt(new_user_preferences(), context),
+        args.min_time
+    ))
+
+    with_filters = fakes.ANSWER
+    without_filters = fakes.ANSWER.split("```filters")[0]
+    results.append(measure("_extract_filters[with filters]", lambda: service._extract_filters(with_filters), args.min_time))
+    results.append(measure("_extract_filters[no filters]", lambda: service._extract_filters(without_filters), args.min_time))
+    results.append(measure("_extract_filters[regex, with filters]", lambda: regex_extract(with_filters), args.min_time))
+    results.append(measure("FilterBlockParser[4-char chunks]", lambda: feed_in_chunks(with_filters), args.min_time))
+
+    loop.close()
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Products per snapshot")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds to run each benchmark")
+    parser.add_argument("--json", help="Write results to this file")
+    return parser.parse_args()
+
+
+def main_cli():
+    args = parse_args()
+    configure_logging(get_settings().log_level)
+    results = run(args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
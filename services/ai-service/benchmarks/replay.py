@@ -0,0 +1,160 @@
+"""
+Replay captured ``/process-chat`` traffic against a local instance.
+
+Reads the compressed JSONL written by ``services/traffic_capture.py`` and
+re-sends each request at its original offset from the first one, divided by
+``--speed`` (2 replays twice as fast; 0 sends as fast as ``--concurrency``
+allows). Turns of one captured session are sent in order, each continuing
+the session the replayed previous turn created, so delta snapshots apply as
+they did originally. Reports latency percentiles, errors, throughput and how
+far sends fell behind schedule.
+
+    python -m benchmarks.replay /tmp/ai-service-traffic/*.jsonl.gz
+    python -m benchmarks.replay capture.jsonl.gz --url http://localhost:8000 --speed 4
+    python -m benchmarks.replay capture.jsonl.gz --in-process --ttft-ms 300
+"""
+
+from typing import Any, Dict, List, Optional
+import argparse
+import asyncio
+import gzip
+import json
+
+from benchmarks import percentile
+
+
+def load_records(paths: List[str], limit: int = 0) -> List[Dict[str, Any]]:
+    """Captured requests from all files, in arrival order."""
+    records = []
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda record: record["t"])
+    return records[:limit] if limit else records
+
+
+async def replay(client, records: List[Dict[str, Any]], speed: float, concurrency: int) -> Dict[str, Any]:
+    """Send the records, pacing and ordering them as captured."""
+    if not records:
+        return {"requests": 0}
+    first = records[0]["t"]
+    limit = asyncio.Semaphore(concurrency) if concurrency else None
+    # Captured session -> future of the replayed session ID after its latest turn
+    sessions: Dict[str, asyncio.Future] = {}
+    latencies: List[float] = []
+    lateness: List[float] = []
+    statuses: Dict[int, int] = {}
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def send(record: Dict[str, Any], previous: Optional[asyncio.Future], done: asyncio.Future):
+        session_id = None
+        try:
+            if speed:
+                await asyncio.sleep(max(0.0, start + (record["t"] - first) / speed - loop.time()))
+            if previous is not None:
+                session_id = await previous
+            if record["position"] == 0:
+                session_id = None
+            scheduled = start + (record["t"] - first) / speed if speed else loop.time()
+            body = {
+                "user_id": f"replay-{record['user']}",
+                "message": record["message"],
+                "dom_snapshot": record.get("dom_snapshot"),
+                "session_id": session_id,
+                "use_cache": record.get("use_cache", True),
+            }
+            if limit is not None:
+                await limit.acquire()
+            try:
+                sent = loop.time()
+                lateness.append(max(0.0, sent - scheduled) * 1000)
+                response = await client.post("/process-chat", json=body)
+                latencies.append((loop.time() - sent) * 1000)
+            finally:
+                if limit is not None:
+                    limit.release()
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                session_id = response.json().get("session_id")
+        except Exception as e:
+            statuses[0] = statuses.get(0, 0) + 1
+            print(f"Request failed: {e}")
+        finally:
+            done.set_result(session_id)
+
+    tasks = []
+    for record in records:
+        done = loop.create_future()
+        previous = sessions.get(record["session"])
+        sessions[record["session"]] = done
+        tasks.append(send(record, previous, done))
+    await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status != 200),
+        "statuses": statuses,
+        "captured_seconds": records[-1]["t"] - first,
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies, default=0.0),
+        "behind_schedule_p99_ms": percentile(lateness, 99),
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    records = load_records(args.files, args.limit)
+    print(f"Replaying {len(records)} requests from {len(args.files)} file(s) at speed {args.speed or 'max'}")
+
+    if not args.in_process:
+        import httpx
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            return await replay(client, records, args.speed, args.concurrency)
+
+    from benchmarks import fakes
+    fakes.install(args.ttft_ms, args.tokens_per_second)
+    import httpx
+    import main
+    fakes.use_in_memory_cosmos(args.cosmos_latency_ms)
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=args.timeout) as client:
+            return await replay(client, records, args.speed, args.concurrency)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="Captured .jsonl.gz files")
+    parser.add_argument("--url", default="http://localhost:8000", help="AI service to replay against")
+    parser.add_argument("--speed", type=float, default=1.0, help="Arrival rate multiplier (0 = no pacing)")
+    parser.add_argument("--concurrency", type=int, default=0, help="Max requests in flight (0 = unlimited)")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Request timeout in seconds")
+    parser.add_argument("--in-process", action="store_true", help="Replay against the app in-process with the fakes")
+    parser.add_argument("--ttft-ms", type=float, default=300.0, help="Fake model time to first token (--in-process)")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0, help="Fake model speed (--in-process)")
+    parser.add_argument("--cosmos-latency-ms", type=float, default=5.0, help="Simulated Cosmos round trip (--in-process)")
+    parser.add_argument("--json", help="Write the summary to this file")
+    return parser.parse_args()
+
+
+def main_cli():
+    args = parse_args()
+    summary = asyncio.run(run(args))
+    for name, value in summary.items():
+        print(f"{name:>24}: {round(value, 2) if isinstance(value, float) else value}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
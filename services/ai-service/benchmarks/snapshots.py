@@ -0,0 +1,65 @@
+"""
+Synthetic DOM snapshots and chat messages for benchmarks.
+"""
+
+from typing import Any, Dict, List
+import random
+
+CATEGORIES = ("athletic", "casual", "formal", "outdoor", "work")
+STYLES = ("Runner", "Sneaker", "Oxford", "Loafer", "Boot", "Trail Shoe", "Slip-On", "Derby", "Clog", "Sandal")
+MATERIALS = ("Leather", "Canvas", "Suede", "Mesh", "Knit", "Nubuck", "Rubber")
+
+MESSAGES = (
+    "What would you recommend for everyday walking?",
+    "Which of these are good for a wedding?",
+    "I need something waterproof for hiking, any ideas?",
+    "Compare the shoes I can see right now",
+    "Are there comfortable options for standing all day at work?",
+    "What's a good gift for someone who runs marathons?",
+    "Which ones look best with jeans?",
+    "Show me something similar but more breathable",
+)
+
+
+def make_products(count: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """Products shaped like the gateway catalog, with stable random content."""
+    rng = random.Random(seed)
+    products = []
+    for i in range(count):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        name = f"{rng.choice(MATERIALS)} {rng.choice(STYLES)} {i + 1}"
+        products.append({
+            "id": f"bench-{i + 1:04d}",
+            "name": name,
+            "category": category,
+            "price": round(rng.uniform(29, 249), 2),
+            "description": (
+                f"{name} in {category} style with a cushioned footbed, "
+                f"{rng.choice(MATERIALS).lower()} lining and a durable rubber outsole"
+            ),
+            "discount": rng.choice((0, 0, 0, 10, 15, 20, 30)),
+            "b2b_available": rng.random() < 0.6,
+            "b2c_available": True,
+            "in_stock": rng.random() < 0.9,
+            "image": f"/images/bench-{i + 1:04d}.jpg",
+        })
+    return products
+
+
+def make_snapshot(count: int, seed: int = 7) -> Dict[str, Any]:
+    """
+    A full snapshot of ``count`` products.
+
+    A screenful is visible; a third of the rest is above the fold and the
+    remainder below it.
+    """
+    products = make_products(count, seed)
+    visible = min(count, 8)
+    above = (count - visible) // 3
+    return {
+        "page_url": f"https://shop.example.com/products?page_size={count}",
+        "timestamp": "2024-01-01T00:00:00Z",
+        "above_fold_products": products[:above],
+        "visible_products": products[above:above + visible],
+        "below_fold_products": products[above + visible:],
+    }
@@ -1,6 +1,12 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+import atexit
+import json
 import logging
+import queue
+import re
 
 
 # Configure logging to sanitize sensitive data
@@ -10,17 +16,95 @@ class SensitiveDataFilter(logging.Filter):
         'api_key', 'apikey', 'key=', 'password', 'secret', 'token',
         'AccountKey=', 'InstrumentationKey=', 'connection_string'
     ]
+    # One case-insensitive scan instead of lowercasing and searching per pattern
+    SENSITIVE_MATCHER = re.compile("|".join(map(re.escape, SENSITIVE_PATTERNS)), re.IGNORECASE)
     
     def filter(self, record):
-        msg = str(record.msg).lower()
         # Block any log message containing sensitive patterns
-        return not any(pattern.lower() in msg for pattern in self.SENSITIVE_PATTERNS)
+        return not self.SENSITIVE_MATCHER.search(str(record.msg))
 
 
-# Apply filter to all loggers
-logging.basicConfig(level=logging.INFO)
-for handler in logging.root.handlers:
-    handler.addFilter(SensitiveDataFilter())
+# Attributes every LogRecord has; anything else was passed via ``extra``
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as ``key=value`` text or JSON lines, including ``extra`` fields."""
+    
+    def __init__(self, json_lines: bool = False):
+        super().__init__()
+        self.json_lines = json_lines
+    
+    def format(self, record):
+        fields = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        fields.update(
+            (key, value) for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_")
+        )
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            fields["exception"] = record.exc_text
+        if self.json_lines:
+            return json.dumps(fields, default=str)
+        extras = " ".join(f"{key}={value}" for key, value in list(fields.items())[4:])
+        line = f"{fields['time']} {record.levelname} {record.name}: {fields['message']}"
+        return f"{line} {extras}" if extras else line
+
+
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+
+
+def configure_logging(level: str = "INFO", json_lines: bool = False):
+    """
+    Route all logging through a queue so request handlers never block on I/O.
+    
+    Records are put on an in-memory queue by the calling thread; a listener
+    thread filters, formats and writes them to stderr. Calling this again
+    replaces the previous configuration.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+    
+    output = logging.StreamHandler()
+    output.setFormatter(StructuredFormatter(json_lines))
+    output.addFilter(SensitiveDataFilter())
+    
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    _queue_handler = QueueHandler(log_queue)
+    root.addHandler(_queue_handler)
+    root.setLevel(level.upper())
+    
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records, stop the listener thread and log directly from then on."""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener, _queue_handler = None, None
+
+
+# Log through the queue from import time; main.py applies the configured level and format
+configure_logging()
+atexit.register(shutdown_logging)
 
 
 class Settings(BaseSettings):
@@ -28,18 +112,115 @@ class Settings(BaseSettings):
     # Using managed identity authentication (no API key needed)
     ai_foundry_project_endpoint: str
     ai_foundry_model_deployment_name: str = "gpt-4o-mini"
+    # Persistent agent created by scripts/create_persistent_agent.py (optional)
+    ai_foundry_agent_id: str = ""
+    # Number of long-lived agent clients shared across requests
+    agent_pool_size: int = 4
     
-    # Cosmos DB
-    cosmos_endpoint: str
-    cosmos_connection_string: str
+    # Cosmos DB (not needed with the memory or sqlite storage backends)
+    cosmos_endpoint: str = ""
+    cosmos_connection_string: str = ""
     cosmos_database_name: str = "browsing-companion-db"
+    # Size of the shared async connection pool
+    cosmos_max_connections: int = 100
+    
+    # Sessions and preferences storage: "cosmos", "memory", "sqlite" or "tiered"
+    # (SQLite serves active sessions, written through to Cosmos in the background)
+    storage_backend: str = "cosmos"
+    storage_sqlite_path: str = ""
+    storage_local_retention_seconds: int = 86400
+    # Local preference rows older than this are re-read from Cosmos, so updates
+    # made through other replicas show up
+    storage_local_preferences_ttl_seconds: int = 60
     
     # Azure Storage
-    azure_storage_connection_string: str
+    azure_storage_connection_string: str = ""
     
     # Application Insights
     applicationinsights_connection_string: str = ""
     
+    # Per-session DOM snapshot state (enables delta snapshots)
+    snapshot_store_max_sessions: int = 10000
+    snapshot_store_ttl_seconds: int = 1800
+    
+    # Approximate token budget for the page context (0 disables compaction)
+    context_token_budget: int = 4000
+    # Rendered product lines cached across requests (by product ID and content)
+    product_render_cache_size: int = 4096
+    
+    # Answer purely structural questions from the snapshot without the agent
+    fast_path_enabled: bool = True
+    fast_path_min_confidence: float = 0.85
+    
+    # Cache of agent answers keyed by message, page snapshot and preferences
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 1024
+    response_cache_ttl_seconds: int = 300
+    
+    # Write-behind persistence of chat messages
+    write_behind_max_pending: int = 10000
+    write_behind_batch_size: int = 100
+    write_behind_flush_interval_ms: int = 50
+    write_behind_max_retries: int = 5
+    
+    # Conversation history passed to the agent and the per-session cache of it
+    history_max_messages: int = 6
+    history_cache_max_sessions: int = 10000
+    history_cache_max_bytes: int = 67108864
+    history_cache_ttl_seconds: int = 1800
+    
+    # Rolling conversation summaries sent instead of replaying raw history
+    conversation_summary_enabled: bool = True
+    conversation_summary_max_chars: int = 2000
+    conversation_recent_turn_max_chars: int = 1500
+    
+    # Shared preferences cache; users without saved preferences expire sooner
+    preferences_cache_max_entries: int = 50000
+    preferences_cache_ttl_seconds: int = 300
+    preferences_cache_negative_ttl_seconds: int = 60
+    
+    # Deadlines for the stages before the agent call; late stages fall back to defaults
+    preferences_stage_timeout_ms: int = 300
+    history_stage_timeout_ms: int = 300
+    context_stage_timeout_ms: int = 1000
+    
+    # Admission control for agent calls (excess requests get 429 + Retry-After)
+    agent_max_concurrency: int = 32
+    agent_max_queue: int = 128
+    agent_queue_timeout_ms: int = 10000
+    agent_max_per_user: int = 2
+    
+    # Replay window for duplicate (retried) chat requests
+    idempotency_window_seconds: int = 30
+    idempotency_max_entries: int = 10000
+    
+    # Product catalog used to resolve ID-only snapshots ("" = the gateway's
+    # src/data/products.json if checked out, else the bundled data/products.json)
+    product_catalog_path: str = ""
+    product_catalog_reload_seconds: int = 5
+    
+    # Logging (LOG_FORMAT: "text" or "json"); per-product debug lines are sampled
+    log_level: str = "INFO"
+    log_format: str = "text"
+    log_debug_sample_rate: float = 0.01
+    
+    # Request profiling: X-Profile-Token must match the secret ("" disables the
+    # header and the admin endpoints); a sample rate profiles requests at random
+    profile_secret: str = ""
+    profile_sample_rate: float = 0.0
+    profile_interval_ms: float = 5
+    profile_blocking_threshold_ms: float = 20
+    profile_dir: str = ""
+    profile_max_profiles: int = 50
+    
+    # Sampled /process-chat capture for replay load tests (0 disables); IDs are
+    # hashed with the salt (random per process when empty)
+    traffic_capture_sample_rate: float = 0.0
+    traffic_capture_dir: str = ""
+    traffic_capture_salt: str = ""
+    traffic_capture_max_file_mb: int = 100
+    traffic_capture_max_pending: int = 1000
+    
     # Service Configuration
     service_port: int = 8000
     environment: str = "development"
@@ -1,13 +1,37 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
+from services.admission import AdmissionRejected
 from services.chat_service import ChatService, PreferencesService
-from config import get_settings
+from services.metrics import REGISTRY, ServerTimingMiddleware
+from services.profiler import PROFILE_KINDS, RequestProfiler
+from services.snapshot_store import SnapshotResyncRequired
+from services.traffic_capture import TrafficRecorder
+from config import configure_logging, get_settings
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import time
 import uvicorn
 
 settings = get_settings()
-app = FastAPI(title="Browsing Companion AI Service", version="1.0.0")
+configure_logging(settings.log_level, json_lines=settings.log_format == "json")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Tie long-lived service resources to the application lifecycle."""
+    await chat_service.start()
+    try:
+        yield
+    finally:
+        await chat_service.close()
+        await asyncio.to_thread(traffic_recorder.close)
+
+
+app = FastAPI(title="Browsing Companion AI Service", version="1.0.0", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -18,9 +42,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-stage timings of each request as a Server-Timing header
+app.add_middleware(ServerTimingMiddleware)
+
 # Initialize services
 chat_service = ChatService()
 preferences_service = PreferencesService()
+request_profiler = RequestProfiler()
+traffic_recorder = TrafficRecorder()
 
 
 # Request/Response Models
@@ -29,6 +58,10 @@ class ChatRequest(BaseModel):
     message: str
     dom_snapshot: Optional[Dict[str, Any]] = None
     session_id: Optional[str] = None
+    # Set to false to bypass the response cache for this request
+    use_cache: bool = True
+    # Identifies retries of the same request (the Idempotency-Key header also works)
+    idempotency_key: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
@@ -36,6 +69,7 @@ class ChatResponse(BaseModel):
     session_id: str
     timestamp: str
     filters: Optional[Dict[str, Any]] = None
+    snapshot_version: Optional[int] = None
 
 
 class PreferencesRequest(BaseModel):
@@ -66,8 +100,25 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Stage latencies, prompt/response sizes and in-flight gauges in Prometheus text format"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats")
+async def stats():
+    """Runtime counters (prompt prefix reuse, caches)"""
+    return {**chat_service.stats(), "traffic_capture": traffic_recorder.stats()}
+
+
 @app.post("/process-chat", response_model=ChatResponse)
-async def process_chat(request: ChatRequest):
+async def process_chat(
+    request: ChatRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+    x_profile_token: Optional[str] = Header(None)
+):
     """
     Process a chat message with optional DOM snapshot context.
     
@@ -76,19 +127,132 @@ async def process_chat(request: ChatRequest):
     - below_fold_products: List of products below the fold (require scrolling)
     - page_url: Current page URL
     - timestamp: Snapshot timestamp
+    
+    Within a session it may instead be a delta against the snapshot_version
+    returned by the previous response (see services/snapshot_store.py). If the
+    delta can't be applied, a 409 asks the client to resend the full snapshot.
+    
+    When the agent is at capacity the request is rejected with a 429 and a
+    Retry-After header. Retries (same idempotency key, or same session,
+    message and snapshot) share the original request's result.
+    
+    With a valid X-Profile-Token header (or when sampled) the request is
+    profiled and the response carries an X-Profile-Id header; see
+    /admin/profiles.
+    
+    A sample of users' requests is captured for replay when
+    TRAFFIC_CAPTURE_SAMPLE_RATE is set (see services/traffic_capture.py).
     """
+    arrived_at = time.time()
     try:
-        result = await chat_service.process_chat(
-            user_id=request.user_id,
-            message=request.message,
-            dom_snapshot=request.dom_snapshot,
-            session_id=request.session_id
-        )
+        async with request_profiler.profile(x_profile_token, label=request.session_id or "") as profile:
+            if profile is not None:
+                response.headers["X-Profile-Id"] = profile.id
+            result = await chat_service.process_chat(
+                user_id=request.user_id,
+                message=request.message,
+                dom_snapshot=request.dom_snapshot,
+                session_id=request.session_id,
+                use_cache=request.use_cache,
+                idempotency_key=request.idempotency_key or idempotency_key
+            )
+        if traffic_recorder.enabled:
+            traffic_recorder.record(
+                arrived_at, request.user_id, request.message, request.dom_snapshot,
+                result["session_id"], new_session=not request.session_id, use_cache=request.use_cache
+            )
         return ChatResponse(**result)
+    except SnapshotResyncRequired as e:
+        raise HTTPException(status_code=409, detail=chat_service.resync_detail(e))
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/process-chat/stream")
+async def process_chat_stream(request: ChatRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    Stream a chat response as Server-Sent Events.
+    
+    Emits a ``token`` event per text chunk as the model generates it (with the
+    filters block hidden), a ``filters`` event as soon as the filter commands
+    are complete, then a final ``done`` event with the same payload as ``/process-chat``
+    (response, session_id, timestamp and optional filters). Failures are
+    reported as an ``error`` event.
+    
+    The stream opens with the first event, so a delta snapshot that can't be
+    applied still gets a 409 and a request the agent has no capacity for a
+    429 with Retry-After, as on ``/process-chat``. Answers that don't need
+    the agent are never rejected.
+    """
+    events = chat_service.stream_chat(
+        user_id=request.user_id,
+        message=request.message,
+        dom_snapshot=request.dom_snapshot,
+        session_id=request.session_id,
+        use_cache=request.use_cache,
+        idempotency_key=request.idempotency_key or idempotency_key
+    )
+    try:
+        first = await events.__anext__()
+    except SnapshotResyncRequired as e:
+        raise HTTPException(status_code=409, detail=chat_service.resync_detail(e))
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    async def event_stream():
+        try:
+            event = first
+            while True:
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                event = await events.__anext__()
+        except StopAsyncIteration:
+            pass
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/admin/profiles")
+async def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    """Recent request profiles, newest first (requires X-Profile-Token)"""
+    if not request_profiler.authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Profiling is not enabled for this token")
+    return {"profiles": request_profiler.list()}
+
+
+@app.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile(profile_id: str, kind: str = "wall", x_profile_token: Optional[str] = Header(None)):
+    """
+    A profile in collapsed-stack format, for flamegraph.pl or speedscope.
+    
+    ``kind`` is ``wall`` (where the request spent its time) or ``blocking``
+    (stacks that held the event loop past the blocking threshold).
+    """
+    if not request_profiler.authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="Profiling is not enabled for this token")
+    if kind not in PROFILE_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(PROFILE_KINDS)}")
+    folded = request_profiler.read(profile_id, kind)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(folded)
+
+
 @app.get("/preferences/{user_id}", response_model=PreferencesResponse)
 async def get_preferences(user_id: str):
     """Get user preferences"""
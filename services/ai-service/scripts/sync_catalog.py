@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Regenerate data/products.json from the API gateway's catalog.
+
+The gateway's src/data/products.json is the source of truth; the AI service
+bundles a copy only because its Docker build context can't reach the gateway.
+Run this after editing the gateway's catalog, or with --check to fail when
+the copy is out of date.
+
+    python scripts/sync_catalog.py
+    python scripts/sync_catalog.py --check
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+GATEWAY_CATALOG = SERVICE_DIR.parent / "api-gateway" / "src" / "data" / "products.json"
+BUNDLED_CATALOG = SERVICE_DIR / "data" / "products.json"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="Only report whether the copy is up to date")
+    args = parser.parse_args()
+
+    source = GATEWAY_CATALOG.read_text(encoding="utf-8")
+    json.loads(source)
+    current = BUNDLED_CATALOG.read_text(encoding="utf-8") if BUNDLED_CATALOG.exists() else None
+
+    if current == source:
+        print(f"{BUNDLED_CATALOG} is up to date")
+        return 0
+    if args.check:
+        print(f"{BUNDLED_CATALOG} differs from {GATEWAY_CATALOG}; run scripts/sync_catalog.py", file=sys.stderr)
+        return 1
+    BUNDLED_CATALOG.write_text(source, encoding="utf-8")
+    print(f"Wrote {BUNDLED_CATALOG}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Admission control for agent (model) calls.
+
+Without a limit, a traffic spike sends every request to the model endpoint at
+once, the endpoint throttles and latency collapses for everyone.
+``AdmissionController`` caps concurrent agent runs, queues a bounded number of
+waiters in FIFO order with a queue-time deadline, limits how many runs (active
+or queued) a single user may hold, and rejects everything else immediately
+with an estimated ``Retry-After``.
+"""
+
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+from config import get_settings
+import asyncio
+import math
+import time
+
+settings = get_settings()
+
+
+class AdmissionRejected(Exception):
+    """Raised when an agent call cannot be admitted; maps to HTTP 429."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Global concurrency limit with a bounded FIFO wait queue and per-user limits."""
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout_ms: Optional[int] = None,
+        max_per_user: Optional[int] = None
+    ):
+        self.max_concurrency = max_concurrency or settings.agent_max_concurrency
+        self.max_queue = settings.agent_max_queue if max_queue is None else max_queue
+        self.queue_timeout = (queue_timeout_ms or settings.agent_queue_timeout_ms) / 1000
+        self.max_per_user = max_per_user or settings.agent_max_per_user
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._per_user: Dict[str, int] = {}
+        # Moving average of how long a slot is held, for Retry-After estimates
+        self._avg_hold = 5.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def check(self, user_id: str):
+        """
+        Reject up front if the user or the queue is already at its limit.
+
+        Raises:
+            AdmissionRejected: If a slot request would be rejected right now
+        """
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            self.rejected += 1
+            raise AdmissionRejected("Too many concurrent requests for this user", self.retry_after())
+        if self.active >= self.max_concurrency and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected("Chat service is at capacity", self.retry_after())
+
+    def admit(self, user_id: str) -> "AdmissionTicket":
+        """
+        Check the limits and count the request against its user.
+
+        The user's count is held from here, before any slow preparation,
+        until the ticket is closed, so concurrent requests can't all pass
+        the per-user check before any of them reaches ``slot``.
+
+        Raises:
+            AdmissionRejected: If the user or the queue is at its limit
+        """
+        self.check(user_id)
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        return AdmissionTicket(self, user_id)
+
+    @asynccontextmanager
+    async def slot(self, user_id: str):
+        """Hold one agent-call slot for the duration of the block."""
+        ticket = self.admit(user_id)
+        try:
+            async with ticket.slot():
+                yield
+        finally:
+            ticket.close()
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up for a new request."""
+        estimate = (self.waiting + 1) * self._avg_hold / self.max_concurrency
+        return max(1, math.ceil(estimate))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self._total_wait / self.admitted * 1000, 2) if self.admitted else 0.0,
+            "max_wait_ms": round(self._max_wait * 1000, 2),
+        }
+
+    async def _acquire(self):
+        start = time.monotonic()
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+        elif self.waiting >= self.max_queue:
+            # The queue filled up while this request was being prepared
+            self.rejected += 1
+            raise AdmissionRejected("Chat service is at capacity", self.retry_after())
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over just as we gave up; pass it on
+                    self._release()
+                else:
+                    waiter.cancel()
+                    self._waiters.remove(waiter)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.timed_out += 1
+                raise AdmissionRejected("Timed out waiting for the chat service", self.retry_after())
+        waited = time.monotonic() - start
+        self.admitted += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+    def _leave(self, user_id: str):
+        remaining = self._per_user[user_id] - 1
+        if remaining:
+            self._per_user[user_id] = remaining
+        else:
+            del self._per_user[user_id]
+
+    def _release(self):
+        # Hand the slot straight to the next waiter so it can't be overtaken
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class AdmissionTicket:
+    """An admitted request; ``close`` must be called once it is finished."""
+
+    def __init__(self, controller: AdmissionController, user_id: str):
+        self.controller = controller
+        self.user_id = user_id
+        self.closed = False
+
+    @asynccontextmanager
+    async def slot(self):
+        """Wait for an agent-call slot and hold it for the duration of the block."""
+        controller = self.controller
+        await controller._acquire()
+        held_since = time.monotonic()
+        try:
+            yield
+        finally:
+            controller._avg_hold = 0.9 * controller._avg_hold + 0.1 * (time.monotonic() - held_since)
+            controller._release()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.controller._leave(self.user_id)
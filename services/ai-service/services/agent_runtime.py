@@ -0,0 +1,140 @@
+"""
+Long-lived agent runtime for the chat service.
+
+Creating an ``AzureAIAgentClient`` and ``ChatAgent`` per message repeats the
+agent setup and connection handshakes before the first token. The runtime keeps
+a small pool of chat clients for the lifetime of the app and hands out
+lightweight ``ChatAgent`` wrappers that carry per-request instructions.
+"""
+
+from typing import AsyncIterator, Dict, List, Optional
+from azure.identity.aio import DefaultAzureCredential
+from agent_framework import ChatAgent
+from agent_framework.azure import AzureAIAgentClient
+from config import get_settings
+import asyncio
+import itertools
+import logging
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+AGENT_NAME = "BrowsingCompanionAgent"
+
+
+class AgentRuntime:
+    """
+    Pool of Agent Framework chat clients shared by all chat requests.
+
+    Two modes are supported:
+    - Persistent: when ``AI_FOUNDRY_AGENT_ID`` is set, every client binds to the
+      agent created by ``scripts/create_persistent_agent.py`` and never deletes it.
+    - Ephemeral: otherwise each client creates one agent on its first run,
+      reuses it for every following run and deletes it on shutdown.
+
+    In both modes the per-request system prompt is sent as run-level
+    instructions, so the agent definition itself never changes between requests.
+    """
+
+    def __init__(self, pool_size: Optional[int] = None, agent_id: Optional[str] = None):
+        self.pool_size = max(1, pool_size or settings.agent_pool_size)
+        self.agent_id = agent_id if agent_id is not None else settings.ai_foundry_agent_id
+        self._credential = None
+        self._clients: List[AzureAIAgentClient] = []
+        self._cycle = None
+        # Per pooled client: held while its first run creates the ephemeral agent
+        self._create_locks: Dict[int, asyncio.Lock] = {}
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def persistent(self) -> bool:
+        """Whether the runtime binds to a pre-created persistent agent."""
+        return bool(self.agent_id)
+
+    @property
+    def started(self) -> bool:
+        return bool(self._clients)
+
+    @property
+    def credential(self):
+        """Lazy initialization of Azure credential."""
+        if self._credential is None:
+            self._credential = DefaultAzureCredential()
+        return self._credential
+
+    async def start(self):
+        """Create the client pool. Safe to call more than once."""
+        async with self._start_lock:
+            if self._clients:
+                return
+            self._clients = [self._create_client() for _ in range(self.pool_size)]
+            self._create_locks = {id(client): asyncio.Lock() for client in self._clients}
+            self._cycle = itertools.cycle(self._clients)
+
+    async def close(self):
+        """Close all pooled clients (deleting ephemeral agents) and the credential."""
+        clients, self._clients, self._cycle = self._clients, [], None
+        self._create_locks = {}
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning("Error closing agent client: %s", e)
+        if self._credential is not None:
+            await self._credential.close()
+            self._credential = None
+
+    def _create_client(self) -> AzureAIAgentClient:
+        kwargs = {}
+        if self.persistent:
+            kwargs["agent_id"] = self.agent_id
+        return AzureAIAgentClient(
+            project_endpoint=settings.ai_foundry_project_endpoint,
+            model_deployment_name=settings.ai_foundry_model_deployment_name,
+            async_credential=self.credential,
+            agent_name=AGENT_NAME,
+            **kwargs,
+        )
+
+    async def agent(self, instructions: str) -> ChatAgent:
+        """
+        Get an agent bound to a pooled client with per-request instructions.
+
+        ``ChatAgent`` is a thin wrapper; it is deliberately not entered with
+        ``async with`` so the shared client stays open after the request.
+        """
+        if not self._clients:
+            await self.start()
+        return ChatAgent(chat_client=next(self._cycle), instructions=instructions)
+
+    async def run_stream(self, message: str, instructions: str) -> AsyncIterator[str]:
+        """Run the agent on a message and yield response text chunks as they arrive."""
+        agent = await self.agent(instructions)
+        client = agent.chat_client
+
+        # In ephemeral mode the first run on a client creates its agent. Other
+        # runs on the same client wait until the agent ID is known, so concurrent
+        # first requests don't each create (and leak) one; other clients don't wait.
+        if client.agent_id is None:
+            lock = self._create_locks.setdefault(id(client), asyncio.Lock())
+            await lock.acquire()
+            held = True
+            try:
+                if client.agent_id is not None:
+                    lock.release()
+                    held = False
+                else:
+                    async for chunk in agent.run_stream(message):
+                        if held and client.agent_id is not None:
+                            lock.release()
+                            held = False
+                        if chunk.text:
+                            yield chunk.text
+                    return
+            finally:
+                if held:
+                    lock.release()
+
+        async for chunk in agent.run_stream(message):
+            if chunk.text:
+                yield chunk.text
@@ -0,0 +1,175 @@
+"""
+Server-side product catalog.
+
+Products are a known, mostly static dataset (the gateway serves the same
+``products.json``), yet every DOM snapshot used to repeat each product's name,
+category, price, discount and description. The catalog is loaded at startup
+into slotted records indexed by ID, so snapshots may list just product IDs
+per zone:
+
+    {"visible_products": ["shoe-004", "shoe-007"], "below_fold_products": ["shoe-012"]}
+
+Entries may also be dicts; an entry with only an ``id`` (plus e.g.
+``position``) is completed from the catalog, and any fields the client does
+send take precedence. The file is re-read when its modification time changes.
+
+The gateway's ``src/data/products.json`` is the only hand-edited catalog. In a
+repository checkout the service reads it directly; the Docker image, whose
+build context is this service alone, uses the copy in ``data/products.json``
+that ``scripts/sync_catalog.py`` generates from it.
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Union
+from config import get_settings
+import json
+import os
+import time
+import logging
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GATEWAY_CATALOG_PATH = os.path.join(_SERVICE_DIR, "..", "api-gateway", "src", "data", "products.json")
+# Generated by scripts/sync_catalog.py; do not edit by hand
+BUNDLED_CATALOG_PATH = os.path.join(_SERVICE_DIR, "data", "products.json")
+
+ProductEntry = Union[str, Dict[str, Any]]
+
+
+def default_catalog_path() -> str:
+    """The gateway's catalog when it is checked out, else the bundled copy."""
+    return GATEWAY_CATALOG_PATH if os.path.exists(GATEWAY_CATALOG_PATH) else BUNDLED_CATALOG_PATH
+
+
+class ProductRecord:
+    """One catalog product."""
+
+    __slots__ = (
+        "id", "name", "category", "price", "description", "discount",
+        "b2b_available", "b2c_available", "in_stock", "image", "_dict"
+    )
+
+    def __init__(self, data: Dict[str, Any]):
+        self.id = str(data["id"])
+        self.name = data.get("name", "Unknown Product")
+        self.category = data.get("category", "")
+        # Numbers are kept as in the file so they format like client-sent values
+        self.price = data.get("price", 0)
+        self.description = data.get("description", "")
+        self.discount = data.get("discount", 0)
+        self.b2b_available = bool(data.get("b2b_available", True))
+        self.b2c_available = bool(data.get("b2c_available", True))
+        self.in_stock = bool(data.get("in_stock", True))
+        self.image = data.get("image")
+        self._dict: Optional[Dict[str, Any]] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Snapshot-format dict for the product (shared; treat as read-only)."""
+        if self._dict is None:
+            self._dict = {
+                "id": self.id,
+                "name": self.name,
+                "category": self.category,
+                "price": self.price,
+                "description": self.description,
+                "discount": self.discount,
+                "b2b_available": self.b2b_available,
+                "b2c_available": self.b2c_available,
+                "in_stock": self.in_stock,
+                "image": self.image,
+            }
+        return self._dict
+
+
+class ProductCatalog:
+    """Products by ID, reloaded when the catalog file changes."""
+
+    def __init__(self, path: Optional[str] = None, reload_interval: Optional[float] = None):
+        self.path = os.path.normpath(path or settings.product_catalog_path or default_catalog_path())
+        self.reload_interval = (
+            settings.product_catalog_reload_seconds if reload_interval is None else reload_interval
+        )
+        self._records: Dict[str, ProductRecord] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.unresolved = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def load(self):
+        """(Re)load the catalog file; a missing or invalid file keeps the current records."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, "r", encoding="utf-8") as f:
+                products = json.load(f)
+            records = {}
+            for product in products:
+                record = ProductRecord(product)
+                records[record.id] = record
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error("Error loading product catalog from %s: %s", self.path, e)
+            return
+        self._records = records
+        self._mtime = mtime
+        self._checked_at = time.monotonic()
+        logger.info("Loaded product catalog", extra={"products": len(records)})
+
+    def maybe_reload(self):
+        """Reload if the file changed; checks at most once per reload interval."""
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    def get(self, product_id: str) -> Optional[ProductRecord]:
+        return self._records.get(str(product_id))
+
+    def resolve(self, entry: ProductEntry) -> Optional[Dict[str, Any]]:
+        """
+        Complete a snapshot product entry from the catalog.
+
+        Returns:
+            The product dict, or None for an ID the catalog doesn't know
+        """
+        if isinstance(entry, dict):
+            record = self._records.get(str(entry.get("id")))
+            if record is None or ("name" in entry and "price" in entry):
+                # Full entries are used as sent
+                return entry
+            return {**record.as_dict(), **entry}
+
+        record = self._records.get(str(entry))
+        if record is None:
+            self.unresolved += 1
+            return None
+        return record.as_dict()
+
+    def resolve_all(self, entries: Iterable[ProductEntry]) -> List[Dict[str, Any]]:
+        """Resolve a zone's entries, dropping unknown IDs."""
+        self.maybe_reload()
+        resolved = []
+        for entry in entries:
+            product = self.resolve(entry)
+            if product is not None:
+                resolved.append(product)
+        return resolved
+
+    def stats(self) -> Dict[str, Any]:
+        return {"products": len(self._records), "unresolved": self.unresolved}
+
+
+@lru_cache()
+def get_catalog() -> ProductCatalog:
+    """Get the process-wide product catalog, loading it on first use."""
+    catalog = ProductCatalog()
+    catalog.load()
+    return catalog
@@ -5,19 +5,79 @@ This service provides AI-powered chat capabilities for the Browsing Companion
 application using Microsoft Foundry (Azure AI Foundry) with the Agent Framework SDK.
 """
 
-from typing import Dict, Any, List, Optional
-from azure.cosmos import CosmosClient, exceptions
-from azure.identity.aio import DefaultAzureCredential
-from agent_framework import ChatAgent
-from agent_framework.azure import AzureAIAgentClient
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
 from config import get_settings
-from services.context_provider import DOMSnapshotProvider
-import json
+from services.admission import AdmissionController
+from services.agent_runtime import AgentRuntime
+from services.catalog import get_catalog
+from services.context_provider import DOMSnapshotProvider, estimate_tokens
+from services.fast_path import FastPathResponder
+from services.conversation_summary import (
+    ConversationSummarizer, ConversationSummary, summary_document_id
+)
+from services.filter_parser import FilterBlockParser
+from services.idempotency import IdempotencyRegistry, idempotency_key as make_idempotency_key
+from services.history_cache import HistoryCache, history_fingerprint
+from services.metrics import (
+    AGENT_CALLS_IN_FLIGHT, PROMPT_CHARS, PROMPT_TOKENS, REQUEST_SECONDS, REQUESTS_IN_FLIGHT,
+    RESPONSE_CHARS, RESPONSE_TOKENS, record_stage, timed_stage
+)
+from services.preferences_cache import default_preferences, get_preferences_cache
+from services.prompts import SystemPromptBuilder, preferences_fingerprint
+from services.response_cache import ResponseCache, cache_key
+from services.snapshot_index import SnapshotIndex, parse_query
+from services.storage import get_storage
+from services.snapshot_store import SnapshotStore, SnapshotResyncRequired
+from services.write_behind import WriteBehindQueue
 import uuid
 import asyncio
+import time
+import logging
 from datetime import datetime
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class ChatTurn:
+    """State of one chat turn as it moves from the request to the agent."""
+    
+    __slots__ = (
+        "user_id", "message", "session_id", "is_new_session", "snapshot", "snapshot_version",
+        "index", "fingerprint", "context", "page", "query", "preferences", "history", "summary", "cache_key", "system_prompt", "agent_input",
+        "admission", "timings", "degraded", "answered_by"
+    )
+    
+    def __init__(self, user_id: str, message: str, session_id: Optional[str]):
+        self.user_id = user_id
+        self.message = message
+        self.is_new_session = not session_id
+        self.session_id = session_id or str(uuid.uuid4())
+        # Session snapshot state and the constraints parsed from the message
+        self.snapshot = None
+        self.query = None
+        # The snapshot as of this turn; the session state changes in place
+        # when another request for the session applies its snapshot
+        self.snapshot_version = None
+        self.index = None
+        self.fingerprint = ""
+        self.context = None
+        self.page = None
+        # User preferences, prior messages and the response cache key this turn has claimed
+        self.preferences = None
+        self.history = None
+        self.summary = None
+        self.cache_key = None
+        # Admission ticket of a turn that calls the agent
+        self.admission = None
+        # Filled in by ChatService._prepare_turn
+        self.system_prompt = ""
+        self.agent_input = message
+        # Milliseconds per pre-model stage, and stages that fell back to defaults
+        self.timings: Dict[str, float] = {}
+        self.degraded: List[str] = []
+        # "fast_path", "cache" or "agent"
+        self.answered_by = "agent"
 
 
 class ChatService:
@@ -28,127 +88,688 @@ class ChatService:
     """
     
     def __init__(self):
-        # Azure credential for managed identity
-        self._credential = None
+        # Long-lived agent clients shared across requests
+        self.agent_runtime = AgentRuntime()
         
-        # Initialize Cosmos DB client
-        self.cosmos_client = CosmosClient.from_connection_string(
-            settings.cosmos_connection_string
-        )
-        self.database = self.cosmos_client.get_database_client(settings.cosmos_database_name)
-        self.chat_container = self.database.get_container_client("chat-sessions")
-        self.preferences_container = self.database.get_container_client("preferences")
+        # Bounds concurrent agent calls, queueing and per-user usage
+        self.admission = AdmissionController()
         
         # Initialize context provider
         self.context_provider = DOMSnapshotProvider()
+        
+        # Last DOM snapshot per session, so clients can send deltas
+        self.snapshot_store = SnapshotStore()
+        
+        # Local answers for purely structural questions
+        self.fast_path = FastPathResponder()
+        
+        # Static-prefix system prompt layout with memoized preference blocks
+        self.prompt_builder = SystemPromptBuilder()
+        
+        # Retried requests share or replay the original request's result
+        self.idempotency = IdempotencyRegistry()
+        
+        # Agent answers keyed by message, page snapshot and preferences
+        self.response_cache = ResponseCache()
+        
+        # Preferences cache shared with PreferencesService
+        self.preferences_cache = get_preferences_cache()
+        
+        # Newest messages of active sessions, kept current by store_message
+        self.history_cache = HistoryCache()
+        
+        # Rolling per-session summaries, updated after each turn
+        self.summarizer = ConversationSummarizer()
+        
+        # Sessions and preferences storage (STORAGE_BACKEND)
+        self.storage = get_storage()
+        
+        # Messages are written to storage in batches off the request path
+        self.message_writer = WriteBehindQueue(self._write_messages, partition_key_field="userId")
+        
+        # Pre-model stage timings: name -> [count, total_ms, max_ms, degraded]
+        self._stage_stats: Dict[str, List[float]] = {}
+        
+        # Background work (e.g. persistence after a stream closes)
+        self._background_tasks = set()
+    
+    async def start(self):
+        """Warm up long-lived resources at application startup."""
+        await self.agent_runtime.start()
+        self.message_writer.start()
+        # Load the product catalog before the first ID-only snapshot arrives
+        catalog = get_catalog()
+        if not len(catalog):
+            logger.error(
+                "Product catalog %s is empty or missing; ID-only snapshots will resolve to no products",
+                catalog.path
+            )
+        # Open storage connections (e.g. the Cosmos pool) on the app's event loop
+        await self.storage.start()
     
-    @property
-    def credential(self):
-        """Lazy initialization of Azure credential."""
-        if self._credential is None:
-            self._credential = DefaultAzureCredential()
-        return self._credential
+    async def close(self):
+        """Release long-lived resources at application shutdown."""
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        # Drain queued messages while storage is still open
+        await self.message_writer.close()
+        await self.agent_runtime.close()
+        await self.storage.close()
     
     async def process_chat(
         self,
         user_id: str,
         message: str,
         dom_snapshot: Optional[Dict[str, Any]] = None,
-        session_id: Optional[str] = None
+        session_id: Optional[str] = None,
+        use_cache: bool = True,
+        idempotency_key: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Process a chat message with optional DOM context using Microsoft Agent Framework.
         
+        Structural questions that the snapshot can answer exactly (e.g.
+        "cheapest casual shoes") are answered locally without calling the agent,
+        and repeated questions about the same page are served from the
+        response cache. A retry of a request that is still running or finished
+        within the idempotency window gets the original result and is not
+        stored again.
+        
         Args:
             user_id: User identifier
             message: User's chat message
             dom_snapshot: Optional DOM snapshot data
             session_id: Optional session ID for conversation history
+            use_cache: Whether the response cache may be used for this request
+            idempotency_key: Optional client key identifying retries of one request
         
         Returns:
             Dictionary containing AI response and session info
+        
+        Raises:
+            SnapshotResyncRequired: If dom_snapshot is a delta that no longer
+                applies and the client has to send a full snapshot
+            AdmissionRejected: If the agent is at capacity for this request
         """
-        # Get user preferences
-        user_preferences = await self.get_user_preferences(user_id)
+        key = make_idempotency_key(user_id, message, session_id, dom_snapshot, idempotency_key)
+        with REQUESTS_IN_FLIGHT.track(endpoint="process_chat"):
+            return await self.idempotency.run(
+                key,
+                lambda: self._process_chat(user_id, message, dom_snapshot, session_id, use_cache)
+            )
+    
+    async def _process_chat(
+        self,
+        user_id: str,
+        message: str,
+        dom_snapshot: Optional[Dict[str, Any]],
+        session_id: Optional[str],
+        use_cache: bool
+    ) -> Dict[str, Any]:
+        start = time.perf_counter()
+        turn, result = await self._begin_turn(user_id, message, dom_snapshot, session_id, use_cache)
         
-        # Extract DOM context if available
-        dom_context = ""
-        if dom_snapshot:
-            dom_context = await self.context_provider.get_context(dom_snapshot)
+        if result is None:
+            try:
+                await self._prepare_turn(turn)
+                
+                async with turn.admission.slot():
+                    try:
+                        # Use the pooled Microsoft Agent Framework runtime; the system
+                        # prompt is passed as run-level instructions. The filters block
+                        # is split from the visible text as chunks arrive.
+                        parser = FilterBlockParser()
+                        async for _ in self._generate(turn, parser):
+                            pass
+                    except Exception as e:
+                        raise Exception(f"Error calling Microsoft Agent Framework: {str(e)}")
+                
+                logger.debug(
+                    "Agent response: %.200s",
+                    parser.text,
+                    extra={"session_id": turn.session_id, "chars": len(parser.text)}
+                )
+                
+                self._fill_cache(turn, parser.text, parser.filters)
+            finally:
+                self._end_turn(turn)
+            
+            result = self._build_result(turn, parser.text, parser.filters)
         
-        # Build system prompt with context
-        system_prompt = self._build_system_prompt(user_preferences, dom_context)
+        # Store conversation (cache hits too, so history stays consistent)
+        await self._persist_turn(turn, result["response"], result.get("filters"))
+        
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="process_chat", answered_by=turn.answered_by)
+        return result
+    
+    async def stream_chat(
+        self,
+        user_id: str,
+        message: str,
+        dom_snapshot: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+        use_cache: bool = True,
+        idempotency_key: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a chat response as events while the agent generates it.
         
-        # Get conversation history if session exists
-        conversation_history = []
-        if session_id:
-            conversation_history = await self.get_conversation_history(session_id)
+        Yields ``{"event": "token", "data": {"text": ...}}`` for each chunk of
+        user-visible text, a ``filters`` event as soon as the agent's filters
+        block is complete, and finishes with a ``done`` event carrying the same
+        payload as ``process_chat``. The conversation is persisted in the background once
+        the final event has been sent, so the stream closes without waiting on
+        database writes.
         
-        # Build the full conversation for the agent
-        full_message = self._build_conversation_message(message, conversation_history)
+        A retry of a request that is still running or finished within the
+        idempotency window replays the original result instead of running
+        again; a retry that arrives while the original is running waits for
+        it to finish.
         
+        Raises:
+            SnapshotResyncRequired: Before the first event, as in ``process_chat``
+            AdmissionRejected: Before the first event, as in ``process_chat``
+        """
+        key = make_idempotency_key(user_id, message, session_id, dom_snapshot, idempotency_key)
+        replay = await self.idempotency.join(key)
+        if replay is not None:
+            yield {"event": "token", "data": {"text": replay["response"]}}
+            if replay.get("filters"):
+                yield {"event": "filters", "data": replay["filters"]}
+            yield {"event": "done", "data": replay}
+            return
+        
+        future = self.idempotency.start(key)
         try:
-            # Use Microsoft Agent Framework with Azure AI Foundry
-            async with ChatAgent(
-                chat_client=AzureAIAgentClient(
-                    project_endpoint=settings.ai_foundry_project_endpoint,
-                    model_deployment_name=settings.ai_foundry_model_deployment_name,
-                    async_credential=self.credential,
-                    agent_name="BrowsingCompanionAgent",
-                ),
-                instructions=system_prompt,
-            ) as agent:
-                # Get response using streaming for better UX
-                response_text = ""
-                async for chunk in agent.run_stream(full_message):
-                    if chunk.text:
-                        response_text += chunk.text
+            with REQUESTS_IN_FLIGHT.track(endpoint="stream_chat"):
+                async for event in self._stream_chat(user_id, message, dom_snapshot, session_id, use_cache):
+                    if event["event"] == "done":
+                        self.idempotency.finish(key, future, event["data"])
+                    yield event
+        except Exception as e:
+            self.idempotency.finish(key, future, error=e)
+            raise
+        finally:
+            # Without a result (error event, client gone) duplicates run themselves
+            self.idempotency.finish(key, future)
+    
+    async def _stream_chat(
+        self,
+        user_id: str,
+        message: str,
+        dom_snapshot: Optional[Dict[str, Any]],
+        session_id: Optional[str],
+        use_cache: bool
+    ) -> AsyncIterator[Dict[str, Any]]:
+        start = time.perf_counter()
+        turn, result = await self._begin_turn(user_id, message, dom_snapshot, session_id, use_cache)
+        
+        if result is not None:
+            yield {"event": "token", "data": {"text": result["response"]}}
+            if result.get("filters"):
+                yield {"event": "filters", "data": result["filters"]}
+        else:
+            try:
+                await self._prepare_turn(turn)
+                async with turn.admission.slot():
+                    parser = FilterBlockParser()
+                    try:
+                        async for parsed in self._generate(turn, parser):
+                            for event in self._stream_events(parsed):
+                                yield event
+                    except Exception as e:
+                        yield {"event": "error", "data": {"detail": f"Error calling Microsoft Agent Framework: {str(e)}"}}
+                        return
                 
-                assistant_message = response_text
-            
-            # Debug logging
-            print(f"Agent Response: {assistant_message[:200]}...")
-            
-            # Parse filter commands from response
-            filters = self._extract_filters(assistant_message)
-            
-            # Remove the filters JSON block from the user-facing response
-            clean_response = self._remove_filters_block(assistant_message)
-            
-            # Store conversation
-            if not session_id:
-                session_id = str(uuid.uuid4())
-            
-            await self.store_message(session_id, user_id, "user", message)
-            await self.store_message(session_id, user_id, "assistant", clean_response)
-            
-            result = {
-                "response": clean_response,
-                "session_id": session_id,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-            # Add filters if found
-            if filters:
-                result["filters"] = filters
-            
-            return result
+                self._fill_cache(turn, parser.text, parser.filters)
+            finally:
+                self._end_turn(turn)
             
+            result = self._build_result(turn, parser.text, parser.filters)
+        
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="stream_chat", answered_by=turn.answered_by)
+        # Persist before the last yield: the client may disconnect there
+        self._spawn(self._persist_turn(turn, result["response"], result.get("filters")))
+        yield {"event": "done", "data": result}
+    
+    async def _begin_turn(
+        self,
+        user_id: str,
+        message: str,
+        dom_snapshot: Optional[Dict[str, Any]],
+        session_id: Optional[str],
+        use_cache: bool
+    ) -> Tuple[ChatTurn, Optional[Dict[str, Any]]]:
+        """
+        Start a turn and answer it without the agent when possible.
+        
+        Returns the turn and, if it was answered locally or from the response
+        cache, its result. Otherwise the turn holds an admission ticket and
+        possibly a response cache claim, both released by ``_end_turn``.
+        
+        Only turns that need the agent go through admission control, and the
+        turn's snapshot is committed to the session only once the turn is
+        answered or admitted, so a rejected delta can be resent unchanged.
+        
+        Raises:
+            SnapshotResyncRequired: If the delta snapshot no longer applies
+            AdmissionRejected: If the turn needs the agent and it is at capacity
+        """
+        turn = self._start_turn(user_id, message, dom_snapshot, session_id)
+        try:
+            answer = await self._answer_locally(turn)
+            if answer is None:
+                answer = await self._lookup_cache(turn, use_cache)
+            if answer is None:
+                turn.admission = self.admission.admit(turn.user_id)
+            self._commit_snapshot(turn)
+        except BaseException:
+            self._end_turn(turn)
+            raise
+        
+        if answer is None:
+            return turn, None
+        return turn, self._build_result(turn, answer["response"], answer.get("filters"))
+    
+    def _start_turn(
+        self,
+        user_id: str,
+        message: str,
+        dom_snapshot: Optional[Dict[str, Any]],
+        session_id: Optional[str]
+    ) -> ChatTurn:
+        """
+        Resolve the session and its DOM snapshot for a new turn.
+        
+        Deltas are applied against the session's last snapshot; the query
+        index is rebuilt only when the snapshot changed. The result is staged
+        and only becomes the session's snapshot in ``_commit_snapshot``.
+        """
+        turn = ChatTurn(user_id, message, session_id)
+        
+        if turn.is_new_session:
+            # The session's whole history will pass through store_message
+            turn.history = []
+            self.history_cache.seed(turn.session_id, [])
+            turn.summary = ConversationSummary()
+        
+        if dom_snapshot:
+            with timed_stage("snapshot"):
+                state = self.snapshot_store.stage(turn.session_id, dom_snapshot)
+                # The page is materialized once here if the index or context
+                # still has to be built for this version
+                page = state.to_snapshot() if state.index is None or state.context is None else None
+                if state.index is None:
+                    state.index = SnapshotIndex.from_snapshot(page)
+                turn.snapshot = state
+                turn.snapshot_version = state.version
+                turn.index = state.index
+                turn.fingerprint = state.fingerprint
+                turn.context = state.context
+                turn.page = page
+                turn.query = parse_query(message, turn.index.categories)
+        
+        return turn
+    
+    def _commit_snapshot(self, turn: ChatTurn):
+        """Make the turn's staged snapshot the session's current snapshot."""
+        if turn.snapshot is not None:
+            self.snapshot_store.commit(turn.session_id, turn.snapshot)
+            # A full snapshot may be renumbered past one committed meanwhile
+            turn.snapshot_version = turn.snapshot.version
+    
+    def _end_turn(self, turn: ChatTurn):
+        """Release the turn's response cache claim and admission ticket."""
+        self._release_cache(turn)
+        if turn.admission is not None:
+            turn.admission.close()
+    
+    async def _answer_locally(self, turn: ChatTurn) -> Optional[Dict[str, Any]]:
+        """
+        Answer a purely structural question from the snapshot, if confident.
+        
+        The answer respects the user's hidden categories and customer type;
+        follow-ups in an existing session, users whose preferences the fast
+        path can't apply and turns without their preferences go to the agent.
+        """
+        if not settings.fast_path_enabled or turn.snapshot is None:
+            return None
+        if not self.fast_path.classify(turn.message, turn.query):
+            return None
+        if not turn.is_new_session and self.fast_path.follow_up(turn.message):
+            return None
+        
+        await self._load_preferences(turn)
+        if "preferences" in turn.degraded:
+            return None
+        query = self.fast_path.personalize(turn.query, turn.preferences)
+        if query is None:
+            return None
+        
+        response, filters = self.fast_path.answer(turn.index, query)
+        turn.answered_by = "fast_path"
+        logger.debug("Fast path answered: %s", query.describe(), extra={"session_id": turn.session_id})
+        return {"response": response, "filters": filters}
+    
+    async def _lookup_cache(self, turn: ChatTurn, use_cache: bool) -> Optional[Dict[str, Any]]:
+        """
+        Look up the turn's answer in the response cache.
+        
+        On a miss the turn claims its cache key; concurrent turns with the
+        same key wait for its answer. The claim must be released with
+        ``_release_cache`` (or ``_end_turn``) once the agent has answered (or failed).
+        """
+        if not use_cache or not settings.response_cache_enabled:
+            return None
+        
+        # Preferences and history are part of the key; _prepare_turn reuses them
+        await asyncio.gather(self._load_preferences(turn), self._load_history(turn))
+        if turn.degraded:
+            # Fallback preferences or history would produce the wrong key
+            return None
+        key = cache_key(
+            turn.message,
+            turn.fingerprint,
+            preferences_fingerprint(turn.preferences),
+            history_fingerprint(turn.history)
+        )
+        cached = await self.response_cache.acquire(key)
+        if cached is None:
+            turn.cache_key = key
+        else:
+            turn.answered_by = "cache"
+        return cached
+    
+    def _fill_cache(self, turn: ChatTurn, response: str, filters: Optional[Dict[str, Any]]):
+        if turn.cache_key is None:
+            return
+        if turn.degraded:
+            # Answered without some of its context (e.g. no page context after
+            # a timeout); waiters compute their own answer instead
+            self._release_cache(turn)
+            return
+        self.response_cache.fill(turn.cache_key, {"response": response, "filters": filters})
+    
+    def _release_cache(self, turn: ChatTurn):
+        if turn.cache_key is not None:
+            self.response_cache.release(turn.cache_key)
+            turn.cache_key = None
+    
+    async def _prepare_turn(self, turn: ChatTurn):
+        """
+        Gather preferences, page context and history into the agent's prompt and input.
+        
+        The three stages are independent and run concurrently, each with its
+        own deadline; a stage that misses it falls back to default
+        preferences, no page context or no history rather than delaying
+        the turn.
+        """
+        # Stages already done for the response cache lookup are skipped
+        _, dom_context, _ = await asyncio.gather(
+            self._load_preferences(turn),
+            self._load_context(turn),
+            self._load_history(turn)
+        )
+        
+        # Answer price/discount/category constraints exactly up front
+        if turn.snapshot is not None and turn.query:
+            dom_context += "\n\n" + turn.index.format_matches(turn.query)
+        
+        # Build system prompt with context
+        turn.system_prompt = self._build_system_prompt(turn.preferences, dom_context)
+        
+        # Build the full conversation for the agent
+        turn.agent_input = self._build_conversation_message(turn.message, turn.history, turn.summary)
+    
+    async def _load_preferences(self, turn: ChatTurn):
+        if turn.preferences is None:
+            turn.preferences = await self._run_stage(
+                turn, "preferences",
+                self.get_user_preferences(turn.user_id),
+                settings.preferences_stage_timeout_ms,
+                default_preferences(turn.user_id)
+            )
+    
+    async def _load_history(self, turn: ChatTurn):
+        loads = []
+        if turn.history is None:
+            loads.append(self._load_messages(turn))
+        if turn.summary is None and settings.conversation_summary_enabled:
+            loads.append(self._load_summary(turn))
+        await asyncio.gather(*loads)
+    
+    async def _load_messages(self, turn: ChatTurn):
+        turn.history = await self._run_stage(
+            turn, "history",
+            self.get_conversation_history(turn.session_id, turn.user_id),
+            settings.history_stage_timeout_ms,
+            []
+        )
+    
+    async def _load_summary(self, turn: ChatTurn):
+        turn.summary = await self._run_stage(
+            turn, "summary",
+            self.get_conversation_summary(turn.session_id, turn.user_id),
+            settings.history_stage_timeout_ms,
+            None
+        )
+    
+    async def _load_context(self, turn: ChatTurn) -> str:
+        """Page context for the turn's snapshot; it is cached per snapshot version."""
+        state = turn.snapshot
+        if state is None:
+            return ""
+        if turn.context is not None:
+            return turn.context
+        
+        version = turn.snapshot_version
+        
+        async def build() -> str:
+            # Formatting runs in a worker thread so the deadline can fire and
+            # the other stages' I/O keeps progressing on large pages
+            context, _ = await asyncio.to_thread(self.context_provider.build_context, turn.page)
+            if state.version == version:
+                state.context = context
+            return context
+        
+        # Shielded so the context is still cached if this turn stops waiting
+        return await self._run_stage(
+            turn, "context",
+            asyncio.shield(self._spawn(build())),
+            settings.context_stage_timeout_ms,
+            ""
+        )
+    
+    async def _run_stage(self, turn: ChatTurn, name: str, work, timeout_ms: int, fallback: Any) -> Any:
+        """Await one pre-model stage under its deadline and record its timing."""
+        start = time.perf_counter()
+        degraded = False
+        try:
+            result = await asyncio.wait_for(work, timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Stage missed its deadline; continuing without it",
+                extra={"stage": name, "timeout_ms": timeout_ms, "session_id": turn.session_id}
+            )
+            degraded = True
+            result = fallback
+            turn.degraded.append(name)
+        
+        elapsed = (time.perf_counter() - start) * 1000
+        turn.timings[name] = elapsed
+        record_stage(name, elapsed / 1000)
+        stats = self._stage_stats.setdefault(name, [0, 0.0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        stats[3] += degraded
+        return result
+    
+    def stats(self) -> Dict[str, Any]:
+        """Runtime counters for the stats endpoint."""
+        return {
+            "admission": self.admission.stats(),
+            "system_prompt": self.prompt_builder.stats(),
+            "product_renderer": self.context_provider.renderer.stats(),
+            "response_cache": self.response_cache.stats(),
+            "idempotency": self.idempotency.stats(),
+            "catalog": get_catalog().stats(),
+            "message_writer": self.message_writer.stats(),
+            "storage": self.storage.stats(),
+            "history_cache": self.history_cache.stats(),
+            "preferences_cache": self.preferences_cache.stats(),
+            "stages": {
+                name: {
+                    "count": int(count),
+                    "avg_ms": round(total / count, 2) if count else 0.0,
+                    "max_ms": round(peak, 2),
+                    "degraded": int(degraded),
+                }
+                for name, (count, total, peak, degraded) in self._stage_stats.items()
+            },
+        }
+    
+    async def _generate(self, turn: ChatTurn, parser: FilterBlockParser) -> AsyncIterator[List[Tuple[str, Any]]]:
+        """
+        Run the agent for a turn, yielding the parser output for each chunk.
+        
+        Records time to first token, generation time after it, the time spent
+        parsing the filters block and the prompt and response sizes.
+        """
+        PROMPT_CHARS.observe(len(turn.system_prompt) + len(turn.agent_input))
+        PROMPT_TOKENS.observe(estimate_tokens(turn.system_prompt) + estimate_tokens(turn.agent_input))
+        
+        start = time.perf_counter()
+        first_token = None
+        parsing = 0.0
+        with AGENT_CALLS_IN_FLIGHT.track():
+            async for text in self.agent_runtime.run_stream(turn.agent_input, turn.system_prompt):
+                if first_token is None:
+                    first_token = time.perf_counter()
+                    record_stage("agent_ttft", first_token - start)
+                parse_start = time.perf_counter()
+                parsed = parser.feed(text)
+                parsing += time.perf_counter() - parse_start
+                yield parsed
+            parse_start = time.perf_counter()
+            parsed = parser.close()
+            parsing += time.perf_counter() - parse_start
+            yield parsed
+        
+        record_stage("agent_generation", time.perf_counter() - (first_token or start))
+        record_stage("filter_parsing", parsing)
+        RESPONSE_CHARS.observe(len(parser.text))
+        RESPONSE_TOKENS.observe(estimate_tokens(parser.text))
+    
+    @staticmethod
+    def resync_detail(error: SnapshotResyncRequired) -> Dict[str, Any]:
+        """Error payload telling the client to resend a full DOM snapshot."""
+        return {
+            "detail": str(error),
+            "resync_required": True,
+            "snapshot_version": error.current_version
+        }
+    
+    def _stream_events(self, parsed: List[Tuple[str, Any]]) -> List[Dict[str, Any]]:
+        """Map filter parser output to stream events."""
+        events = []
+        for kind, value in parsed:
+            if kind == "text":
+                events.append({"event": "token", "data": {"text": value}})
+            else:
+                events.append({"event": "filters", "data": value})
+        return events
+    
+    def _build_result(
+        self,
+        turn: ChatTurn,
+        response: str,
+        filters: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Build the chat response payload for a turn."""
+        result = {
+            "response": response,
+            "session_id": turn.session_id,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        
+        if turn.snapshot is not None:
+            result["snapshot_version"] = turn.snapshot_version
+        
+        # Add filters if found
+        if filters:
+            result["filters"] = filters
+        
+        return result
+    
+    async def _persist_turn(
+        self,
+        turn: ChatTurn,
+        response: str,
+        filters: Optional[Dict[str, Any]] = None
+    ):
+        """Queue the user message and assistant response of one turn for storage."""
+        with timed_stage("store_message"):
+            await self.store_message(turn.session_id, turn.user_id, "user", turn.message)
+            await self.store_message(turn.session_id, turn.user_id, "assistant", response)
+        if settings.conversation_summary_enabled:
+            self._spawn(self._update_summary(turn, response, filters))
+    
+    async def _update_summary(
+        self,
+        turn: ChatTurn,
+        response: str,
+        filters: Optional[Dict[str, Any]]
+    ):
+        """Fold a finished turn into the session summary and queue it for storage."""
+        try:
+            summary = turn.summary or self.summarizer.get(turn.session_id)
+            if summary is None and not turn.is_new_session:
+                summary = await self.get_conversation_summary(turn.session_id, turn.user_id)
+            summary = self.summarizer.update(
+                turn.session_id, summary or ConversationSummary(), turn.message, response, filters
+            )
+            await self.message_writer.put(summary.to_document(turn.session_id, turn.user_id))
         except Exception as e:
-            raise Exception(f"Error calling Microsoft Agent Framework: {str(e)}")
+            logger.error("Error updating conversation summary: %s", e)
+    
+    def _spawn(self, coro):
+        """Run a coroutine in the background, keeping a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
     
     def _build_conversation_message(
         self,
         current_message: str,
-        conversation_history: List[Dict[str, Any]]
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[ConversationSummary] = None
     ) -> str:
-        """Build conversation context from history for the agent."""
+        """
+        Build conversation context from history for the agent.
+        
+        With a session summary, the input is the summary plus the most recent
+        exchange verbatim, which keeps it bounded however long the session
+        runs; sessions without one fall back to the last few messages.
+        """
+        if summary is not None and summary.turns:
+            context_parts = [f"Conversation summary so far:\n{summary.text}"]
+            for msg in conversation_history[-2:]:
+                role = "User" if msg["role"] == "user" else "Assistant"
+                content = msg["content"]
+                if len(content) > settings.conversation_recent_turn_max_chars:
+                    content = content[:settings.conversation_recent_turn_max_chars] + " […]"
+                context_parts.append(f"{role}: {content}")
+            context_parts.append(f"User: {current_message}")
+            return "\n\n".join(context_parts)
+        
         if not conversation_history:
             return current_message
         
         # Include last few messages for context
         context_parts = []
-        for msg in conversation_history[-6:]:  # Last 6 messages (3 turns)
+        for msg in conversation_history[-settings.history_max_messages:]:
             role = "User" if msg["role"] == "user" else "Assistant"
             context_parts.append(f"{role}: {msg['content']}")
         
@@ -162,259 +783,82 @@ class ChatService:
         dom_context: str
     ) -> str:
         """Build system prompt with user preferences and DOM context"""
-        
-        base_prompt = """You are a Smart Shopping Companion for a shoe e-commerce website. 
-Your role is to help users find the perfect shoes based on what they can see on their screen 
-and their preferences.
-
-IMPORTANT FORMATTING RULES:
-- Always use Markdown formatting in your responses
-- Use emoticons to make responses friendly and engaging (👟 for shoes, ✨ for highlights, 💰 for prices, 🎯 for recommendations, ⚡ for quick facts)
-- Structure responses with clear headings using ## and ###
-- Use **bold** for product names and important information
-- Use bullet points (•) or numbered lists for multiple items
-- Use code blocks with backticks for prices or specific details
-- Keep responses well-organized and easy to scan
-- Add line breaks between sections for readability
-
-VIEWPORT AWARENESS:
-You will receive information about THREE types of products based on scroll position:
-1. 🔍 VISIBLE PRODUCTS - Currently visible on the user's screen (no scrolling needed)
-2. ⬆️ ABOVE THE FOLD - Products the user has already scrolled past (above the viewport)
-3. ⬇️ BELOW THE FOLD - Products that require scrolling down to see
-
-When answering questions:
-- ALWAYS check ALL THREE sections when answering questions about availability
-- If products matching the criteria are VISIBLE, list them in a "Currently Visible" section
-- If products matching the criteria are ABOVE THE FOLD, list them in an "Above (Scroll Up)" section with a note to scroll up
-- If products matching the criteria are BELOW THE FOLD, list them in a "Below (Scroll Down)" section with a note to scroll down
-- Use phrases like "scroll up to see..." for above-fold products and "scroll down to see..." for below-fold products
-- IMPORTANT: If products meet the user's criteria, LIST them regardless of their position (visible, above, or below)
-- Format all products the same way, but group them by their scroll position
-
-CLICKABLE PRODUCT LINKS:
-When mentioning products, make product names clickable so users can scroll to them:
-- Format: [Product Name](#product-id) where product-id is the product's ID (e.g., shoe-001, shoe-017)
-- Example: [Patent Leather Heels](#shoe-017) - User can click to scroll and highlight
-- ALWAYS include the product ID link when mentioning a specific product
-- This works for both visible and below-fold products
-
-COMPLETENESS RULE - EXTREMELY IMPORTANT:
-When listing products that match criteria, you MUST list EVERY SINGLE product that matches, not just some.
-- Go through ALL visible products one by one
-- Check each against the criteria
-- Include ALL that match - do not skip any
-- If 5 products match, list all 5, not just 2 or 3
-
-DISCOUNT COMPARISON RULES - CRITICAL:
-When users ask for discounts, you MUST filter correctly:
-- "at least 25%" or "25% or more" = ONLY products with discount ≥ 25 (includes 25, 30, 35, etc.)
-- "more than 25%" = ONLY products with discount > 25 (includes 30, 35, etc., but NOT 25)
-- "25% discount" or "exactly 25%" = ONLY products with exactly 25% discount
-
-SUPERLATIVE/RANKING QUERIES - VERY IMPORTANT:
-When users ask for "best", "highest", "lowest", "cheapest", "most expensive", "top", etc.:
-- "best discount" or "highest discount" or "best deals" = Show TOP 5 products sorted by discount (highest first)
-  - Include ALL products with discounts, ranked from highest to lowest
-  - Example: 30% → 25% → 20% → 15% → 10%
-  - Exclude products with 0% discount unless fewer than 5 have discounts
-- "cheapest" or "lowest price" = Show TOP 5 products sorted by price (lowest first)
-- "most expensive" or "highest price" = Show TOP 5 products sorted by price (highest first)
-- Always sort/rank the results appropriately
-- Present as a numbered list (1, 2, 3, 4, 5) to show ranking
-
-PRICE COMPARISON RULES - CRITICAL:
-When users ask about prices, you MUST check EVERY product and list ALL matching:
-- "under $100" or "below $100" or "less than $100" = ALL products where price < 100 (e.g., $89.99 < 100 = YES)
-- "up to $100" or "$100 or less" = ALL products where price <= 100
-- "over $100" or "above $100" or "more than $100" = ALL products where price > 100
-- "between $50 and $100" = ALL products where 50 <= price <= 100
-
-EXAMPLE for "shoes under $100":
-If visible products are: Product A ($49.99), Product B ($89.99), Product C ($129.99), Product D ($59.99)
-You MUST list: Product A ($49.99), Product B ($89.99), Product D ($59.99) - that's 3 products
-Do NOT just pick 2 of them - list ALL 3!
-
-STRICT FILTERING - DO NOT SHOW NON-MATCHING PRODUCTS:
-When a user specifies criteria (discount, price, category), you must ONLY show products that meet ALL criteria.
-
-NEVER DO THIS:
-- User asks for "25% off" → DO NOT show products with 0%, 10%, or 20% discount
-- User asks for "casual shoes with 25% off" → DO NOT show casual shoes without 25%+ discount
-- If no products match → Say "No products match your criteria" - do NOT list non-matching products as alternatives
-- List only SOME matching products when MORE exist - you must list ALL
-
-ALWAYS DO THIS:
-1. Filter by ALL criteria the user specified (category AND discount AND price, etc.)
-2. Check EVERY visible product against the criteria
-3. List ALL products that match - not just a few
-4. If zero products match, clearly state that and ask if they want to adjust criteria
-5. Never "helpfully" show products that don't match as if they do
-
-FILTER CONTROL CAPABILITIES:
-You can help users filter products by responding with filter commands. When users ask to filter products, include a JSON block in your response:
-
-```filters
-{
-  "category": "casual",
-  "min_price": 50,
-  "max_price": 200,
-  "has_discount": true,
-  "min_discount": 10,
-  "customer_type": "b2b",
-  "in_stock": true
-}
-```
-
-Available filters:
-- category: formal, athletic, casual, outdoor, work, or empty for all
-- min_price: minimum price (number)
-- max_price: maximum price (number)
-- has_discount: true/false/null for discounted items
-- min_discount: minimum discount percentage (0-100)
-- customer_type: "b2b", "b2c", or "all"
-- in_stock: true/false/null for stock availability
-
-Examples:
-- "Show me discounted casual shoes" → set category="casual", has_discount=true
-- "Filter by B2B shoes under $150" → set customer_type="b2b", max_price=150
-- "Show shoes with at least 20% off" → set has_discount=true, min_discount=20
-
-Example response format:
-## 👟 Products I Can See
-
-Here are the shoes currently visible on your screen:
-
-• **Product Name** - Brief description
-  - Price: `$XX.XX`
-  - Category: Type
-  - ✨ Special feature or discount
-
-### 🎯 My Recommendation
-Based on your preferences, I suggest..."""
-        
-        # Add user preferences
-        if user_preferences:
-            customer_type = "B2B business customer" if user_preferences.get("is_b2b") else "individual retail customer"
-            base_prompt += f"\n\nCustomer Type: {customer_type}"
-            
-            if user_preferences.get("preferred_categories"):
-                categories = ", ".join(user_preferences["preferred_categories"])
-                base_prompt += f"\nPreferred Categories: {categories}"
-            
-            if user_preferences.get("hidden_categories"):
-                hidden = ", ".join(user_preferences["hidden_categories"])
-                base_prompt += f"\nCategories to avoid: {hidden}"
-        
-        # Add DOM context
-        if dom_context:
-            base_prompt += f"\n\n=== CURRENT PAGE CONTEXT ===\n{dom_context}\n=== END CONTEXT ==="
-            base_prompt += "\n\nWhen answering questions, reference specific products that are visible on the user's screen using the formatting guidelines above."
-        
-        base_prompt += "\n\nRemember: Use Markdown, emoticons, and structured formatting to make your responses engaging and easy to read!"
-        
-        return base_prompt
+        return self.prompt_builder.build(user_preferences, dom_context)
     
     async def get_user_preferences(self, user_id: str) -> Dict[str, Any]:
-        """Retrieve user preferences from Cosmos DB"""
+        """Retrieve user preferences, from the shared cache or storage"""
+        cached = self.preferences_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
         try:
-            item = self.preferences_container.read_item(
-                item=user_id,
-                partition_key=user_id
-            )
-            return item
-        except exceptions.CosmosResourceNotFoundError:
-            # Return default preferences
-            return {
-                "userId": user_id,
-                "is_b2b": False,
-                "preferred_categories": [],
-                "hidden_categories": []
-            }
+            item = await self.storage.read_preferences(user_id)
         except Exception as e:
-            print(f"Error fetching preferences: {e}")
+            logger.error("Error fetching preferences: %s", e)
             return {}
+        if item is None:
+            # Return default preferences
+            defaults = default_preferences(user_id)
+            self.preferences_cache.put(user_id, defaults, found=False)
+            return defaults
+        self.preferences_cache.put(user_id, item)
+        return item
     
-    async def get_conversation_history(self, session_id: str) -> List[Dict[str, Any]]:
-        """Retrieve conversation history for a session"""
+    async def get_conversation_history(
+        self,
+        session_id: str,
+        user_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieve the newest messages of a session, oldest first.
+        
+        Active sessions are served from the history cache. Otherwise only the
+        last ``history_max_messages`` messages are read, from the user's
+        partition when the user is known.
+        """
+        cached = self.history_cache.get(session_id)
+        if cached is not None:
+            return cached
+        
         try:
-            query = "SELECT * FROM c WHERE c.sessionId = @session_id ORDER BY c.timestamp ASC"
-            items = list(self.chat_container.query_items(
-                query=query,
-                parameters=[{"name": "@session_id", "value": session_id}],
-                enable_cross_partition_query=True
-            ))
+            items = await self.storage.recent_messages(session_id, user_id, settings.history_max_messages)
+            self.history_cache.seed(session_id, items)
             return items
         except Exception as e:
-            print(f"Error fetching conversation history: {e}")
+            logger.error("Error fetching conversation history: %s", e)
             return []
     
-    def _remove_filters_block(self, message: str) -> str:
-        """Remove the filters JSON block from the response to keep it clean for users"""
-        import re
-        
-        # Remove ```filters ... ``` blocks
-        filter_pattern = r'```filters\s*\n.*?\n```\s*'
-        clean_message = re.sub(filter_pattern, '', message, flags=re.DOTALL)
+    async def get_conversation_summary(
+        self,
+        session_id: str,
+        user_id: str
+    ) -> Optional[ConversationSummary]:
+        """Retrieve a session's rolling summary, from memory or storage"""
+        summary = self.summarizer.get(session_id)
+        if summary is not None:
+            return summary
         
-        # Clean up any extra blank lines
-        clean_message = re.sub(r'\n{3,}', '\n\n', clean_message)
+        try:
+            document = await self.storage.read_session_document(user_id, summary_document_id(session_id))
+        except Exception as e:
+            logger.error("Error fetching conversation summary: %s", e)
+            return None
+        if document is None:
+            return None
         
-        return clean_message.strip()
+        summary = ConversationSummary.from_document(document)
+        self.summarizer.put(session_id, summary)
+        return summary
+    
+    def _remove_filters_block(self, message: str) -> str:
+        """Remove the filters JSON block from the response to keep it clean for users"""
+        clean_message, _ = FilterBlockParser.parse(message)
+        return clean_message
     
     def _extract_filters(self, message: str) -> Optional[Dict[str, Any]]:
         """Extract filter commands from assistant message"""
-        import re
-        
-        # Look for ```filters ... ``` blocks
-        filter_pattern = r'```filters\s*\n(.*?)\n```'
-        match = re.search(filter_pattern, message, re.DOTALL)
-        
-        if match:
-            try:
-                filters_json = match.group(1)
-                filters = json.loads(filters_json)
-                
-                # Validate and clean filters
-                valid_filters = {}
-                
-                if "category" in filters and filters["category"] and filters["category"] not in ["empty", "null", ""]:
-                    valid_filters["category"] = filters["category"]
-                
-                if "min_price" in filters and filters["min_price"] is not None:
-                    try:
-                        valid_filters["min_price"] = float(filters["min_price"])
-                    except (ValueError, TypeError):
-                        pass
-                
-                if "max_price" in filters and filters["max_price"] is not None:
-                    try:
-                        valid_filters["max_price"] = float(filters["max_price"])
-                    except (ValueError, TypeError):
-                        pass
-                
-                if "has_discount" in filters and filters["has_discount"] is not None:
-                    valid_filters["has_discount"] = bool(filters["has_discount"])
-                
-                if "min_discount" in filters and filters["min_discount"] is not None:
-                    try:
-                        valid_filters["min_discount"] = float(filters["min_discount"])
-                    except (ValueError, TypeError):
-                        pass
-                
-                if "customer_type" in filters:
-                    if filters["customer_type"] in ["all", "b2b", "b2c"]:
-                        valid_filters["customer_type"] = filters["customer_type"]
-                
-                if "in_stock" in filters and filters["in_stock"] is not None:
-                    valid_filters["in_stock"] = bool(filters["in_stock"])
-                
-                return valid_filters if valid_filters else None
-            except (json.JSONDecodeError, ValueError) as e:
-                print(f"Error parsing filters: {e}")
-                return None
-        
-        return None
+        _, filters = FilterBlockParser.parse(message)
+        return filters
     
     async def store_message(
         self,
@@ -423,50 +867,59 @@ Based on your preferences, I suggest..."""
         role: str,
         content: str
     ):
-        """Store a message in conversation history"""
-        try:
-            message = {
-                "id": str(uuid.uuid4()),
-                "sessionId": session_id,
-                "userId": user_id,
-                "role": role,
-                "content": content,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            self.chat_container.create_item(body=message)
-        except Exception as e:
-            print(f"Error storing message: {e}")
+        """
+        Store a message in conversation history.
+        
+        The message is queued for the write-behind worker; this only waits
+        when the queue is full.
+        """
+        message = {
+            "id": str(uuid.uuid4()),
+            "sessionId": session_id,
+            "userId": user_id,
+            "role": role,
+            "content": content,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        self.history_cache.append(session_id, message)
+        await self.message_writer.put(message)
+    
+    async def _write_messages(self, user_id: str, messages: List[Dict[str, Any]]):
+        """Write one user's queued messages as a single batch."""
+        await self.storage.write_session_documents(user_id, messages)
 
 
 class PreferencesService:
     """Service for managing user preferences."""
     
     def __init__(self):
-        self.cosmos_client = CosmosClient.from_connection_string(
-            settings.cosmos_connection_string
-        )
-        self.database = self.cosmos_client.get_database_client(settings.cosmos_database_name)
-        self.container = self.database.get_container_client("preferences")
+        # Shared with ChatService so updates are visible to the next chat turn
+        self.cache = get_preferences_cache()
+        self.storage = get_storage()
     
     async def get_preferences(self, user_id: str) -> Dict[str, Any]:
         """Get user preferences"""
-        try:
-            item = self.container.read_item(
-                item=user_id,
-                partition_key=user_id
-            )
-            return item
-        except exceptions.CosmosResourceNotFoundError:
-            return {
-                "userId": user_id,
-                "is_b2b": False,
-                "preferred_categories": [],
-                "hidden_categories": []
-            }
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached
+        
+        item = await self.storage.read_preferences(user_id)
+        if item is None:
+            defaults = default_preferences(user_id)
+            self.cache.put(user_id, defaults, found=False)
+            return defaults
+        self.cache.put(user_id, item)
+        return item
     
     async def update_preferences(self, user_id: str, preferences: Dict[str, Any]) -> Dict[str, Any]:
         """Update user preferences"""
         preferences["userId"] = user_id
         preferences["id"] = user_id
-        self.container.upsert_item(body=preferences)
+        try:
+            saved = await self.storage.upsert_preferences(user_id, preferences)
+        except Exception:
+            # The stored document is unknown now; read it again next time
+            self.cache.invalidate(user_id)
+            raise
+        self.cache.put(user_id, saved or preferences)
         return preferences
@@ -1,6 +1,16 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+from config import get_settings
+from services.catalog import ProductCatalog, get_catalog
+from services.metrics import CONTEXT_BUILD_SECONDS, SNAPSHOT_PRODUCTS
 import json
+import random
+import time
+import logging
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
 
 
 class ContextProvider(ABC):
@@ -12,8 +22,117 @@ class ContextProvider(ABC):
         pass
 
 
+# Off-screen compaction levels, from most to least detailed
+COMPACTION_LEVELS = ("full", "no_descriptions", "compact_table", "category_summary")
+
+ZONE_HEADINGS = {
+    "above": "\n⬆️ ABOVE THE FOLD ({count} products - user scrolled past these)",
+    "below": "\n⬇️ BELOW THE FOLD ({count} products - require scrolling down)",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate (~4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+def _render_product(
+    product_id: Any,
+    name: Any,
+    category: Any,
+    price: Any,
+    discount: Any,
+    description: Any
+) -> str:
+    """Product line without its list number; pass description=None to leave it out."""
+    product_info = [f"{name} (ID: {product_id})"]
+    
+    if category:
+        product_info.append(f"Category: {category}")
+    
+    if price:
+        product_info.append(f"Price: ${price}")
+    
+    if discount:
+        product_info.append(f"Discount: {discount}% off")
+    
+    if description:
+        product_info.append(f"Description: {description}")
+    
+    return " | ".join(product_info)
+
+
+def _render_table_row(product_id: Any, name: Any, category: Any, price: Any, discount: Any) -> str:
+    return f"{product_id} | {name} | {category or '-'} | ${price or 0} | {discount or 0}%"
+
+
+class ProductRenderer:
+    """
+    Renders product lines through a bounded LRU of fragments.
+    
+    The same products show up across users and turns, so each fragment is
+    cached by the product's ID and the field values it is rendered from; a
+    changed price or description is simply a different key.
+    """
+    
+    def __init__(self, max_entries: Optional[int] = None):
+        max_entries = max_entries or settings.product_render_cache_size
+        # typed: 100, 100.0 and True are equal keys but render differently
+        self._line = lru_cache(maxsize=max_entries, typed=True)(_render_product)
+        self._row = lru_cache(maxsize=max_entries, typed=True)(_render_table_row)
+    
+    def line(self, product: Dict[str, Any], include_description: bool = True) -> str:
+        get = product.get
+        fields = (
+            get('id', 'unknown'), get('name', 'Unknown Product'), get('category'),
+            get('price'), get('discount'), get('description') if include_description else None
+        )
+        try:
+            return self._line(*fields)
+        except TypeError:
+            # Unhashable field values (e.g. a list) are rendered uncached
+            return _render_product(*fields)
+    
+    def row(self, product: Dict[str, Any]) -> str:
+        get = product.get
+        fields = (
+            get('id', 'unknown'), get('name', 'Unknown Product'), get('category'),
+            get('price'), get('discount')
+        )
+        try:
+            return self._row(*fields)
+        except TypeError:
+            return _render_table_row(*fields)
+    
+    def stats(self) -> Dict[str, Any]:
+        lines, rows = self._line.cache_info(), self._row.cache_info()
+        hits, misses = lines.hits + rows.hits, lines.misses + rows.misses
+        return {
+            "entries": lines.currsize + rows.currsize,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+
 class DOMSnapshotProvider(ContextProvider):
-    """Provides context from DOM snapshots of visible products"""
+    """
+    Provides context from DOM snapshots of visible products.
+    
+    Visible products are always written out in full. When the context would
+    exceed the token budget, above- and below-fold products are degraded step
+    by step: first without descriptions, then as compact tables, then as
+    per-category summaries with price and discount ranges.
+    
+    Zones may list bare product IDs; they are resolved from the product catalog.
+    Product lines come from a shared fragment cache, so popular pages cost
+    little more than joining cached strings.
+    """
+    
+    def __init__(self, token_budget: Optional[int] = None, catalog: Optional[ProductCatalog] = None):
+        self.token_budget = settings.context_token_budget if token_budget is None else token_budget
+        self.catalog = catalog or get_catalog()
+        self.renderer = ProductRenderer()
     
     async def get_context(self, data: Dict[str, Any]) -> str:
         """
@@ -21,7 +140,7 @@ class DOMSnapshotProvider(ContextProvider):
         
         Args:
             data: Dictionary containing:
-                - visible_products: List of products visible in viewport
+                - visible_products: List of products (or product IDs) visible in viewport
                 - above_fold_products: List of products above the viewport (scrolled past)
                 - below_fold_products: List of products below the fold (require scrolling)
                 - page_url: Current page URL
@@ -30,23 +149,27 @@ class DOMSnapshotProvider(ContextProvider):
         Returns:
             Formatted context string for the AI model
         """
-        visible_products = data.get("visible_products", [])
-        above_fold_products = data.get("above_fold_products", [])
-        below_fold_products = data.get("below_fold_products", [])
+        context, _ = self.build_context(data)
+        return context
+    
+    def build_context(self, data: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Format DOM snapshot data within the token budget.
+        
+        Returns:
+            Tuple of the context string and the compaction level used
+        """
+        start = time.perf_counter()
+        visible_products = self.catalog.resolve_all(data.get("visible_products") or [])
+        above_fold_products = self.catalog.resolve_all(data.get("above_fold_products") or [])
+        below_fold_products = self.catalog.resolve_all(data.get("below_fold_products") or [])
         page_url = data.get("page_url", "Unknown")
         
-        # Debug logging
-        print(f"\n=== DOM SNAPSHOT DEBUG ===")
-        print(f"Visible products: {len(visible_products)}")
-        print(f"Above fold products: {len(above_fold_products)}")
-        print(f"Below fold products: {len(below_fold_products)}")
-        for p in visible_products:
-            print(f"  VISIBLE: {p.get('name')} - Price: ${p.get('price', 0)} - Discount: {p.get('discount', 0)}%")
-        for p in above_fold_products:
-            print(f"  ABOVE: {p.get('name')} - Price: ${p.get('price', 0)} - Discount: {p.get('discount', 0)}%")
-        for p in below_fold_products:
-            print(f"  BELOW: {p.get('name')} - Price: ${p.get('price', 0)} - Discount: {p.get('discount', 0)}%")
-        print(f"=========================\n")
+        SNAPSHOT_PRODUCTS.observe(len(visible_products), zone="visible")
+        SNAPSHOT_PRODUCTS.observe(len(above_fold_products), zone="above_fold")
+        SNAPSHOT_PRODUCTS.observe(len(below_fold_products), zone="below_fold")
+        if logger.isEnabledFor(logging.DEBUG):
+            self._log_snapshot(visible_products, above_fold_products, below_fold_products)
         
         context_parts = []
         
@@ -57,75 +180,110 @@ class DOMSnapshotProvider(ContextProvider):
         # Format visible products
         if visible_products:
             context_parts.append("\n🔍 VISIBLE PRODUCTS (currently on screen):")
-            
-            for idx, product in enumerate(visible_products, 1):
-                product_info = [
-                    f"{idx}. {product.get('name', 'Unknown Product')} (ID: {product.get('id', 'unknown')})"
-                ]
-                
-                if product.get('category'):
-                    product_info.append(f"Category: {product['category']}")
-                
-                if product.get('price'):
-                    product_info.append(f"Price: ${product['price']}")
-                
-                if product.get('discount'):
-                    product_info.append(f"Discount: {product['discount']}% off")
-                
-                if product.get('description'):
-                    product_info.append(f"Description: {product['description']}")
-                
-                context_parts.append(" | ".join(product_info))
+            context_parts.extend(self._format_products(visible_products))
         else:
             context_parts.append("\n🔍 VISIBLE PRODUCTS: None currently on screen.")
         
-        # Format above-fold products (scrolled past)
-        if above_fold_products:
-            context_parts.append(f"\n⬆️ ABOVE THE FOLD ({len(above_fold_products)} products - user scrolled past these):")
-            
-            for idx, product in enumerate(above_fold_products, 1):
-                product_info = [
-                    f"{idx}. {product.get('name', 'Unknown Product')} (ID: {product.get('id', 'unknown')})"
-                ]
-                
-                if product.get('category'):
-                    product_info.append(f"Category: {product['category']}")
-                
-                if product.get('price'):
-                    product_info.append(f"Price: ${product['price']}")
-                
-                if product.get('discount'):
-                    product_info.append(f"Discount: {product['discount']}% off")
-                
-                if product.get('description'):
-                    product_info.append(f"Description: {product['description']}")
-                
-                context_parts.append(" | ".join(product_info))
+        head = "\n".join(context_parts)
         
-        # Format below-fold products
-        if below_fold_products:
-            context_parts.append(f"\n⬇️ BELOW THE FOLD ({len(below_fold_products)} products - require scrolling down):")
-            
-            for idx, product in enumerate(below_fold_products, 1):
-                product_info = [
-                    f"{idx}. {product.get('name', 'Unknown Product')} (ID: {product.get('id', 'unknown')})"
-                ]
-                
-                if product.get('category'):
-                    product_info.append(f"Category: {product['category']}")
-                
-                if product.get('price'):
-                    product_info.append(f"Price: ${product['price']}")
-                
-                if product.get('discount'):
-                    product_info.append(f"Discount: {product['discount']}% off")
-                
-                if product.get('description'):
-                    product_info.append(f"Description: {product['description']}")
-                
-                context_parts.append(" | ".join(product_info))
+        # Off-screen products: use the most detailed level that fits the budget
+        for level in COMPACTION_LEVELS:
+            off_screen = self._format_off_screen(above_fold_products, below_fold_products, level)
+            if not self.token_budget or level == COMPACTION_LEVELS[-1]:
+                break
+            if estimate_tokens(head) + estimate_tokens(off_screen) <= self.token_budget:
+                break
+        
+        if level != "full":
+            logger.debug("Context compacted", extra={"level": level, "token_budget": self.token_budget})
+            head += f"\nOff-screen product detail: {level.replace('_', ' ')} (condensed to fit the context budget)"
+        
+        CONTEXT_BUILD_SECONDS.observe(time.perf_counter() - start, level=level)
+        return head + off_screen, level
+    
+    def _log_snapshot(
+        self,
+        visible_products: List[Dict[str, Any]],
+        above_fold_products: List[Dict[str, Any]],
+        below_fold_products: List[Dict[str, Any]]
+    ):
+        """Debug-log zone counts, and the products themselves for a sample of snapshots."""
+        logger.debug(
+            "DOM snapshot",
+            extra={
+                "visible": len(visible_products),
+                "above_fold": len(above_fold_products),
+                "below_fold": len(below_fold_products),
+            }
+        )
+        if random.random() >= settings.log_debug_sample_rate:
+            return
+        for zone, products in (("visible", visible_products), ("above", above_fold_products), ("below", below_fold_products)):
+            if products:
+                logger.debug(
+                    "DOM snapshot %s products: %s", zone,
+                    "; ".join(
+                        f"{p.get('name')} - ${p.get('price', 0)} - {p.get('discount', 0)}%"
+                        for p in products
+                    )
+                )
+    
+    def _format_off_screen(
+        self,
+        above_fold_products: List[Dict[str, Any]],
+        below_fold_products: List[Dict[str, Any]],
+        level: str
+    ) -> str:
+        """Format the above- and below-fold sections at the given compaction level."""
+        context_parts = []
+        for zone, products in (("above", above_fold_products), ("below", below_fold_products)):
+            if not products:
+                continue
+            heading = ZONE_HEADINGS[zone].format(count=len(products))
+            if level == "full":
+                context_parts.append(heading + ":")
+                context_parts.extend(self._format_products(products))
+            elif level == "no_descriptions":
+                context_parts.append(heading + ":")
+                context_parts.extend(self._format_products(products, include_description=False))
+            elif level == "compact_table":
+                context_parts.append(heading + ", as ID | Name | Category | Price | Discount:")
+                context_parts.extend(self._format_table_rows(products))
+            else:
+                context_parts.append(heading + ", summarized by category:")
+                context_parts.extend(self._format_category_summary(products))
+        
+        return "".join("\n" + part for part in context_parts)
+    
+    def _format_products(
+        self,
+        products: List[Dict[str, Any]],
+        include_description: bool = True
+    ) -> List[str]:
+        line = self.renderer.line
+        return [
+            f"{idx}. {line(product, include_description)}"
+            for idx, product in enumerate(products, 1)
+        ]
+    
+    def _format_table_rows(self, products: List[Dict[str, Any]]) -> List[str]:
+        return [self.renderer.row(product) for product in products]
+    
+    def _format_category_summary(self, products: List[Dict[str, Any]]) -> List[str]:
+        by_category: Dict[str, List[Dict[str, Any]]] = {}
+        for product in products:
+            by_category.setdefault(product.get('category') or 'uncategorized', []).append(product)
         
-        return "\n".join(context_parts)
+        lines = []
+        for category, items in sorted(by_category.items()):
+            prices = [float(p.get('price') or 0) for p in items]
+            discounts = [float(p.get('discount') or 0) for p in items]
+            discounted = sum(1 for d in discounts if d > 0)
+            lines.append(
+                f"- {category}: {len(items)} products, price ${min(prices):g}-${max(prices):g}, "
+                f"discount {min(discounts):g}-{max(discounts):g}% ({discounted} discounted)"
+            )
+        return lines
 
 
 class ScreenshotProvider(ContextProvider):
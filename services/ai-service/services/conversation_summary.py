@@ -0,0 +1,179 @@
+"""
+Rolling per-session conversation summaries.
+
+Pasting the last six raw messages into the agent input made every turn pay
+for long, Markdown-heavy answers, and anything older than three turns was
+lost. Instead, each session keeps a compact summary that is updated
+incrementally after every turn, off the request path: one line per turn with
+the question, the gist of the answer, the products it pointed to and the
+filters it applied. When the summary outgrows its budget, the oldest lines
+are folded into a short "earlier questions" line, so the agent input stays
+bounded however long the session runs.
+
+Summaries are kept in memory for active sessions and persisted as one
+document per session in the chat-sessions container.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from config import get_settings
+import re
+import time
+
+settings = get_settings()
+
+_PRODUCT_LINK = re.compile(r"\[([^\]]+)\]\(#([^)\s]+)\)")
+_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+(.+)$", re.MULTILINE)
+_MARKDOWN = re.compile(r"[*_`>#]+|\[([^\]]*)\]\([^)]*\)")
+_WHITESPACE = re.compile(r"\s+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+# Characters kept per question / answer gist in a summary line
+QUESTION_CHARS = 160
+GIST_CHARS = 160
+# Products listed per summary line
+MAX_PRODUCTS = 5
+# Characters kept per folded question
+EARLIER_QUESTION_CHARS = 60
+
+
+def summary_document_id(session_id: str) -> str:
+    return f"summary-{session_id}"
+
+
+def _clip(text: str, limit: int) -> str:
+    text = _WHITESPACE.sub(" ", text).strip()
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def _plain(text: str) -> str:
+    return _MARKDOWN.sub(lambda m: m.group(1) or "", text)
+
+
+def summarize_turn(message: str, response: str, filters: Optional[Dict[str, Any]] = None) -> str:
+    """Condense one user/assistant exchange into a single summary line."""
+    heading = _HEADING.search(response)
+    if heading:
+        gist = heading.group(1)
+    else:
+        body = _plain(response).strip()
+        gist = _SENTENCE_END.split(body, 1)[0] if body else ""
+    parts = [f'User asked "{_clip(message, QUESTION_CHARS)}"']
+    if gist:
+        parts.append(f"assistant answered: {_clip(_plain(gist), GIST_CHARS)}")
+
+    products = []
+    for name, product_id in _PRODUCT_LINK.findall(response):
+        entry = f"{_plain(name).strip()} ({product_id})"
+        if entry not in products:
+            products.append(entry)
+    if products:
+        more = len(products) - MAX_PRODUCTS
+        listed = ", ".join(products[:MAX_PRODUCTS]) + (f" and {more} more" if more > 0 else "")
+        parts.append(f"products mentioned: {listed}")
+
+    if filters:
+        parts.append("filters applied: " + ", ".join(f"{k}={v}" for k, v in filters.items()))
+    return "; ".join(parts)
+
+
+class ConversationSummary:
+    """Summary state of one session."""
+
+    __slots__ = ("turns", "lines", "earlier", "last_used")
+
+    def __init__(self, turns: int = 0, lines: Optional[List[str]] = None, earlier: Optional[List[str]] = None):
+        self.turns = turns
+        self.lines: List[str] = lines or []
+        self.earlier: List[str] = earlier or []
+        self.last_used = time.monotonic()
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "ConversationSummary":
+        return cls(document.get("turns", 0), list(document.get("lines", [])), list(document.get("earlier", [])))
+
+    def to_document(self, session_id: str, user_id: str) -> Dict[str, Any]:
+        return {
+            "id": summary_document_id(session_id),
+            "type": "summary",
+            "summaryOf": session_id,
+            "userId": user_id,
+            "turns": self.turns,
+            "lines": self.lines,
+            "earlier": self.earlier,
+        }
+
+    @property
+    def text(self) -> str:
+        parts = []
+        if self.earlier:
+            parts.append("Earlier questions: " + "; ".join(self.earlier))
+        parts.extend(self.lines)
+        return "\n".join(parts)
+
+    def add(self, line: str, max_chars: int):
+        self.turns += 1
+        self.lines.append(f"Turn {self.turns}: {line}")
+        # Fold the oldest turns into the "earlier" line until it fits
+        while len(self.lines) > 1 and len(self.text) > max_chars:
+            oldest = self.lines.pop(0)
+            question = re.search(r'User asked "(.*?)"(?:;|$)', oldest)
+            self.earlier.append(_clip(question.group(1) if question else oldest, EARLIER_QUESTION_CHARS))
+            # Folded questions may take at most half the budget
+            while len(self.earlier) > 1 and len("; ".join(self.earlier)) > max_chars // 2:
+                self.earlier.pop(0)
+        while self.earlier and len(self.text) > max_chars:
+            self.earlier.pop(0)
+
+
+class ConversationSummarizer:
+    """In-memory LRU of session summaries."""
+
+    def __init__(
+        self,
+        max_chars: Optional[int] = None,
+        max_sessions: Optional[int] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.max_chars = max_chars or settings.conversation_summary_max_chars
+        self.max_sessions = max_sessions or settings.history_cache_max_sessions
+        self.ttl_seconds = ttl_seconds or settings.history_cache_ttl_seconds
+        self._sessions: "OrderedDict[str, ConversationSummary]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[ConversationSummary]:
+        summary = self._sessions.get(session_id)
+        if summary is None:
+            return None
+        if time.monotonic() - summary.last_used > self.ttl_seconds:
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return summary
+
+    def put(self, session_id: str, summary: ConversationSummary):
+        summary.last_used = time.monotonic()
+        self._sessions[session_id] = summary
+        self._sessions.move_to_end(session_id)
+        now = time.monotonic()
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - oldest.last_used > self.ttl_seconds:
+                del self._sessions[oldest_id]
+            else:
+                break
+
+    def update(
+        self,
+        session_id: str,
+        summary: ConversationSummary,
+        message: str,
+        response: str,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> ConversationSummary:
+        """Add a finished turn to a session's summary."""
+        summary.add(summarize_turn(message, response, filters), self.max_chars)
+        self.put(session_id, summary)
+        return summary
@@ -0,0 +1,59 @@
+"""
+Shared async Cosmos DB client.
+
+A single ``azure.cosmos.aio.CosmosClient`` (and its HTTP connection pool) is
+shared by every service in the process, so database round trips never block
+the event loop and concurrent requests reuse pooled connections.
+"""
+
+from typing import Dict, Optional
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.cosmos.aio import CosmosClient, ContainerProxy
+from config import get_settings
+import aiohttp
+
+settings = get_settings()
+
+_client: Optional[CosmosClient] = None
+_session: Optional[aiohttp.ClientSession] = None
+_containers: Dict[str, ContainerProxy] = {}
+
+
+def get_cosmos_client() -> CosmosClient:
+    """
+    Get the process-wide async Cosmos client, creating it on first use.
+
+    Must be called from within a running event loop, since the underlying
+    aiohttp session binds to it.
+    """
+    global _client, _session
+    if _client is None:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=settings.cosmos_max_connections)
+        )
+        _client = CosmosClient.from_connection_string(
+            settings.cosmos_connection_string,
+            transport=AioHttpTransport(session=_session, session_owner=False),
+        )
+    return _client
+
+
+def get_container(name: str) -> ContainerProxy:
+    """Get a cached container client from the shared database."""
+    container = _containers.get(name)
+    if container is None:
+        database = get_cosmos_client().get_database_client(settings.cosmos_database_name)
+        container = _containers[name] = database.get_container_client(name)
+    return container
+
+
+async def close_cosmos_client():
+    """Close the shared client and its connection pool."""
+    global _client, _session
+    client, session = _client, _session
+    _client, _session = None, None
+    _containers.clear()
+    if client is not None:
+        await client.close()
+    if session is not None:
+        await session.close()
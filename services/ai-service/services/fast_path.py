@@ -0,0 +1,211 @@
+"""
+Deterministic answers for purely structural chat messages.
+
+Messages like "cheapest shoes", "show discounted casual shoes under $150" or
+"best deals" are fully described by the constraints ``parse_query``
+understands. For those, the answer and the ``filters`` payload can be computed
+from the snapshot index without a model round trip. Everything else (and any
+message with words the classifier doesn't account for) goes to the agent, as
+do negated or exclusion questions ("not on sale", "except casual ones"), which
+the parsed constraints would answer with the opposite set, price phrases that
+parse to an impossible range, and follow-ups that lean on the conversation
+("and under $50?"). Local answers honour the user's hidden categories and
+customer type; users with preferred categories get the agent, which can
+weigh them.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import copy
+from config import get_settings
+from services.filter_parser import validate_filters
+from services.snapshot_index import SnapshotIndex, SnapshotQuery, ZONE_NAMES, TOP_N, MAX_LISTED
+import re
+
+settings = get_settings()
+
+# Words that carry no constraint of their own in a shopping question
+FILLER_WORDS = frozenset("""
+    a all an and any are available can could currently do find for get give have
+    here i in is it items list look looking me my need now of on one ones only
+    options page please price priced prices product products see shoe shoes show
+    some that the there these this those to want what which with you your
+""".split())
+
+_WORD = re.compile(r"[a-z0-9$%.']+")
+
+# Negation and exclusion; outside a parsed constraint these invert its meaning
+_NEGATION = re.compile(
+    r"\b(?:not|no|none|without|except|excluding|exclude|hide|other than)\b|n't\b|\bnon-?(?=[a-z])"
+)
+
+# Openings and references that only make sense after an earlier answer
+_FOLLOW_UP = re.compile(
+    r"^\s*(?:and|or|but|also|only|just|now|then|what about|how about)\b"
+    r"|\b(?:them|those|ones|it|instead|too|again|either|same)\b"
+)
+
+SECTION_HEADINGS = {
+    "visible": "### 🔍 Currently Visible",
+    "above_fold": "### ⬆️ Above (Scroll Up)",
+    "below_fold": "### ⬇️ Below (Scroll Down)",
+}
+
+
+class FastPathResponder:
+    """Intent classifier and local responder for structural queries."""
+
+    def __init__(self, min_confidence: Optional[float] = None):
+        self.min_confidence = settings.fast_path_min_confidence if min_confidence is None else min_confidence
+
+    def confidence(self, message: str, query: SnapshotQuery) -> float:
+        """Share of the message's words explained by parsed constraints or filler."""
+        text = message.lower()
+        words = list(_WORD.finditer(text))
+        if not words:
+            return 0.0
+        covered = 0
+        for word in words:
+            start, end = word.span()
+            token = word.group().strip(".'")
+            if token in FILLER_WORDS or any(s <= start and end <= e for s, e in query.spans):
+                covered += 1
+        return covered / len(words)
+
+    def negated(self, message: str, query: SnapshotQuery) -> bool:
+        """Whether the message negates or excludes something outside its parsed constraints."""
+        for match in _NEGATION.finditer(message.lower()):
+            start, end = match.span()
+            # "no more than $100" is itself a constraint
+            if not any(s <= start and end <= e for s, e in query.spans):
+                return True
+        return False
+
+    def classify(self, message: str, query: Optional[SnapshotQuery]) -> bool:
+        """Whether the message can be answered locally with high confidence."""
+        if query is None or query.contradictory or self.negated(message, query):
+            return False
+        return self.confidence(message, query) >= self.min_confidence
+
+    def follow_up(self, message: str) -> bool:
+        """Whether the message reads as a follow-up to an earlier answer."""
+        return bool(_FOLLOW_UP.search(message.lower()))
+
+    def personalize(self, query: SnapshotQuery, preferences: Optional[Dict[str, Any]]) -> Optional[SnapshotQuery]:
+        """
+        The query narrowed to the user's hidden categories and customer type.
+
+        Returns None when the preferences can't be applied exactly: preferred
+        categories are a weighting for the agent, and a question about a
+        hidden category needs the agent to explain.
+        """
+        preferences = preferences or {}
+        hidden = {c.lower() for c in preferences.get("hidden_categories") or []}
+        if preferences.get("preferred_categories") and not query.categories:
+            return None
+        if any(c.lower() in hidden for c in query.categories):
+            return None
+
+        personalized = copy.copy(query)
+        personalized.excluded_categories = [c for c in query.excluded_categories]
+        if hidden and not query.categories:
+            personalized.excluded_categories += sorted(hidden)
+        personalized.customer_type = "b2b" if preferences.get("is_b2b") else "b2c"
+        return personalized
+
+    def answer(self, index: SnapshotIndex, query: SnapshotQuery) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Build the Markdown answer and filters payload for a structural query.
+
+        Returns:
+            Tuple of the Markdown response and the validated filters (or None)
+        """
+        rows = index.query(query)
+        criteria = query.describe()
+
+        if len(rows) == 0:
+            response = (
+                "## 🔍 No Matches\n\n"
+                f"No products match your criteria (**{criteria}**) on this page.\n\n"
+                "Would you like to adjust the price range, discount or category? 🎯"
+            )
+        elif query.sort:
+            response = self._ranked_answer(index, rows, query)
+        else:
+            response = self._grouped_answer(index, rows, criteria)
+
+        return response, self.filters_for(query)
+
+    def filters_for(self, query: SnapshotQuery) -> Optional[Dict[str, Any]]:
+        """Translate the query into the product grid's filter schema."""
+        filters: Dict[str, Any] = {}
+        if len(query.categories) == 1:
+            filters["category"] = query.categories[0]
+        if query.min_price is not None:
+            filters["min_price"] = query.min_price
+        if query.max_price is not None:
+            filters["max_price"] = query.max_price
+        if query.has_discount or query.min_discount is not None or query.exact_discount is not None:
+            filters["has_discount"] = True
+        discount = query.exact_discount if query.exact_discount is not None else query.min_discount
+        if discount is not None:
+            filters["min_discount"] = discount
+        if query.sort == "discount_desc" and not filters.get("min_discount") and list(filters) == ["has_discount"]:
+            # "Best deals" is a ranking, not a request to filter the grid
+            # (unlike "most expensive shoes on sale", which keeps has_discount)
+            filters = {}
+        return validate_filters(filters)
+
+    def _ranked_answer(self, index: SnapshotIndex, rows, query: SnapshotQuery) -> str:
+        title = {
+            "price_asc": "💰 Lowest Prices",
+            "price_desc": "✨ Highest Prices",
+            "discount_desc": "🎯 Best Discounts",
+        }[query.sort]
+        criteria = query.describe(include_sort=False)
+        top = f"Top {min(len(rows), TOP_N)}"
+        lines = [f"## {title}", "", f"{top} matching **{criteria}**:" if criteria else f"{top} on this page:", ""]
+        for rank, row in enumerate(rows, 1):
+            lines.append(f"{rank}. {self._product_line(index, row)} — {self._position_hint(index, row)}")
+        return "\n".join(lines)
+
+    def _grouped_answer(self, index: SnapshotIndex, rows, criteria: str) -> str:
+        lines = [
+            "## 👟 Matching Products",
+            "",
+            f"⚡ **{len(rows)}** product{'s' if len(rows) != 1 else ''} match **{criteria}**.",
+        ]
+        by_zone: Dict[int, List[int]] = {}
+        for row in rows:
+            by_zone.setdefault(int(index.zone[row]), []).append(row)
+        # At most MAX_LISTED products, the ones on screen first; the filters
+        # narrow the grid to the rest
+        remaining = MAX_LISTED
+        for zone_name in ("visible", "above_fold", "below_fold"):
+            zone_rows = by_zone.get(ZONE_NAMES.index(zone_name), [])[:remaining]
+            if not zone_rows:
+                continue
+            remaining -= len(zone_rows)
+            lines.extend(["", SECTION_HEADINGS[zone_name]])
+            if zone_name == "above_fold":
+                lines.append("_Scroll up to see these:_")
+            elif zone_name == "below_fold":
+                lines.append("_Scroll down to see these:_")
+            for row in zone_rows:
+                lines.append(f"• {self._product_line(index, row)}")
+        if len(rows) > MAX_LISTED:
+            lines.extend(["", f"... and {len(rows) - MAX_LISTED} more matching products."])
+        return "\n".join(lines)
+
+    def _product_line(self, index: SnapshotIndex, row: int) -> str:
+        line = f"**[{index.names[row]}](#{index.ids[row]})** - `${index.price[row]:.2f}`"
+        if index.discount[row] > 0:
+            line += f" ✨ {index.discount[row]:g}% off"
+        return line
+
+    def _position_hint(self, index: SnapshotIndex, row: int) -> str:
+        zone_name = ZONE_NAMES[index.zone[row]]
+        if zone_name == "above_fold":
+            return "scroll up to see it"
+        if zone_name == "below_fold":
+            return "scroll down to see it"
+        return "on your screen"
@@ -0,0 +1,236 @@
+"""
+Incremental parser for ```filters blocks in the agent's token stream.
+
+The agent embeds filter commands in its Markdown answer as a fenced block:
+
+    ```filters
+    {"category": "casual", "max_price": 100}
+    ```
+
+``FilterBlockParser`` consumes the response chunk by chunk, hides the block
+from the user-visible text and emits the validated filter dict as soon as the
+closing fence arrives, so filters can be applied before the rest of the prose
+has been generated. The visible text it produces is identical to removing the
+block from the finished message, collapsing runs of blank lines and stripping
+the result.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+FENCE_OPEN = "```filters"
+FENCE_CLOSE = "\n```"
+
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+# Parser states
+_TEXT, _HEADER, _BODY, _AFTER = range(4)
+
+
+def validate_filters(filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Validate and clean a raw filters dict against the supported filter schema"""
+    if not isinstance(filters, dict):
+        return None
+
+    valid_filters = {}
+
+    if "category" in filters and filters["category"] and filters["category"] not in ["empty", "null", ""]:
+        valid_filters["category"] = filters["category"]
+
+    if "min_price" in filters and filters["min_price"] is not None:
+        try:
+            valid_filters["min_price"] = float(filters["min_price"])
+        except (ValueError, TypeError):
+            pass
+
+    if "max_price" in filters and filters["max_price"] is not None:
+        try:
+            valid_filters["max_price"] = float(filters["max_price"])
+        except (ValueError, TypeError):
+            pass
+
+    if "has_discount" in filters and filters["has_discount"] is not None:
+        valid_filters["has_discount"] = bool(filters["has_discount"])
+
+    if "min_discount" in filters and filters["min_discount"] is not None:
+        try:
+            valid_filters["min_discount"] = float(filters["min_discount"])
+        except (ValueError, TypeError):
+            pass
+
+    if "customer_type" in filters:
+        if filters["customer_type"] in ["all", "b2b", "b2c"]:
+            valid_filters["customer_type"] = filters["customer_type"]
+
+    if "in_stock" in filters and filters["in_stock"] is not None:
+        valid_filters["in_stock"] = bool(filters["in_stock"])
+
+    return valid_filters if valid_filters else None
+
+
+def _partial_suffix(text: str, marker: str) -> int:
+    """Length of the longest suffix of text that is a proper prefix of marker."""
+    # Only suffixes starting with the marker's first character can match
+    start = text.find(marker[0], max(0, len(text) - len(marker) + 1))
+    while start >= 0:
+        if marker.startswith(text[start:]):
+            return len(text) - start
+        start = text.find(marker[0], start + 1)
+    return 0
+
+
+class FilterBlockParser:
+    """
+    Streaming splitter for agent output into visible text and filter commands.
+
+    ``feed`` returns a list of ``("text", str)`` and ``("filters", dict)``
+    events. Only the first filters block determines the filters (later blocks
+    are still hidden). An unterminated block is released as plain text by
+    ``close``, matching how the finished message was treated before.
+
+    Each chunk is scanned once: text outside a block is emitted as it
+    arrives, and the search for a closing fence resumes where the previous
+    chunk's search stopped.
+    """
+
+    def __init__(self):
+        self.filters: Optional[Dict[str, Any]] = None
+        self._state = _TEXT
+        self._buffer = ""
+        self._body_start = 0
+        self._fallback_start = 0
+        # Where the search for the closing fence resumes in _BODY
+        self._scan_from = 0
+        self._seen_block = False
+        # Visible-text normalization: drop leading whitespace, hold trailing
+        # whitespace until more text follows, collapse blank-line runs
+        self._started = False
+        self._pending_ws = ""
+        self._visible: List[str] = []
+
+    @property
+    def text(self) -> str:
+        """Visible text emitted so far."""
+        return "".join(self._visible)
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk of agent output."""
+        events: List[Tuple[str, Any]] = []
+        self._buffer += chunk
+
+        while self._buffer:
+            if self._state == _TEXT:
+                if "`" not in self._buffer:
+                    # Most chunks: plain prose that can't start a fence
+                    self._emit_text(self._buffer, events)
+                    self._buffer = ""
+                    break
+                idx = self._buffer.find(FENCE_OPEN)
+                if idx < 0:
+                    keep = _partial_suffix(self._buffer, FENCE_OPEN)
+                    self._emit_text(self._buffer[:len(self._buffer) - keep], events)
+                    self._buffer = self._buffer[len(self._buffer) - keep:]
+                    break
+                self._emit_text(self._buffer[:idx], events)
+                self._buffer = self._buffer[idx:]
+                self._state = _HEADER
+
+            elif self._state == _HEADER:
+                # The opening fence must be followed by whitespace containing a
+                # newline; wait for the end of that whitespace run
+                header = self._buffer[len(FENCE_OPEN):]
+                rest = header.lstrip()
+                spacing = header[:len(header) - len(rest)]
+                first_newline = spacing.find("\n")
+                if first_newline < 0 and rest:
+                    # Not a filters fence after all; release the marker as text
+                    self._emit_text(FENCE_OPEN, events)
+                    self._buffer = header
+                    self._state = _TEXT
+                    continue
+                if not rest:
+                    break
+                self._state = _BODY
+                # The body starts after the last newline of the run; the closing
+                # fence may only reuse an earlier newline if no later one exists
+                self._body_start = len(FENCE_OPEN) + spacing.rfind("\n") + 1
+                self._fallback_start = len(FENCE_OPEN) + first_newline + 1
+                self._scan_from = self._body_start
+
+            elif self._state == _BODY:
+                idx = self._buffer.find(FENCE_CLOSE, self._scan_from)
+                if idx < 0:
+                    # A fence split across chunks starts in the last few characters
+                    self._scan_from = max(self._body_start, len(self._buffer) - len(FENCE_CLOSE) + 1)
+                    break
+                body = self._buffer[self._body_start:idx]
+                self._buffer = self._buffer[idx + len(FENCE_CLOSE):]
+                self._state = _AFTER
+                if not self._seen_block:
+                    self._seen_block = True
+                    self.filters = self._parse_body(body)
+                    if self.filters:
+                        events.append(("filters", self.filters))
+
+            else:  # _AFTER: swallow whitespace trailing the closing fence
+                stripped = self._buffer.lstrip()
+                self._buffer = stripped
+                if stripped:
+                    self._state = _TEXT
+
+        return events
+
+    def close(self) -> List[Tuple[str, Any]]:
+        """Flush held text at the end of the stream."""
+        events: List[Tuple[str, Any]] = []
+        while self._state == _BODY and self._fallback_start < self._body_start:
+            # No closing fence after the header's last newline; try the earlier one
+            self._body_start = self._scan_from = self._fallback_start
+            events.extend(self.feed(""))
+        if self._state in (_TEXT, _HEADER, _BODY):
+            # Partial markers and unterminated blocks are ordinary text
+            self._emit_text(self._buffer, events)
+        self._buffer = ""
+        self._state = _TEXT
+        # Trailing whitespace is dropped, as with str.strip()
+        self._pending_ws = ""
+        return events
+
+    @classmethod
+    def parse(cls, message: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Split a complete message into visible text and filters in one pass."""
+        parser = cls()
+        parser.feed(message)
+        parser.close()
+        return parser.text, parser.filters
+
+    def _parse_body(self, body: str) -> Optional[Dict[str, Any]]:
+        try:
+            return validate_filters(json.loads(body))
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.warning("Error parsing filters: %s", e)
+            return None
+
+    def _emit_text(self, text: str, events: List[Tuple[str, Any]]):
+        core = text.strip()
+        if not core:
+            self._pending_ws += text
+            return
+        # Whitespace before the text joins the held run; whitespace after it
+        # is held until more text follows
+        if len(core) == len(text):
+            lead = self._pending_ws
+            self._pending_ws = ""
+        else:
+            lead = self._pending_ws + text[:len(text) - len(text.lstrip())]
+            self._pending_ws = text[len(text.rstrip()):]
+        visible = lead + core if self._started else core
+        self._started = True
+        if "\n\n\n" in visible:
+            visible = _BLANK_LINES.sub("\n\n", visible)
+        self._visible.append(visible)
+        events.append(("text", visible))
@@ -0,0 +1,148 @@
+"""
+In-process cache of recent conversation turns per session.
+
+The agent only sees the last few messages of a conversation, so each session
+keeps a ring buffer of its newest messages. ``ChatService.store_message``
+appends to the buffer as it writes, which means follow-up turns in an active
+session read their history from memory. Sessions are evicted when idle for
+longer than the TTL, and least recently used sessions are dropped when the
+cache exceeds its session count or approximate memory cap.
+"""
+
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional
+from config import get_settings
+import hashlib
+import time
+
+settings = get_settings()
+
+# Rough per-message overhead on top of the content, in bytes
+_MESSAGE_OVERHEAD = 200
+
+
+def history_fingerprint(messages: Iterable[Dict[str, Any]]) -> str:
+    """Hash of the roles and contents of a message list ("" when empty)."""
+    digest = hashlib.sha1()
+    empty = True
+    for message in messages:
+        empty = False
+        digest.update(f"{message.get('role')}\x1f{message.get('content')}\x1e".encode("utf-8"))
+    return "" if empty else digest.hexdigest()
+
+
+class SessionHistory:
+    """Ring buffer of one session's newest messages."""
+
+    __slots__ = ("messages", "size", "last_used")
+
+    def __init__(self, max_messages: int):
+        self.messages: deque = deque(maxlen=max_messages)
+        self.size = 0
+        self.last_used = time.monotonic()
+
+    def append(self, message: Dict[str, Any]) -> int:
+        """Add a message; returns the change in approximate size."""
+        before = self.size
+        if len(self.messages) == self.messages.maxlen:
+            self.size -= _message_size(self.messages[0])
+        self.messages.append(message)
+        self.size += _message_size(message)
+        return self.size - before
+
+
+class HistoryCache:
+    """LRU of per-session ring buffers, bounded by sessions, memory and idle time."""
+
+    def __init__(
+        self,
+        max_messages: Optional[int] = None,
+        max_sessions: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.max_messages = max_messages or settings.history_max_messages
+        self.max_sessions = max_sessions or settings.history_cache_max_sessions
+        self.max_bytes = max_bytes or settings.history_cache_max_bytes
+        self.ttl_seconds = ttl_seconds or settings.history_cache_ttl_seconds
+        self._sessions: "OrderedDict[str, SessionHistory]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Newest messages of a session, oldest first, or None if not cached."""
+        history = self._sessions.get(session_id)
+        if history is None or time.monotonic() - history.last_used > self.ttl_seconds:
+            if history is not None:
+                self._remove(session_id)
+            self.misses += 1
+            return None
+        self.hits += 1
+        history.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return list(history.messages)
+
+    def seed(self, session_id: str, messages: List[Dict[str, Any]]):
+        """Start caching a session whose complete recent history is known."""
+        self._remove(session_id)
+        history = SessionHistory(self.max_messages)
+        self._sessions[session_id] = history
+        for message in messages[-self.max_messages:]:
+            self.size += history.append(_compact(message))
+        self._evict()
+
+    def append(self, session_id: str, message: Dict[str, Any]):
+        """Record a newly stored message for a session that is already cached."""
+        history = self._sessions.get(session_id)
+        if history is None:
+            # Without the earlier messages the buffer would be incomplete
+            return
+        self.size += history.append(_compact(message))
+        history.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "approx_bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remove(self, session_id: str):
+        history = self._sessions.pop(session_id, None)
+        if history is not None:
+            self.size -= history.size
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, history = next(iter(self._sessions.items()))
+            if (
+                len(self._sessions) > self.max_sessions
+                or self.size > self.max_bytes
+                or now - history.last_used > self.ttl_seconds
+            ):
+                self._remove(session_id)
+            else:
+                break
+
+
+def _compact(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep only the fields the conversation prompt needs."""
+    return {
+        "role": message.get("role"),
+        "content": message.get("content", ""),
+        "timestamp": message.get("timestamp"),
+    }
+
+
+def _message_size(message: Dict[str, Any]) -> int:
+    return len(message.get("content") or "") + _MESSAGE_OVERHEAD
@@ -0,0 +1,166 @@
+"""
+Idempotent chat requests.
+
+The gateway and browser retry ``/process-chat`` on timeouts, and each retry
+used to start a fresh agent run and store the turn again. Requests carry an
+idempotency key (sent by the client, or derived from the user, session,
+message and snapshot); a duplicate that arrives while the original is running
+waits for the same result, and one that arrives shortly after it finished gets
+the stored result replayed. Streamed requests take part through ``join``,
+``start`` and ``finish``.
+"""
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from config import get_settings
+import asyncio
+import hashlib
+import json
+import time
+
+settings = get_settings()
+
+
+def idempotency_key(
+    user_id: str,
+    message: str,
+    session_id: Optional[str] = None,
+    dom_snapshot: Optional[Dict[str, Any]] = None,
+    client_key: Optional[str] = None
+) -> str:
+    """
+    Key identifying one logical chat request.
+
+    A client-supplied key is scoped to the user; otherwise the key is derived
+    from the session, message and the snapshot payload as sent (a retried
+    delta snapshot must not be applied twice).
+    """
+    digest = hashlib.sha1()
+    if client_key:
+        parts = ("client", user_id, client_key)
+    else:
+        snapshot = json.dumps(dom_snapshot, sort_keys=True, separators=(",", ":"), default=str) if dom_snapshot else ""
+        parts = ("derived", user_id, session_id or "", message, snapshot)
+    digest.update("\x1f".join(parts).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class IdempotencyRegistry:
+    """In-flight and recently finished results by idempotency key."""
+
+    def __init__(self, window_seconds: Optional[float] = None, max_entries: Optional[int] = None):
+        self.window_seconds = window_seconds or settings.idempotency_window_seconds
+        self.max_entries = max_entries or settings.idempotency_max_entries
+        self._finished: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.replayed = 0
+        self.attached = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """A finished result for the key within the replay window."""
+        entry = self._finished.get(key)
+        if entry is None:
+            return None
+        finished_at, result = entry
+        if time.monotonic() - finished_at > self.window_seconds:
+            del self._finished[key]
+            return None
+        self.replayed += 1
+        return dict(result)
+
+    def remember(self, key: str, result: Dict[str, Any]):
+        """Store a finished result for replay."""
+        self._finished[key] = (time.monotonic(), dict(result))
+        self._finished.move_to_end(key)
+        while len(self._finished) > self.max_entries:
+            self._finished.popitem(last=False)
+
+    async def run(self, key: str, work: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Run ``work`` once per key.
+
+        Duplicates that arrive while it runs share its outcome, including
+        errors; a failed request is not remembered, so a later retry runs
+        again.
+        """
+        result = await self.join(key)
+        if result is not None:
+            return result
+
+        future = self.start(key)
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            self.finish(key, future)
+            raise
+        except Exception as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    async def join(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        The result of the request with this key, waiting for it while it runs.
+
+        Returns None if no such request ran recently or it ended without a
+        result (e.g. it was cancelled); the caller then runs the request
+        itself, between ``start`` and ``finish``. An error of the running
+        request is raised here too.
+        """
+        while True:
+            result = self.get(key)
+            if result is not None:
+                return result
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                return None
+            self.attached += 1
+            try:
+                return dict(await asyncio.shield(inflight))
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The original request ended without a result; take over its work
+
+    def start(self, key: str) -> asyncio.Future:
+        """Mark the request with this key as running; duplicates ``join`` it."""
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
+
+    def finish(
+        self,
+        key: str,
+        future: asyncio.Future,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[Exception] = None
+    ):
+        """
+        End a running request.
+
+        A result is remembered for replay and handed to waiting duplicates;
+        an error is raised in them; without either they take over the work.
+        """
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+            # Don't warn about an exception nobody else waited for
+            future.exception()
+        elif result is not None:
+            self.remember(key, result)
+            future.set_result(result)
+        else:
+            future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "finished": len(self._finished),
+            "replayed": self.replayed,
+            "attached": self.attached,
+        }
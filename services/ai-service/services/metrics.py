@@ -0,0 +1,254 @@
+"""
+Prometheus-style metrics and per-request Server-Timing.
+
+A slow chat turn can come from the preferences read, the history query,
+context building, the agent's time to first token, generation, filter parsing
+or storing the turn. Each stage is recorded in a latency histogram (exposed
+on ``/metrics`` in the Prometheus text format) and in the current request's
+timings, which ``ServerTimingMiddleware`` returns as a ``Server-Timing``
+header so individual slow requests can be diagnosed from the browser.
+
+The implementation is deliberately small and dependency-free: the service
+runs as a single process per container, so plain in-memory counters suffice.
+Each metric has a lock because some stages (context building) are recorded
+from worker threads while ``/metrics`` renders on the event loop.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import threading
+import time
+
+# Stage timings of the request being handled (stage -> milliseconds)
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+COUNT_BUCKETS = (0, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        if not self.label_names:
+            self._values[()] = 0
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels: str):
+        """Count the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            snapshot = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = Histogram(
+    "chat_stage_duration_seconds",
+    "Duration of each stage of a chat turn",
+    labels=("stage",)
+)
+REQUEST_SECONDS = Histogram(
+    "chat_request_duration_seconds",
+    "Duration of chat requests by how they were answered",
+    labels=("endpoint", "answered_by")
+)
+CONTEXT_BUILD_SECONDS = Histogram(
+    "chat_context_build_duration_seconds",
+    "Time to format a DOM snapshot into page context",
+    labels=("level",)
+)
+PROMPT_CHARS = Histogram("chat_prompt_chars", "System prompt plus agent input size in characters", buckets=SIZE_BUCKETS)
+PROMPT_TOKENS = Histogram("chat_prompt_tokens", "Estimated prompt tokens per agent call", buckets=SIZE_BUCKETS)
+RESPONSE_CHARS = Histogram("chat_response_chars", "Agent response size in characters", buckets=SIZE_BUCKETS)
+RESPONSE_TOKENS = Histogram("chat_response_tokens", "Estimated response tokens per agent call", buckets=SIZE_BUCKETS)
+SNAPSHOT_PRODUCTS = Histogram(
+    "chat_snapshot_products",
+    "Products per zone in formatted DOM snapshots",
+    labels=("zone",),
+    buckets=COUNT_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge("chat_requests_in_flight", "Chat requests being handled", labels=("endpoint",))
+AGENT_CALLS_IN_FLIGHT = Gauge("chat_agent_calls_in_flight", "Agent runs holding an admission slot")
+
+
+def record_stage(stage: str, seconds: float):
+    """Record a stage duration in the histogram and the current request's timings."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Time a block as one stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in timings.items())
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware adding a ``Server-Timing`` header with the request's stage timings.
+
+    Streaming responses send their headers first, so they only carry the
+    stages completed before the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timings["total"] = (time.perf_counter() - start) * 1000
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing_header(timings).encode("latin-1")))
+                # Lets the browser UI read the timings cross-origin
+                headers.append((b"timing-allow-origin", b"*"))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
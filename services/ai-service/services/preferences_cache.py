@@ -0,0 +1,93 @@
+"""
+Shared in-process cache of user preferences.
+
+Preferences change rarely but were read from Cosmos on every chat turn.
+``ChatService`` and ``PreferencesService`` share one ``PreferencesCache``:
+reads are served from memory for a TTL, users without a stored document are
+cached as a negative entry (holding the default preferences) with a shorter
+TTL, and ``POST /preferences/{user_id}`` refreshes the entry immediately.
+Other replicas pick the change up when their entry expires.
+"""
+
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+from config import get_settings
+import time
+
+settings = get_settings()
+
+
+def default_preferences(user_id: str) -> Dict[str, Any]:
+    """Preferences of a user who hasn't saved any."""
+    return {
+        "userId": user_id,
+        "is_b2b": False,
+        "preferred_categories": [],
+        "hidden_categories": []
+    }
+
+
+class PreferencesCache:
+    """LRU + TTL cache of preference documents with negative caching."""
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        negative_ttl_seconds: Optional[float] = None
+    ):
+        self.max_entries = max_entries or settings.preferences_cache_max_entries
+        self.ttl_seconds = ttl_seconds or settings.preferences_cache_ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds or settings.preferences_cache_negative_ttl_seconds
+        # user_id -> (expires_at, preferences, found)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any], bool]]" = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Cached preferences (a copy), or None if the user has to be read."""
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+        _, preferences, found = entry
+        if found:
+            self.hits += 1
+        else:
+            self.negative_hits += 1
+        self._entries.move_to_end(user_id)
+        return dict(preferences)
+
+    def put(self, user_id: str, preferences: Dict[str, Any], found: bool = True):
+        """Cache a user's stored preferences, or their defaults when ``found`` is False."""
+        ttl = self.ttl_seconds if found else self.negative_ttl_seconds
+        self._entries[user_id] = (time.monotonic() + ttl, dict(preferences), found)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+@lru_cache()
+def get_preferences_cache() -> PreferencesCache:
+    """Get the process-wide preferences cache."""
+    return PreferencesCache()
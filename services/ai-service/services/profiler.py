@@ -0,0 +1,304 @@
+"""
+On-demand request profiling.
+
+Some regressions only show up with real snapshots in production. A
+``/process-chat`` request can be profiled by sending the ``X-Profile-Token``
+header with the configured secret, or a fraction of requests can be profiled
+by setting ``PROFILE_SAMPLE_RATE``. While the request runs, a sampling thread
+records two things every few milliseconds:
+
+- **wall**: where the request's task is. If it is running, that's the event
+  loop thread's stack below the task; if it is suspended, the chain of
+  coroutines it is awaiting, ending in ``[waiting]`` (idle loop) or
+  ``[waiting, loop busy]`` (the loop is running other code, i.e. the request
+  is delayed by something blocking the loop).
+- **blocking**: event loop thread stacks during stretches where a single
+  callback kept the loop busy for longer than ``PROFILE_BLOCKING_THRESHOLD_MS``,
+  e.g. a synchronous Cosmos call or heavy formatting on the loop.
+
+Both are saved in the collapsed-stack format (``frame;frame;frame count``)
+read by flamegraph.pl, speedscope and inferno, and can be fetched from the
+``/admin/profiles`` endpoints with the same token.
+"""
+
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from config import get_settings
+import asyncio
+import hmac
+import inspect
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import logging
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+PROFILE_KINDS = ("wall", "blocking")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_stack(frame) -> List[Any]:
+    """Frames of a thread from the outermost to the innermost."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _is_loop_idle(frames: List[Any]) -> bool:
+    """Whether the event loop thread is waiting for I/O rather than running a callback."""
+    if not frames:
+        return True
+    innermost = frames[-1].f_code
+    if innermost.co_name == "select" and innermost.co_filename.endswith("selectors.py"):
+        return True
+    # Loops implemented in C (uvloop) have no Python frame while idle
+    return not any(_is_callback_frame(frame) for frame in frames)
+
+
+def _is_callback_frame(frame) -> bool:
+    code = frame.f_code
+    return bool(code.co_flags & inspect.CO_COROUTINE) or (
+        code.co_name == "_run" and code.co_filename.endswith(os.path.join("asyncio", "events.py"))
+    )
+
+
+def _await_chain(coro) -> Tuple[List[Any], Any]:
+    """
+    Frames of a suspended coroutine and everything it awaits, outermost first.
+    
+    Returns:
+        Tuple of the frames and the innermost awaited object that isn't a
+        coroutine (usually a future), if any
+    """
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames, coro
+
+
+class RequestProfile:
+    """Samples of one profiled request."""
+
+    def __init__(self, profile_id: str, trigger: str, label: str):
+        self.id = profile_id
+        self.trigger = trigger
+        self.label = label
+        self.started_at = time.time()
+        self.duration_ms = 0.0
+        self.samples = 0
+        self.blocked_ms = 0.0
+        self.blocked_stretches = 0
+        self.longest_block_ms = 0.0
+        self.stacks: Dict[str, Dict[str, int]] = {kind: {} for kind in PROFILE_KINDS}
+
+    def add(self, kind: str, labels: List[str], count: int = 1):
+        key = ";".join(labels)
+        stacks = self.stacks[kind]
+        stacks[key] = stacks.get(key, 0) + count
+
+    def collapsed(self, kind: str) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks[kind].items())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "trigger": self.trigger,
+            "label": self.label,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 1),
+            "samples": self.samples,
+            "blocked_ms": round(self.blocked_ms, 1),
+            "blocked_stretches": self.blocked_stretches,
+            "longest_block_ms": round(self.longest_block_ms, 1),
+        }
+
+
+class _Sampler(threading.Thread):
+    """Samples the event loop thread and one task until stopped."""
+
+    def __init__(self, profile: RequestProfile, task: asyncio.Task, interval: float, blocking_threshold: float):
+        super().__init__(name=f"profiler-{profile.id}", daemon=True)
+        self.profile = profile
+        self.task = task
+        self.interval = interval
+        self.blocking_threshold = blocking_threshold
+        self.loop_thread_id = threading.get_ident()
+        self.stop_event = threading.Event()
+        # Current stretch of the loop running one callback: its outermost frame,
+        # start time and the stacks sampled during it
+        self._busy_frame = None
+        self._busy_since = 0.0
+        self._busy_stacks: List[List[str]] = []
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+        self._end_busy_stretch(time.perf_counter())
+
+    def sample(self):
+        now = time.perf_counter()
+        frames = _thread_stack(sys._current_frames().get(self.loop_thread_id))
+        idle = _is_loop_idle(frames)
+        self.profile.samples += 1
+        self.profile.add("wall", self._task_stack(frames, idle))
+
+        if idle:
+            self._end_busy_stretch(now)
+            return
+        callback = next(frame for frame in frames if _is_callback_frame(frame))
+        if callback is not self._busy_frame:
+            self._end_busy_stretch(now)
+            self._busy_frame = callback
+            self._busy_since = now
+        self._busy_stacks.append([_frame_label(frame) for frame in frames])
+
+    def _task_stack(self, loop_frames: List[Any], idle: bool) -> List[str]:
+        chain, awaited = _await_chain(self.task.get_coro())
+        if chain:
+            outermost = chain[0]
+            for index, frame in enumerate(loop_frames):
+                if frame is outermost:
+                    # The task is running: everything below it on the loop thread
+                    return [_frame_label(f) for f in loop_frames[index:]]
+        labels = [_frame_label(frame) for frame in chain]
+        if awaited is not None:
+            labels.append(f"[{type(awaited).__name__}]")
+        labels.append("[waiting]" if idle else "[waiting, loop busy]")
+        return labels
+
+    def _end_busy_stretch(self, now: float):
+        if self._busy_frame is None:
+            return
+        duration = now - self._busy_since
+        if duration >= self.blocking_threshold:
+            profile = self.profile
+            profile.blocked_ms += duration * 1000
+            profile.blocked_stretches += 1
+            profile.longest_block_ms = max(profile.longest_block_ms, duration * 1000)
+            for stack in self._busy_stacks:
+                profile.add("blocking", stack)
+        self._busy_frame = None
+        self._busy_stacks = []
+
+
+class RequestProfiler:
+    """Decides which requests to profile, runs the sampler and keeps recent profiles."""
+
+    def __init__(
+        self,
+        secret: Optional[str] = None,
+        sample_rate: Optional[float] = None,
+        interval_ms: Optional[float] = None,
+        blocking_threshold_ms: Optional[float] = None,
+        directory: Optional[str] = None,
+        max_profiles: Optional[int] = None
+    ):
+        self.secret = settings.profile_secret if secret is None else secret
+        self.sample_rate = settings.profile_sample_rate if sample_rate is None else sample_rate
+        self.interval = (interval_ms or settings.profile_interval_ms) / 1000
+        self.blocking_threshold = (blocking_threshold_ms or settings.profile_blocking_threshold_ms) / 1000
+        self.directory = directory or settings.profile_dir or os.path.join(tempfile.gettempdir(), "ai-service-profiles")
+        self.max_profiles = max_profiles or settings.profile_max_profiles
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._active = False
+
+    def authorized(self, token: Optional[str]) -> bool:
+        """Whether a token grants access to profiling (never, without a configured secret)."""
+        return bool(self.secret) and bool(token) and hmac.compare_digest(token, self.secret)
+
+    def trigger(self, token: Optional[str]) -> Optional[str]:
+        """Why this request should be profiled ("header" or "sampled"), or None."""
+        if self._active:
+            # One profile at a time; the sampler attributes the whole loop to it
+            return None
+        if token and self.authorized(token):
+            return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    @asynccontextmanager
+    async def profile(self, token: Optional[str], label: str = "") -> AsyncIterator[Optional[RequestProfile]]:
+        """Profile the enclosed block if the request asked for it or was sampled."""
+        trigger = self.trigger(token)
+        if trigger is None:
+            yield None
+            return
+
+        profile = RequestProfile(uuid.uuid4().hex[:12], trigger, label)
+        sampler = _Sampler(profile, asyncio.current_task(), self.interval, self.blocking_threshold)
+        self._active = True
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            yield profile
+        finally:
+            sampler.stop_event.set()
+            await asyncio.to_thread(sampler.join)
+            profile.duration_ms = (time.perf_counter() - start) * 1000
+            self._active = False
+            if await asyncio.to_thread(self._save, profile):
+                # _profiles is only touched on the loop, where list() and read() use it
+                self._profiles[profile.id] = profile.summary()
+                expired = []
+                while len(self._profiles) > self.max_profiles:
+                    expired.append(self._profiles.popitem(last=False)[0])
+                if expired:
+                    await asyncio.to_thread(self._remove, expired)
+                logger.info("Saved request profile", extra=profile.summary())
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Summaries of the kept profiles, newest first."""
+        return list(reversed(self._profiles.values()))
+
+    def read(self, profile_id: str, kind: str) -> Optional[str]:
+        """Collapsed stacks of a kept profile."""
+        if profile_id not in self._profiles or kind not in PROFILE_KINDS:
+            return None
+        try:
+            with open(self._path(profile_id, kind), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _path(self, profile_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.{kind}.folded")
+
+    def _save(self, profile: RequestProfile) -> bool:
+        """Write a profile's files (in a worker thread); False if that failed."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for kind in PROFILE_KINDS:
+                with open(self._path(profile.id, kind), "w", encoding="utf-8") as f:
+                    f.write(profile.collapsed(kind))
+        except OSError as e:
+            logger.error("Error saving profile: %s", e)
+            return False
+        return True
+
+    def _remove(self, profile_ids: List[str]):
+        """Delete the files of profiles that are no longer kept (in a worker thread)."""
+        for profile_id in profile_ids:
+            for kind in PROFILE_KINDS:
+                try:
+                    os.remove(self._path(profile_id, kind))
+                except OSError:
+                    pass
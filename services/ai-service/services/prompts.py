@@ -0,0 +1,244 @@
+"""
+System prompt layout for the shopping companion agent.
+
+The prompt is laid out so its prefix is byte-for-byte stable across requests,
+which lets the model provider's prompt-prefix caching apply:
+
+    [static instructions]        constant for the process
+    [preferences block]          memoized per preferences document
+    [page context]               per request, always last
+
+``SystemPromptBuilder`` also counts how many prompt bytes came from the
+reusable prefix.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+import hashlib
+import json
+
+BASE_INSTRUCTIONS = """You are a Smart Shopping Companion for a shoe e-commerce website. 
+Your role is to help users find the perfect shoes based on what they can see on their screen 
+and their preferences.
+
+IMPORTANT FORMATTING RULES:
+- Always use Markdown formatting in your responses
+- Use emoticons to make responses friendly and engaging (👟 for shoes, ✨ for highlights, 💰 for prices, 🎯 for recommendations, ⚡ for quick facts)
+- Structure responses with clear headings using ## and ###
+- Use **bold** for product names and important information
+- Use bullet points (•) or numbered lists for multiple items
+- Use code blocks with backticks for prices or specific details
+- Keep responses well-organized and easy to scan
+- Add line breaks between sections for readability
+
+VIEWPORT AWARENESS:
+You will receive information about THREE types of products based on scroll position:
+1. 🔍 VISIBLE PRODUCTS - Currently visible on the user's screen (no scrolling needed)
+2. ⬆️ ABOVE THE FOLD - Products the user has already scrolled past (above the viewport)
+3. ⬇️ BELOW THE FOLD - Products that require scrolling down to see
+
+When answering questions:
+- ALWAYS check ALL THREE sections when answering questions about availability
+- If products matching the criteria are VISIBLE, list them in a "Currently Visible" section
+- If products matching the criteria are ABOVE THE FOLD, list them in an "Above (Scroll Up)" section with a note to scroll up
+- If products matching the criteria are BELOW THE FOLD, list them in a "Below (Scroll Down)" section with a note to scroll down
+- Use phrases like "scroll up to see..." for above-fold products and "scroll down to see..." for below-fold products
+- IMPORTANT: If products meet the user's criteria, LIST them regardless of their position (visible, above, or below)
+- Format all products the same way, but group them by their scroll position
+
+CLICKABLE PRODUCT LINKS:
+When mentioning products, make product names clickable so users can scroll to them:
+- Format: [Product Name](#product-id) where product-id is the product's ID (e.g., shoe-001, shoe-017)
+- Example: [Patent Leather Heels](#shoe-017) - User can click to scroll and highlight
+- ALWAYS include the product ID link when mentioning a specific product
+- This works for both visible and below-fold products
+
+COMPLETENESS RULE - EXTREMELY IMPORTANT:
+When listing products that match criteria, you MUST list EVERY SINGLE product that matches, not just some.
+- Go through ALL visible products one by one
+- Check each against the criteria
+- Include ALL that match - do not skip any
+- If 5 products match, list all 5, not just 2 or 3
+
+DISCOUNT COMPARISON RULES - CRITICAL:
+When users ask for discounts, you MUST filter correctly:
+- "at least 25%" or "25% or more" = ONLY products with discount ≥ 25 (includes 25, 30, 35, etc.)
+- "more than 25%" = ONLY products with discount > 25 (includes 30, 35, etc., but NOT 25)
+- "25% discount" or "exactly 25%" = ONLY products with exactly 25% discount
+
+SUPERLATIVE/RANKING QUERIES - VERY IMPORTANT:
+When users ask for "best", "highest", "lowest", "cheapest", "most expensive", "top", etc.:
+- "best discount" or "highest discount" or "best deals" = Show TOP 5 products sorted by discount (highest first)
+  - Include ALL products with discounts, ranked from highest to lowest
+  - Example: 30% → 25% → 20% → 15% → 10%
+  - Exclude products with 0% discount unless fewer than 5 have discounts
+- "cheapest" or "lowest price" = Show TOP 5 products sorted by price (lowest first)
+- "most expensive" or "highest price" = Show TOP 5 products sorted by price (highest first)
+- Always sort/rank the results appropriately
+- Present as a numbered list (1, 2, 3, 4, 5) to show ranking
+
+PRICE COMPARISON RULES - CRITICAL:
+When users ask about prices, you MUST check EVERY product and list ALL matching:
+- "under $100" or "below $100" or "less than $100" = ALL products where price < 100 (e.g., $89.99 < 100 = YES)
+- "up to $100" or "$100 or less" = ALL products where price <= 100
+- "over $100" or "above $100" or "more than $100" = ALL products where price > 100
+- "between $50 and $100" = ALL products where 50 <= price <= 100
+
+EXAMPLE for "shoes under $100":
+If visible products are: Product A ($49.99), Product B ($89.99), Product C ($129.99), Product D ($59.99)
+You MUST list: Product A ($49.99), Product B ($89.99), Product D ($59.99) - that's 3 products
+Do NOT just pick 2 of them - list ALL 3!
+
+STRICT FILTERING - DO NOT SHOW NON-MATCHING PRODUCTS:
+When a user specifies criteria (discount, price, category), you must ONLY show products that meet ALL criteria.
+
+NEVER DO THIS:
+- User asks for "25% off" → DO NOT show products with 0%, 10%, or 20% discount
+- User asks for "casual shoes with 25% off" → DO NOT show casual shoes without 25%+ discount
+- If no products match → Say "No products match your criteria" - do NOT list non-matching products as alternatives
+- List only SOME matching products when MORE exist - you must list ALL
+
+ALWAYS DO THIS:
+1. Filter by ALL criteria the user specified (category AND discount AND price, etc.)
+2. Check EVERY visible product against the criteria
+3. List ALL products that match - not just a few
+4. If zero products match, clearly state that and ask if they want to adjust criteria
+5. Never "helpfully" show products that don't match as if they do
+
+FILTER CONTROL CAPABILITIES:
+You can help users filter products by responding with filter commands. When users ask to filter products, include a JSON block in your response:
+
+```filters
+{
+  "category": "casual",
+  "min_price": 50,
+  "max_price": 200,
+  "has_discount": true,
+  "min_discount": 10,
+  "customer_type": "b2b",
+  "in_stock": true
+}
+```
+
+Available filters:
+- category: formal, athletic, casual, outdoor, work, or empty for all
+- min_price: minimum price (number)
+- max_price: maximum price (number)
+- has_discount: true/false/null for discounted items
+- min_discount: minimum discount percentage (0-100)
+- customer_type: "b2b", "b2c", or "all"
+- in_stock: true/false/null for stock availability
+
+Examples:
+- "Show me discounted casual shoes" → set category="casual", has_discount=true
+- "Filter by B2B shoes under $150" → set customer_type="b2b", max_price=150
+- "Show shoes with at least 20% off" → set has_discount=true, min_discount=20
+
+Example response format:
+## 👟 Products I Can See
+
+Here are the shoes currently visible on your screen:
+
+• **Product Name** - Brief description
+  - Price: `$XX.XX`
+  - Category: Type
+  - ✨ Special feature or discount
+
+### 🎯 My Recommendation
+Based on your preferences, I suggest..."""
+
+# Static prefix: identical bytes for every request
+STATIC_PROMPT = (
+    BASE_INSTRUCTIONS
+    + "\n\nWhen page context is provided below, reference specific products that are visible on the user's screen using the formatting guidelines above."
+    + "\n\nRemember: Use Markdown, emoticons, and structured formatting to make your responses engaging and easy to read!"
+)
+STATIC_PROMPT_BYTES = len(STATIC_PROMPT.encode("utf-8"))
+
+# Bounded memo of rendered preference blocks
+MAX_PREFERENCE_BLOCKS = 4096
+
+
+def preferences_fingerprint(user_preferences: Dict[str, Any]) -> str:
+    """Stable hash of the preference fields that affect the prompt."""
+    if not user_preferences:
+        return ""
+    relevant = {
+        "is_b2b": bool(user_preferences.get("is_b2b")),
+        "preferred_categories": list(user_preferences.get("preferred_categories") or []),
+        "hidden_categories": list(user_preferences.get("hidden_categories") or []),
+    }
+    canonical = json.dumps(relevant, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+class SystemPromptBuilder:
+    """Assembles system prompts from the static prefix and dynamic suffix."""
+
+    def __init__(self, max_preference_blocks: int = MAX_PREFERENCE_BLOCKS):
+        self.max_preference_blocks = max_preference_blocks
+        self._preference_blocks: "OrderedDict[str, str]" = OrderedDict()
+        self.prompts_built = 0
+        self.prompt_bytes = 0
+        self.static_prefix_bytes = 0
+        self.preference_prefix_bytes = 0
+        self.preference_block_hits = 0
+        self.preference_block_misses = 0
+
+    def build(self, user_preferences: Dict[str, Any], dom_context: str) -> str:
+        """Build a system prompt with user preferences and DOM context"""
+        preference_block, reused = self._preference_block(user_preferences)
+
+        parts = [STATIC_PROMPT, preference_block]
+        if dom_context:
+            parts.append(f"\n\n=== CURRENT PAGE CONTEXT ===\n{dom_context}\n=== END CONTEXT ===")
+        prompt = "".join(parts)
+
+        self.prompts_built += 1
+        self.prompt_bytes += len(prompt.encode("utf-8"))
+        self.static_prefix_bytes += STATIC_PROMPT_BYTES
+        if reused:
+            self.preference_prefix_bytes += len(preference_block.encode("utf-8"))
+        return prompt
+
+    def stats(self) -> Dict[str, Any]:
+        """Prefix reuse counters."""
+        reused = self.static_prefix_bytes + self.preference_prefix_bytes
+        return {
+            "prompts_built": self.prompts_built,
+            "prompt_bytes": self.prompt_bytes,
+            "static_prefix_bytes": self.static_prefix_bytes,
+            "preference_prefix_bytes": self.preference_prefix_bytes,
+            "reused_prefix_ratio": reused / self.prompt_bytes if self.prompt_bytes else 0.0,
+            "preference_block_hits": self.preference_block_hits,
+            "preference_block_misses": self.preference_block_misses,
+        }
+
+    def _preference_block(self, user_preferences: Dict[str, Any]) -> Tuple[str, bool]:
+        """Rendered preferences block and whether it came from the memo."""
+        key = preferences_fingerprint(user_preferences)
+        if not key:
+            return "", True
+
+        block = self._preference_blocks.get(key)
+        if block is not None:
+            self._preference_blocks.move_to_end(key)
+            self.preference_block_hits += 1
+            return block, True
+
+        self.preference_block_misses += 1
+        customer_type = "B2B business customer" if user_preferences.get("is_b2b") else "individual retail customer"
+        block = f"\n\nCustomer Type: {customer_type}"
+
+        if user_preferences.get("preferred_categories"):
+            categories = ", ".join(user_preferences["preferred_categories"])
+            block += f"\nPreferred Categories: {categories}"
+
+        if user_preferences.get("hidden_categories"):
+            hidden = ", ".join(user_preferences["hidden_categories"])
+            block += f"\nCategories to avoid: {hidden}"
+
+        self._preference_blocks[key] = block
+        if len(self._preference_blocks) > self.max_preference_blocks:
+            self._preference_blocks.popitem(last=False)
+        return block, False
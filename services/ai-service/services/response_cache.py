@@ -0,0 +1,135 @@
+"""
+Response cache for agent answers.
+
+Users on the same listing page keep asking the same things ("what's on
+sale?"). The cache stores the cleaned response and filters keyed by the
+normalized message, a canonical fingerprint of the page snapshot, the
+user's preferences hash and the recent conversation (a follow-up question
+means something else after a different answer), with LRU eviction and a
+TTL. Concurrent misses for the same key wait for the first request's answer
+instead of each calling the agent (stampede protection).
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from config import get_settings
+import asyncio
+import hashlib
+import re
+import time
+
+settings = get_settings()
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(message: str) -> str:
+    """Case- and whitespace-insensitive form of a chat message."""
+    return _WHITESPACE.sub(" ", message.lower()).strip().rstrip("?!. ")
+
+
+def cache_key(
+    message: str,
+    snapshot_fingerprint: str,
+    preferences_hash: str,
+    history_hash: str = ""
+) -> str:
+    raw = "\x1f".join((normalize_message(message), snapshot_fingerprint, preferences_hash, history_hash))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of ``{"response", "filters"}`` values with single-flight misses.
+
+    Usage::
+
+        value = await cache.acquire(key)
+        if value is None:
+            try:
+                value = ...  # call the agent
+                cache.fill(key, value)
+            finally:
+                cache.release(key)
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None
+    ):
+        self.max_entries = max_entries or settings.response_cache_max_entries
+        self.ttl_seconds = ttl_seconds or settings.response_cache_ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh cached value without counting it."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def acquire(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a cached value, waiting for an in-flight computation of the same key.
+
+        Returns None when the caller has to compute the value; it must then
+        call ``release`` (after ``fill`` on success).
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            value = await asyncio.shield(inflight)
+            if value is not None:
+                self.coalesced += 1
+                return value
+            # The leader failed; compute independently rather than stampede-retry
+            self.misses += 1
+            return None
+
+        self.misses += 1
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+        return None
+
+    def fill(self, key: str, value: Dict[str, Any]):
+        """Store a computed value and hand it to waiting requests."""
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._resolve(key, value)
+
+    def release(self, key: str):
+        """Finish a computation; waiters get None if nothing was filled."""
+        self._resolve(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+    def _resolve(self, key: str, value: Optional[Dict[str, Any]]):
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(value)
@@ -0,0 +1,347 @@
+"""
+Columnar query engine over DOM snapshots.
+
+Price, discount and category questions ("under $100", "at least 25% off",
+"cheapest casual shoes") are filters and sorts that Python can answer exactly
+in microseconds. ``SnapshotIndex`` stores a snapshot as NumPy columns and
+``parse_query`` turns common phrasings into a ``SnapshotQuery``; the ranked
+matches are injected into the page context so completeness no longer depends
+on the model checking every product.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import re
+
+ZONE_NAMES = ("visible", "above_fold", "below_fold")
+ZONE_LABELS = {
+    "visible": "visible",
+    "above_fold": "above (scroll up)",
+    "below_fold": "below (scroll down)",
+}
+
+# Superlative questions list the top results, like the prompt's ranking rules
+TOP_N = 5
+# Upper bound on listed matches for plain filter questions
+MAX_LISTED = 50
+
+# Amounts may use thousands separators ("$1,000"); see _amount
+_NUMBER = r"\$?\s*(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+_PERCENT = r"\s*(?:%|percent\b|per cent\b)"
+# A price is not followed by a percent sign or word, or by "off"
+_NOT_PERCENT = r"(?!\d|\.\d|,\d|\s*(?:%|percent\b|per cent\b|off\b))"
+
+# "no more than" / "no less than" contain the generic phrases and are matched first
+_PRICE_NO_MORE = re.compile(rf"\b(?:no|not) (?:more|higher|greater) than\s+{_NUMBER}{_NOT_PERCENT}")
+_PRICE_NO_LESS = re.compile(rf"\b(?:no|not) (?:less|lower|cheaper) than\s+{_NUMBER}{_NOT_PERCENT}")
+_PRICE_BETWEEN = re.compile(rf"between\s+{_NUMBER}\s*(?:and|to|-)\s*{_NUMBER}{_NOT_PERCENT}")
+_PRICE_BELOW = re.compile(rf"\b(?:under|below|less than|cheaper than)\s+{_NUMBER}{_NOT_PERCENT}")
+_PRICE_AT_MOST = re.compile(
+    rf"(?:\b(?:up to|at most|max(?:imum)?(?: of)?)\s+{_NUMBER}{_NOT_PERCENT}"
+    rf"|{_NUMBER}{_NOT_PERCENT}\s+or less)"
+)
+_PRICE_ABOVE = re.compile(rf"\b(?:over|above|more than|greater than|pricier than)\s+{_NUMBER}{_NOT_PERCENT}")
+_PRICE_AT_LEAST = re.compile(rf"{_NUMBER}{_NOT_PERCENT}\s+or more")
+
+_DISCOUNT_AT_LEAST = re.compile(
+    rf"(?:at least\s+(\d+(?:\.\d+)?){_PERCENT}"
+    rf"|(\d+(?:\.\d+)?){_PERCENT}\s*(?:discount\s+|off\s+)?(?:or more|and up|\+|or higher|or greater))"
+)
+_DISCOUNT_ABOVE = re.compile(rf"\b(?:more than|over|above|greater than)\s+(\d+(?:\.\d+)?){_PERCENT}")
+_DISCOUNT_EXACT = re.compile(rf"(?:exactly\s+(\d+(?:\.\d+)?){_PERCENT}|(\d+(?:\.\d+)?){_PERCENT}\s*discount)")
+_DISCOUNT_OFF = re.compile(rf"(\d+(?:\.\d+)?){_PERCENT}\s*off")
+_HAS_DISCOUNT = re.compile(r"\b(?:discount(?:s|ed)?|on sale|sale|deals?|reduced)\b")
+
+_SORT_PRICE_ASC = re.compile(r"\b(?:cheapest|lowest[- ]price[ds]?|least expensive|most affordable)\b")
+_SORT_PRICE_DESC = re.compile(r"\b(?:most expensive|highest[- ]price[ds]?|priciest)\b")
+_SORT_DISCOUNT_DESC = re.compile(
+    r"\b(?:best|highest|biggest|largest|top)\s+(?:discounts?|deals?|savings)\b"
+)
+
+# A category word only counts in front of a product noun ("work boots") or
+# after "for" ("shoes for work"); "do these work?" is not a category question
+_PRODUCT_NOUN = (
+    r"(?:shoes?|sneakers?|boots?|trainers?|loafers?|sandals?|footwear|pairs?|ones?"
+    r"|styles?|options?|products?|items?|category)"
+)
+
+
+class SnapshotQuery:
+    """Structured constraints parsed from a chat message."""
+
+    __slots__ = (
+        "min_price", "min_price_inclusive", "max_price", "max_price_inclusive",
+        "min_discount", "min_discount_inclusive", "exact_discount", "has_discount",
+        "categories", "excluded_categories", "customer_type", "sort", "spans"
+    )
+
+    def __init__(self):
+        self.min_price: Optional[float] = None
+        self.min_price_inclusive = True
+        self.max_price: Optional[float] = None
+        self.max_price_inclusive = True
+        self.min_discount: Optional[float] = None
+        self.min_discount_inclusive = True
+        self.exact_discount: Optional[float] = None
+        self.has_discount = False
+        self.categories: List[str] = []
+        # Set from the user's preferences, not the message ("b2b" or "b2c")
+        self.excluded_categories: List[str] = []
+        self.customer_type: Optional[str] = None
+        # "price_asc", "price_desc" or "discount_desc"
+        self.sort: Optional[str] = None
+        # Character spans of the message that produced constraints
+        self.spans: List[Tuple[int, int]] = []
+
+    @property
+    def contradictory(self) -> bool:
+        """Whether the price bounds leave no possible price (e.g. "over $200 under $100")."""
+        if self.min_price is None or self.max_price is None:
+            return False
+        if self.min_price == self.max_price:
+            return not (self.min_price_inclusive and self.max_price_inclusive)
+        return self.min_price > self.max_price
+
+    @property
+    def is_empty(self) -> bool:
+        return (
+            self.min_price is None and self.max_price is None and self.min_discount is None
+            and self.exact_discount is None and not self.has_discount
+            and not self.categories and self.sort is None
+        )
+
+    def describe(self, include_sort: bool = True) -> str:
+        """Human-readable summary of the constraints."""
+        parts = []
+        if self.categories:
+            parts.append("category " + " or ".join(self.categories))
+        if self.excluded_categories:
+            parts.append("excluding " + ", ".join(self.excluded_categories))
+        if self.customer_type == "b2b":
+            parts.append("available to B2B")
+        if self.min_price is not None:
+            parts.append(f"price {'>=' if self.min_price_inclusive else '>'} ${self.min_price:g}")
+        if self.max_price is not None:
+            parts.append(f"price {'<=' if self.max_price_inclusive else '<'} ${self.max_price:g}")
+        if self.exact_discount is not None:
+            parts.append(f"discount = {self.exact_discount:g}%")
+        elif self.min_discount is not None:
+            parts.append(f"discount {'>=' if self.min_discount_inclusive else '>'} {self.min_discount:g}%")
+        elif self.has_discount:
+            parts.append("discount > 0%")
+        if not include_sort:
+            pass
+        elif self.sort == "price_asc":
+            parts.append(f"top {TOP_N} cheapest")
+        elif self.sort == "price_desc":
+            parts.append(f"top {TOP_N} most expensive")
+        elif self.sort == "discount_desc":
+            parts.append(f"top {TOP_N} by discount")
+        return ", ".join(parts)
+
+
+def parse_query(message: str, categories: Optional[List[str]] = None) -> Optional[SnapshotQuery]:
+    """
+    Parse price, discount, category and ranking constraints from a message.
+
+    Args:
+        message: User's chat message
+        categories: Known product categories to look for
+
+    Returns:
+        The parsed query, or None if the message has no recognized constraints
+    """
+    text = message.lower()
+    query = SnapshotQuery()
+
+    def found(pattern, source=None):
+        match = pattern.search(text if source is None else source)
+        if match:
+            query.spans.append(match.span())
+        return match
+
+    # Price phrases are blanked out once matched, so "no more than $100"
+    # doesn't also match "more than $100"
+    price_text = text
+
+    def found_price(pattern):
+        nonlocal price_text
+        match = found(pattern, price_text)
+        if match:
+            start, end = match.span()
+            price_text = price_text[:start] + " " * (end - start) + price_text[end:]
+        return match
+
+    match = found_price(_PRICE_BETWEEN)
+    if match:
+        low, high = sorted((_amount(match.group(1)), _amount(match.group(2))))
+        query.min_price, query.max_price = low, high
+    else:
+        no_more = found_price(_PRICE_NO_MORE)
+        no_less = found_price(_PRICE_NO_LESS)
+        if no_more:
+            query.max_price = _amount(no_more.group(1))
+        else:
+            match = found_price(_PRICE_BELOW)
+            if match:
+                query.max_price, query.max_price_inclusive = _amount(match.group(1)), False
+            else:
+                match = found_price(_PRICE_AT_MOST)
+                if match:
+                    query.max_price = _amount(match.group(1) or match.group(2))
+        if no_less:
+            query.min_price = _amount(no_less.group(1))
+        else:
+            match = found_price(_PRICE_ABOVE)
+            if match:
+                query.min_price, query.min_price_inclusive = _amount(match.group(1)), False
+            else:
+                match = found_price(_PRICE_AT_LEAST)
+                if match:
+                    query.min_price = _amount(match.group(1))
+
+    # Lower bounds first: "20% discount or more" also contains "20% discount"
+    match = found(_DISCOUNT_ABOVE)
+    if match:
+        query.min_discount, query.min_discount_inclusive = float(match.group(1)), False
+    else:
+        match = found(_DISCOUNT_AT_LEAST)
+        if match:
+            query.min_discount = float(match.group(1) or match.group(2))
+        else:
+            match = found(_DISCOUNT_EXACT)
+            if match:
+                query.exact_discount = float(match.group(1) or match.group(2))
+            else:
+                match = found(_DISCOUNT_OFF)
+                if match:
+                    query.min_discount = float(match.group(1))
+
+    if found(_SORT_DISCOUNT_DESC):
+        query.sort = "discount_desc"
+        query.has_discount = True
+    elif found(_SORT_PRICE_ASC):
+        query.sort = "price_asc"
+    elif found(_SORT_PRICE_DESC):
+        query.sort = "price_desc"
+
+    if found(_HAS_DISCOUNT):
+        query.has_discount = True
+
+    for category in categories or []:
+        word = rf"{re.escape(category.lower())}s?"
+        if found(re.compile(rf"\b{word}\s+{_PRODUCT_NOUN}\b|\bfor\s+(?:the\s+|a\s+)?{word}\b")):
+            query.categories.append(category)
+
+    return None if query.is_empty else query
+
+
+class SnapshotIndex:
+    """NumPy-backed columns for one DOM snapshot."""
+
+    __slots__ = ("ids", "names", "price", "discount", "category", "categories", "b2b", "b2c", "zone", "size")
+
+    def __init__(self, products: List[Dict[str, Any]], zones: List[int]):
+        self.size = len(products)
+        self.ids = [str(p.get("id", "unknown")) for p in products]
+        self.names = [p.get("name", "Unknown Product") for p in products]
+        self.price = np.array([_to_float(p.get("price")) for p in products], dtype=np.float64)
+        self.discount = np.array([_to_float(p.get("discount")) for p in products], dtype=np.float64)
+        category_names = [p.get("category") or "" for p in products]
+        self.categories = sorted({c for c in category_names if c})
+        codes = {c: i for i, c in enumerate(self.categories)}
+        self.category = np.array([codes.get(c, -1) for c in category_names], dtype=np.int16)
+        self.b2b = np.array([bool(p.get("b2b_available", True)) for p in products], dtype=bool)
+        self.b2c = np.array([bool(p.get("b2c_available", True)) for p in products], dtype=bool)
+        self.zone = np.array(zones, dtype=np.int8)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Dict[str, Any]) -> "SnapshotIndex":
+        products: List[Dict[str, Any]] = []
+        zones: List[int] = []
+        for code, zone in enumerate(ZONE_NAMES):
+            zone_products = snapshot.get(f"{zone}_products") or []
+            products.extend(zone_products)
+            zones.extend([code] * len(zone_products))
+        return cls(products, zones)
+
+    def query(self, query: SnapshotQuery) -> np.ndarray:
+        """Return the row indices matching the query, ranked if it asks for a ranking."""
+        mask = np.ones(self.size, dtype=bool)
+        if query.min_price is not None:
+            mask &= self.price >= query.min_price if query.min_price_inclusive else self.price > query.min_price
+        if query.max_price is not None:
+            mask &= self.price <= query.max_price if query.max_price_inclusive else self.price < query.max_price
+        if query.exact_discount is not None:
+            mask &= self.discount == query.exact_discount
+        elif query.min_discount is not None:
+            mask &= self.discount >= query.min_discount if query.min_discount_inclusive else self.discount > query.min_discount
+        if query.categories:
+            codes = [self.categories.index(c) for c in query.categories if c in self.categories]
+            mask &= np.isin(self.category, codes)
+        if query.excluded_categories:
+            excluded = {c.lower() for c in query.excluded_categories}
+            codes = [i for i, c in enumerate(self.categories) if c.lower() in excluded]
+            mask &= ~np.isin(self.category, codes)
+        if query.customer_type == "b2b":
+            mask &= self.b2b
+        elif query.customer_type == "b2c":
+            mask &= self.b2c
+
+        if query.has_discount and query.sort == "discount_desc":
+            # Rank discounted products first, but still fill the top N
+            discounted = mask & (self.discount > 0)
+            if np.count_nonzero(discounted) >= TOP_N:
+                mask = discounted
+        elif query.has_discount:
+            mask &= self.discount > 0
+
+        rows = np.flatnonzero(mask)
+        if query.sort == "price_asc":
+            rows = rows[np.argsort(self.price[rows], kind="stable")][:TOP_N]
+        elif query.sort == "price_desc":
+            rows = rows[np.argsort(-self.price[rows], kind="stable")][:TOP_N]
+        elif query.sort == "discount_desc":
+            rows = rows[np.lexsort((self.price[rows], -self.discount[rows]))][:TOP_N]
+        return rows
+
+    def format_matches(self, query: SnapshotQuery) -> str:
+        """Format the query's matches as a context block for the model."""
+        rows = self.query(query)
+        lines = [
+            "=== PRECOMPUTED MATCHES ===",
+            f"Criteria parsed from the user's message: {query.describe()}",
+        ]
+        if query.contradictory:
+            # Most likely a misparse; don't steer the model away from checking
+            lines.append(
+                f"{len(rows)} product(s) on this page match. The parsed price bounds contradict "
+                "each other, so check the user's message and the products yourself."
+            )
+        else:
+            lines.append(
+                f"{len(rows)} product(s) on this page match. This list is complete and "
+                f"{'correctly ranked' if query.sort else 'in page order'}; use it instead of "
+                "re-checking every product."
+            )
+        for rank, row in enumerate(rows[:MAX_LISTED], 1):
+            lines.append(
+                f"{rank}. {self.names[row]} (ID: {self.ids[row]}) | ${self.price[row]:g} | "
+                f"{self.discount[row]:g}% off | {ZONE_LABELS[ZONE_NAMES[self.zone[row]]]}"
+            )
+        if len(rows) > MAX_LISTED:
+            lines.append(f"... and {len(rows) - MAX_LISTED} more matching products.")
+        lines.append("=== END MATCHES ===")
+        return "\n".join(lines)
+
+
+def _amount(text: str) -> float:
+    """A price parsed from a message, without thousands separators."""
+    return float(text.replace(",", ""))
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
@@ -0,0 +1,295 @@
+"""
+Per-session DOM snapshot state.
+
+The chat widget sends the products on the page with every message. Keeping the
+last snapshot per session lets clients send only what changed since then:
+
+    {
+        "base_version": 3,
+        "moved": {"shoe-004": "visible", "shoe-001": "above_fold"},
+        "added": {"below_fold": [{"id": "shoe-031", "name": "...", ...}]},
+        "removed": ["shoe-012"],
+        "page_url": "...",      # optional, only when it changed
+        "timestamp": 1700000000
+    }
+
+Products may be given as bare IDs (or ``{"id": ...}`` dicts) and are completed
+from the product catalog, in full snapshots and in ``added`` alike.
+
+Any snapshot without ``base_version`` is treated as a full snapshot and
+replaces the session state. A delta against a version the service no longer
+has (expired, evicted, or another replica) raises ``SnapshotResyncRequired`` so
+the client can fall back to sending the full snapshot.
+
+A snapshot can be staged on a copy of the session state and committed later,
+so a request that is rejected in between (e.g. by admission control) leaves
+the session at its old version and its retry can resend the same delta.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from config import get_settings
+from services.catalog import get_catalog
+import hashlib
+import json
+import time
+
+settings = get_settings()
+
+ZONES = ("above_fold", "visible", "below_fold")
+
+
+class SnapshotResyncRequired(Exception):
+    """Raised when a delta snapshot cannot be applied and a full snapshot is needed."""
+
+    def __init__(self, message: str, current_version: Optional[int] = None):
+        super().__init__(message)
+        self.current_version = current_version
+
+
+class SnapshotState:
+    """Last known snapshot of one session, indexed by product ID."""
+
+    __slots__ = (
+        "version", "page_url", "timestamp", "products", "zones", "positions",
+        "next_position", "context", "index", "_fingerprint", "last_used", "base_version"
+    )
+
+    def __init__(self):
+        self.version = 0
+        self.page_url = "Unknown"
+        self.timestamp = None
+        self.products: Dict[str, Dict[str, Any]] = {}
+        self.zones: Dict[str, str] = {}
+        # Grid position of each product; zones are rendered in this order
+        self.positions: Dict[str, int] = {}
+        self.next_position = 0
+        # Formatted page context and query index for the current version, built on demand
+        self.context: Optional[str] = None
+        self.index = None
+        self._fingerprint: Optional[str] = None
+        self.last_used = time.monotonic()
+        # Version a staged delta was applied to; None for a full snapshot
+        self.base_version: Optional[int] = None
+
+    def copy(self) -> "SnapshotState":
+        """A copy that can be changed without affecting this state."""
+        state = SnapshotState.__new__(SnapshotState)
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+        state.products = dict(self.products)
+        state.zones = dict(self.zones)
+        state.positions = dict(self.positions)
+        return state
+
+    def load(self, snapshot: Dict[str, Any]):
+        """Replace the state with a full snapshot."""
+        self.products.clear()
+        self.zones.clear()
+        self.positions.clear()
+        self.next_position = 0
+        catalog = get_catalog()
+        for zone in ZONES:
+            for product in catalog.resolve_all(snapshot.get(f"{zone}_products") or []):
+                self._put(product, zone)
+        self.page_url = snapshot.get("page_url", "Unknown")
+        self.timestamp = snapshot.get("timestamp")
+        self._bump()
+
+    def apply_delta(self, delta: Dict[str, Any]):
+        """Apply moved, added and removed products on top of the current state."""
+        removed = delta.get("removed") or []
+        moved = delta.get("moved") or {}
+        added = delta.get("added") or {}
+
+        # Validate everything before mutating so a rejected delta leaves the state intact
+        if not isinstance(removed, list) or not all(isinstance(product_id, str) for product_id in removed):
+            raise SnapshotResyncRequired("'removed' must be a list of product IDs", self.version)
+        if not isinstance(moved, dict):
+            raise SnapshotResyncRequired("'moved' must map product IDs to zones", self.version)
+        if not isinstance(added, dict) or not all(
+            isinstance(products, list) and all(isinstance(product, (str, dict)) for product in products)
+            for products in added.values()
+        ):
+            raise SnapshotResyncRequired("'added' must map zones to lists of products", self.version)
+        for product_id, zone in moved.items():
+            if zone not in ZONES or product_id not in self.products or product_id in removed:
+                raise SnapshotResyncRequired(
+                    f"Cannot move unknown product '{product_id}' to zone '{zone}'",
+                    self.version
+                )
+        for zone in added:
+            if zone not in ZONES:
+                raise SnapshotResyncRequired(f"Unknown zone '{zone}'", self.version)
+
+        for product_id in removed:
+            self.products.pop(product_id, None)
+            self.zones.pop(product_id, None)
+            self.positions.pop(product_id, None)
+
+        for product_id, zone in moved.items():
+            self.zones[product_id] = zone
+
+        catalog = get_catalog()
+        for zone, products in added.items():
+            for product in catalog.resolve_all(products):
+                self._put(product, zone)
+
+        if delta.get("timestamp") is not None:
+            self.timestamp = delta["timestamp"]
+
+        page_changed = bool(delta.get("page_url")) and delta["page_url"] != self.page_url
+        if page_changed:
+            self.page_url = delta["page_url"]
+
+        # An empty delta keeps the version, so the cached context stays valid
+        if removed or moved or added or page_changed:
+            self._bump()
+
+    def to_snapshot(self) -> Dict[str, Any]:
+        """Materialize the state in the full snapshot format."""
+        snapshot: Dict[str, Any] = {f"{zone}_products": [] for zone in ZONES}
+        for product_id in sorted(self.products, key=self.positions.__getitem__):
+            snapshot[f"{self.zones[product_id]}_products"].append(self.products[product_id])
+        snapshot["page_url"] = self.page_url
+        snapshot["timestamp"] = self.timestamp
+        return snapshot
+
+    @property
+    def fingerprint(self) -> str:
+        """Canonical hash of the products and their zones (ignores URL and timestamp)."""
+        if self._fingerprint is None:
+            snapshot = self.to_snapshot()
+            canonical = json.dumps(
+                [snapshot[f"{zone}_products"] for zone in ZONES],
+                sort_keys=True, separators=(",", ":"), default=str
+            )
+            self._fingerprint = hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    def _put(self, product: Dict[str, Any], zone: str):
+        product_id = product.get("id")
+        if product_id is None:
+            return
+        self.products[product_id] = product
+        self.zones[product_id] = zone
+        if product_id not in self.positions:
+            self.positions[product_id] = product.get("position", self.next_position)
+            self.next_position = max(self.next_position, self.positions[product_id]) + 1
+
+    def _bump(self):
+        self.version += 1
+        self.context = None
+        self.index = None
+        self._fingerprint = None
+
+
+class SnapshotStore:
+    """
+    In-memory LRU of per-session snapshot state.
+
+    Sessions are evicted when idle for longer than the TTL or when the store
+    exceeds its maximum size.
+    """
+
+    def __init__(self, max_sessions: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.max_sessions = max_sessions or settings.snapshot_store_max_sessions
+        self.ttl_seconds = ttl_seconds or settings.snapshot_store_ttl_seconds
+        self._sessions: "OrderedDict[str, SnapshotState]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> Optional[SnapshotState]:
+        state = self._sessions.get(session_id)
+        if state is None:
+            return None
+        if time.monotonic() - state.last_used > self.ttl_seconds:
+            del self._sessions[session_id]
+            return None
+        return state
+
+    def apply(self, session_id: str, snapshot: Dict[str, Any]) -> SnapshotState:
+        """
+        Update a session's state from a full or delta snapshot.
+
+        Returns:
+            The updated session state
+
+        Raises:
+            SnapshotResyncRequired: If a delta's base version doesn't match
+        """
+        return self.commit(session_id, self.stage(session_id, snapshot))
+
+    def stage(self, session_id: str, snapshot: Dict[str, Any]) -> SnapshotState:
+        """
+        Apply a full or delta snapshot to a copy of the session's state.
+
+        The store is unchanged until the returned state is passed to ``commit``.
+
+        Raises:
+            SnapshotResyncRequired: If a delta's base version doesn't match
+        """
+        current = self.get(session_id)
+
+        if "base_version" in snapshot:
+            if current is None:
+                raise SnapshotResyncRequired("No snapshot state for session")
+            if snapshot["base_version"] != current.version:
+                raise SnapshotResyncRequired(
+                    f"Snapshot base version {snapshot['base_version']} does not match {current.version}",
+                    current.version
+                )
+            state = current.copy()
+            state.apply_delta(snapshot)
+            state.base_version = current.version
+        else:
+            state = SnapshotState()
+            state.version = current.version if current is not None else 0
+            state.load(snapshot)
+        return state
+
+    def commit(self, session_id: str, state: SnapshotState) -> SnapshotState:
+        """
+        Make a staged state the session's current state.
+
+        A full snapshot replaces whatever the session has by then, with the
+        next version number.
+
+        Returns:
+            The committed state
+
+        Raises:
+            SnapshotResyncRequired: If the state is a delta and the session
+                moved past its base version since it was staged
+        """
+        current = self.get(session_id)
+        current_version = current.version if current is not None else None
+
+        if state.base_version is not None:
+            if current_version != state.base_version:
+                raise SnapshotResyncRequired(
+                    f"Snapshot base version {state.base_version} does not match {current_version}",
+                    current_version
+                )
+        elif current_version is not None and state.version <= current_version:
+            state.version = current_version + 1
+
+        state.base_version = None
+        state.last_used = time.monotonic()
+        self._sessions[session_id] = state
+        self._sessions.move_to_end(session_id)
+        self._evict()
+        return state
+
+    def discard(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, state = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - state.last_used > self.ttl_seconds:
+                del self._sessions[session_id]
+            else:
+                break
@@ -0,0 +1,470 @@
+"""
+Storage backends for chat sessions and user preferences.
+
+``ChatService`` and ``PreferencesService`` store three kinds of documents:
+chat messages and session summaries (partitioned by user, like the
+chat-sessions container) and one preferences document per user. They reach
+them through ``StorageBackend``, selected with ``STORAGE_BACKEND``:
+
+- ``cosmos``: the Cosmos DB containers (default)
+- ``memory``: process memory, for local runs and benchmarks
+- ``sqlite``: an embedded SQLite file, which survives restarts
+- ``tiered``: SQLite serves active sessions and preferences locally; session
+  writes go to SQLite immediately and to Cosmos in the background through a
+  write-behind queue, and reads that miss locally fall back to Cosmos and
+  fill the local tier. Local rows untouched for
+  ``STORAGE_LOCAL_RETENTION_SECONDS`` are pruned; Cosmos keeps them.
+
+The memory and SQLite backends let the service run and be benchmarked
+without Azure.
+"""
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+from azure.cosmos import exceptions
+from config import get_settings
+from services.cosmos import get_cosmos_client, get_container, close_cosmos_client
+from services.write_behind import WriteBehindQueue
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import logging
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKENDS = ("cosmos", "memory", "sqlite", "tiered")
+
+
+class StorageBackend(ABC):
+    """Session documents (messages and summaries, partitioned by user) and preferences."""
+
+    name = ""
+
+    async def start(self):
+        """Open connections; called once at application startup."""
+
+    async def close(self):
+        """Flush pending writes and release connections."""
+
+    @abstractmethod
+    async def recent_messages(self, session_id: str, user_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        """The newest ``limit`` messages of a session, oldest first (any user when user_id is None)."""
+
+    @abstractmethod
+    async def read_session_document(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """A session document by ID, or None if it doesn't exist."""
+
+    @abstractmethod
+    async def write_session_documents(self, user_id: str, documents: List[Dict[str, Any]]):
+        """Upsert documents of one user (messages, summaries) as one batch."""
+
+    @abstractmethod
+    async def read_preferences(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """A user's preferences document, or None if the user has none."""
+
+    @abstractmethod
+    async def upsert_preferences(self, user_id: str, preferences: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a user's preferences document and return it as stored."""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class CosmosStorage(StorageBackend):
+    """The chat-sessions and preferences containers on the shared async Cosmos client."""
+
+    name = "cosmos"
+
+    def __init__(self, sessions_container: str = "chat-sessions", preferences_container: str = "preferences"):
+        self.sessions_container = sessions_container
+        self.preferences_container = preferences_container
+
+    @property
+    def sessions(self):
+        return get_container(self.sessions_container)
+
+    @property
+    def preferences(self):
+        return get_container(self.preferences_container)
+
+    async def start(self):
+        # Open the shared Cosmos connection pool on the app's event loop
+        get_cosmos_client()
+
+    async def close(self):
+        await close_cosmos_client()
+
+    async def recent_messages(self, session_id: str, user_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        query = (
+            "SELECT TOP @limit * FROM c WHERE c.sessionId = @session_id "
+            "ORDER BY c.timestamp DESC"
+        )
+        items = [
+            item async for item in self.sessions.query_items(
+                query=query,
+                parameters=[
+                    {"name": "@limit", "value": limit},
+                    {"name": "@session_id", "value": session_id}
+                ],
+                partition_key=user_id
+            )
+        ]
+        items.reverse()
+        return items
+
+    async def read_session_document(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.sessions.read_item(item=document_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+
+    async def write_session_documents(self, user_id: str, documents: List[Dict[str, Any]]):
+        # Upserts keep a retried batch idempotent if the first attempt landed
+        operations = [("upsert", (document,)) for document in documents]
+        await self.sessions.execute_item_batch(batch_operations=operations, partition_key=user_id)
+
+    async def read_preferences(self, user_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return await self.preferences.read_item(item=user_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+
+    async def upsert_preferences(self, user_id: str, preferences: Dict[str, Any]) -> Dict[str, Any]:
+        saved = await self.preferences.upsert_item(body=preferences)
+        return saved or preferences
+
+
+class MemoryStorage(StorageBackend):
+    """Documents in process memory (unbounded; for local runs, tests and benchmarks)."""
+
+    name = "memory"
+
+    def __init__(self):
+        # session ID -> message ID -> message
+        self._messages: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # (user ID, document ID) -> other session documents (summaries)
+        self._documents: Dict[tuple, Dict[str, Any]] = {}
+        self._preferences: Dict[str, Dict[str, Any]] = {}
+
+    async def recent_messages(self, session_id: str, user_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        messages = [
+            message for message in self._messages.get(session_id, {}).values()
+            if user_id is None or message.get("userId") == user_id
+        ]
+        messages.sort(key=lambda message: message.get("timestamp") or "")
+        return [dict(message) for message in messages[-limit:]] if limit > 0 else []
+
+    async def read_session_document(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        document = self._documents.get((user_id, document_id))
+        return dict(document) if document is not None else None
+
+    async def write_session_documents(self, user_id: str, documents: List[Dict[str, Any]]):
+        for document in documents:
+            document = dict(document)
+            if document.get("sessionId"):
+                self._messages.setdefault(document["sessionId"], {})[document["id"]] = document
+            else:
+                self._documents[(user_id, document["id"])] = document
+
+    async def read_preferences(self, user_id: str) -> Optional[Dict[str, Any]]:
+        preferences = self._preferences.get(user_id)
+        return dict(preferences) if preferences is not None else None
+
+    async def upsert_preferences(self, user_id: str, preferences: Dict[str, Any]) -> Dict[str, Any]:
+        self._preferences[user_id] = dict(preferences)
+        return dict(preferences)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "sessions": len(self._messages),
+            "documents": len(self._documents),
+            "preferences": len(self._preferences),
+        }
+
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS session_documents (
+        user_id TEXT NOT NULL,
+        id TEXT NOT NULL,
+        session_id TEXT,
+        timestamp TEXT,
+        body TEXT NOT NULL,
+        touched_at REAL NOT NULL,
+        PRIMARY KEY (user_id, id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS session_documents_by_session ON session_documents (session_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS session_documents_by_touch ON session_documents (touched_at)",
+    """
+    CREATE TABLE IF NOT EXISTS preferences (
+        user_id TEXT PRIMARY KEY,
+        body TEXT NOT NULL,
+        touched_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS preferences_by_touch ON preferences (touched_at)",
+)
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Documents in an embedded SQLite file.
+
+    All statements run on one dedicated thread with one connection, so the
+    event loop never waits on disk and SQLite needs no locking of its own.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or settings.storage_sqlite_path or os.path.join(tempfile.gettempdir(), "ai-service.sqlite3")
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+
+    async def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-storage")
+            await self._run(self._open)
+
+    async def close(self):
+        if self._executor is None:
+            return
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def _run(self, work: Callable, *args: Any) -> Any:
+        if self._executor is None:
+            await self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, work, *args)
+
+    def _open(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def recent_messages(self, session_id: str, user_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        return await self._run(self._recent_messages, session_id, user_id, limit)
+
+    def _recent_messages(self, session_id: str, user_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        query = "SELECT body FROM session_documents WHERE session_id = ?"
+        parameters: List[Any] = [session_id]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            parameters.append(user_id)
+        query += " ORDER BY timestamp DESC LIMIT ?"
+        parameters.append(limit)
+        rows = self._connection.execute(query, parameters).fetchall()
+        return [json.loads(body) for (body,) in reversed(rows)]
+
+    async def read_session_document(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self._read_session_document, user_id, document_id)
+
+    def _read_session_document(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection.execute(
+            "SELECT body FROM session_documents WHERE user_id = ? AND id = ?", (user_id, document_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def write_session_documents(self, user_id: str, documents: List[Dict[str, Any]]):
+        await self._run(self._write_session_documents, user_id, documents)
+
+    def _write_session_documents(self, user_id: str, documents: List[Dict[str, Any]]):
+        now = time.time()
+        rows = [
+            (user_id, document["id"], document.get("sessionId"), document.get("timestamp"),
+             json.dumps(document, default=str), now)
+            for document in documents
+        ]
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO session_documents (user_id, id, session_id, timestamp, body, touched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    async def read_preferences(self, user_id: str, max_age_seconds: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """A user's preferences, ignoring a row written more than ``max_age_seconds`` ago."""
+        return await self._run(self._read_preferences, user_id, max_age_seconds)
+
+    def _read_preferences(self, user_id: str, max_age_seconds: Optional[float]) -> Optional[Dict[str, Any]]:
+        row = self._connection.execute(
+            "SELECT body, touched_at FROM preferences WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None or (max_age_seconds is not None and time.time() - row[1] > max_age_seconds):
+            return None
+        return json.loads(row[0])
+
+    async def upsert_preferences(self, user_id: str, preferences: Dict[str, Any]) -> Dict[str, Any]:
+        await self._run(self._upsert_preferences, user_id, preferences)
+        return preferences
+
+    def _upsert_preferences(self, user_id: str, preferences: Dict[str, Any]):
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO preferences (user_id, body, touched_at) VALUES (?, ?, ?)",
+                (user_id, json.dumps(preferences, default=str), time.time())
+            )
+
+    async def prune(self, max_age_seconds: float) -> int:
+        """Delete rows not written for ``max_age_seconds``; returns how many."""
+        return await self._run(self._prune, time.time() - max_age_seconds)
+
+    def _prune(self, cutoff: float) -> int:
+        with self._connection:
+            deleted = self._connection.execute("DELETE FROM session_documents WHERE touched_at < ?", (cutoff,)).rowcount
+            deleted += self._connection.execute("DELETE FROM preferences WHERE touched_at < ?", (cutoff,)).rowcount
+        return deleted
+
+
+class TieredStorage(StorageBackend):
+    """
+    A local SQLite tier in front of a remote backend (Cosmos DB).
+
+    Session documents are written locally, then queued for the remote in
+    per-user batches; reads are served locally and fall back to the remote
+    on a miss, filling the local tier. Preference updates go to the remote
+    first so it stays the source of truth, and local preference rows are
+    only served for ``preferences_ttl_seconds`` so updates made through
+    other replicas are picked up.
+    """
+
+    name = "tiered"
+
+    def __init__(
+        self,
+        local: SQLiteStorage,
+        remote: StorageBackend,
+        retention_seconds: Optional[float] = None,
+        preferences_ttl_seconds: Optional[float] = None
+    ):
+        self.local = local
+        self.remote = remote
+        self.retention_seconds = (
+            settings.storage_local_retention_seconds if retention_seconds is None else retention_seconds
+        )
+        self.preferences_ttl_seconds = (
+            settings.storage_local_preferences_ttl_seconds if preferences_ttl_seconds is None else preferences_ttl_seconds
+        )
+        self.remote_writer = WriteBehindQueue(self._write_remote, partition_key_field="userId")
+        self._pruner: Optional[asyncio.Task] = None
+        self.local_hits = 0
+        self.remote_reads = 0
+
+    async def start(self):
+        await self.local.start()
+        await self.remote.start()
+        self.remote_writer.start()
+        if self.retention_seconds and self._pruner is None:
+            self._pruner = asyncio.create_task(self._prune_periodically())
+
+    async def close(self):
+        if self._pruner is not None:
+            self._pruner.cancel()
+            await asyncio.gather(self._pruner, return_exceptions=True)
+            self._pruner = None
+        # Drain queued remote writes while the remote is still open
+        await self.remote_writer.close()
+        await self.local.close()
+        await self.remote.close()
+
+    async def recent_messages(self, session_id: str, user_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        messages = await self.local.recent_messages(session_id, user_id, limit)
+        if messages:
+            self.local_hits += 1
+            return messages
+        self.remote_reads += 1
+        messages = await self.remote.recent_messages(session_id, user_id, limit)
+        for owner in {message.get("userId") for message in messages}:
+            await self.local.write_session_documents(owner, [m for m in messages if m.get("userId") == owner])
+        return messages
+
+    async def read_session_document(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        document = await self.local.read_session_document(user_id, document_id)
+        if document is not None:
+            self.local_hits += 1
+            return document
+        self.remote_reads += 1
+        document = await self.remote.read_session_document(user_id, document_id)
+        if document is not None:
+            await self.local.write_session_documents(user_id, [document])
+        return document
+
+    async def write_session_documents(self, user_id: str, documents: List[Dict[str, Any]]):
+        await self.local.write_session_documents(user_id, documents)
+        for document in documents:
+            await self.remote_writer.put(document)
+
+    async def _write_remote(self, user_id: str, documents: List[Dict[str, Any]]):
+        await self.remote.write_session_documents(user_id, documents)
+
+    async def read_preferences(self, user_id: str) -> Optional[Dict[str, Any]]:
+        preferences = await self.local.read_preferences(user_id, self.preferences_ttl_seconds)
+        if preferences is not None:
+            self.local_hits += 1
+            return preferences
+        self.remote_reads += 1
+        preferences = await self.remote.read_preferences(user_id)
+        if preferences is not None:
+            await self.local.upsert_preferences(user_id, preferences)
+        return preferences
+
+    async def upsert_preferences(self, user_id: str, preferences: Dict[str, Any]) -> Dict[str, Any]:
+        saved = await self.remote.upsert_preferences(user_id, preferences)
+        await self.local.upsert_preferences(user_id, saved)
+        return saved
+
+    async def _prune_periodically(self):
+        interval = max(60.0, self.retention_seconds / 10)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                deleted = await self.local.prune(self.retention_seconds)
+                if deleted:
+                    logger.info("Pruned local storage tier", extra={"rows": deleted})
+            except Exception as e:
+                logger.error("Error pruning local storage tier: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "local_hits": self.local_hits,
+            "remote_reads": self.remote_reads,
+            "remote_writer": self.remote_writer.stats(),
+        }
+
+
+def create_storage(backend: str) -> StorageBackend:
+    """Build a storage backend by name (see STORAGE_BACKENDS)."""
+    if backend == "cosmos":
+        return CosmosStorage()
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "tiered":
+        return TieredStorage(SQLiteStorage(), CosmosStorage())
+    raise ValueError(f"Unknown storage backend '{backend}'; expected one of: {', '.join(STORAGE_BACKENDS)}")
+
+
+@lru_cache()
+def get_storage() -> StorageBackend:
+    """Get the process-wide storage backend selected by STORAGE_BACKEND."""
+    return create_storage(settings.storage_backend)
@@ -0,0 +1,180 @@
+"""
+Sampled capture of ``/process-chat`` traffic for replay load tests.
+
+Synthetic snapshots don't have the shape of real pages. When
+``TRAFFIC_CAPTURE_SAMPLE_RATE`` is set, a deterministic sample of users has
+every chat request written to gzip-compressed JSONL: arrival time, message,
+the ``dom_snapshot`` exactly as sent (full or delta), and the session and
+its turn position. User and session IDs are replaced by keyed hashes, so
+captures can't be joined back to accounts; message text is kept as sent.
+
+Sampling is per user so captured sessions are complete and replay in order.
+Records are written by a background thread from a bounded queue; if it falls
+behind, records are dropped rather than delaying requests. Files rotate at
+``TRAFFIC_CAPTURE_MAX_FILE_MB``. ``benchmarks/replay.py`` plays them back.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from config import get_settings
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import queue
+import secrets
+import tempfile
+import threading
+import time
+import logging
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Sessions whose turn position is tracked
+MAX_TRACKED_SESSIONS = 100000
+
+_STOP = object()
+
+
+class TrafficRecorder:
+    """Writes a sample of chat requests to rotating compressed JSONL files."""
+
+    def __init__(
+        self,
+        sample_rate: Optional[float] = None,
+        directory: Optional[str] = None,
+        salt: Optional[str] = None,
+        max_file_bytes: Optional[int] = None,
+        max_pending: Optional[int] = None
+    ):
+        self.sample_rate = settings.traffic_capture_sample_rate if sample_rate is None else sample_rate
+        self.directory = directory or settings.traffic_capture_dir or os.path.join(
+            tempfile.gettempdir(), "ai-service-traffic"
+        )
+        # Without a configured salt, hashes are only stable within one process
+        salt = salt or settings.traffic_capture_salt or secrets.token_hex(16)
+        self._salt = salt.encode("utf-8")
+        self.max_file_bytes = max_file_bytes or settings.traffic_capture_max_file_mb * 1024 * 1024
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_pending or settings.traffic_capture_max_pending)
+        self._writer: Optional[threading.Thread] = None
+        self._positions: "OrderedDict[str, int]" = OrderedDict()
+        self.recorded = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def anonymize(self, value: str) -> str:
+        return hmac.new(self._salt, value.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+    def sampled(self, user_id: str) -> bool:
+        """Deterministic per-user sampling decision."""
+        if not self.enabled:
+            return False
+        if self.sample_rate >= 1:
+            return True
+        bucket = int(hashlib.sha1(self._salt + user_id.encode("utf-8")).hexdigest()[:8], 16)
+        return bucket / 0xFFFFFFFF < self.sample_rate
+
+    def record(
+        self,
+        arrived_at: float,
+        user_id: str,
+        message: str,
+        dom_snapshot: Optional[Dict[str, Any]],
+        session_id: str,
+        new_session: bool,
+        use_cache: bool = True
+    ):
+        """
+        Queue one finished request for capture.
+
+        Args:
+            arrived_at: Epoch seconds when the request arrived
+            session_id: The session the request ran in (as returned to the client)
+            new_session: Whether the request started the session
+        """
+        if not self.sampled(user_id):
+            return
+        session = self.anonymize(session_id)
+        if new_session:
+            position = 0
+        else:
+            # -1 for sessions that started before capture did
+            last = self._positions.get(session, -1)
+            position = last + 1 if last >= 0 else -1
+        self._positions[session] = position
+        self._positions.move_to_end(session)
+        while len(self._positions) > MAX_TRACKED_SESSIONS:
+            self._positions.popitem(last=False)
+
+        entry = {
+            "t": arrived_at,
+            "user": self.anonymize(user_id),
+            "session": session,
+            "position": position,
+            "message": message,
+            "dom_snapshot": dom_snapshot,
+            "use_cache": use_cache,
+        }
+        if self._writer is None:
+            self._start()
+        try:
+            self._queue.put_nowait(entry)
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 5.0):
+        """Write out queued records and stop the writer thread."""
+        if self._writer is None:
+            return
+        self._queue.put(_STOP)
+        self._writer.join(timeout)
+        self._writer = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "pending": self._queue.qsize(),
+        }
+
+    def _start(self):
+        self._writer = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._writer.start()
+
+    def _run(self):
+        output = None
+        try:
+            while True:
+                entry = self._queue.get()
+                if entry is _STOP:
+                    return
+                if output is None or output.fileobj.tell() >= self.max_file_bytes:
+                    if output is not None:
+                        output.close()
+                    output = self._open()
+                    if output is None:
+                        continue
+                output.write(json.dumps(entry, separators=(",", ":"), default=str).encode("utf-8") + b"\n")
+                if self._queue.empty():
+                    output.flush()
+        finally:
+            if output is not None:
+                output.close()
+
+    def _open(self) -> Optional[gzip.GzipFile]:
+        name = f"traffic-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{secrets.token_hex(3)}.jsonl.gz"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, name)
+            logger.info("Capturing traffic", extra={"path": path})
+            return gzip.GzipFile(path, "wb")
+        except OSError as e:
+            logger.error("Error opening traffic capture file: %s", e)
+            return None
@@ -0,0 +1,167 @@
+"""
+Write-behind persistence for chat messages.
+
+Storing a turn used to cost two sequential ``create_item`` round trips before
+the reply was returned. ``WriteBehindQueue`` accepts documents immediately and
+a background worker flushes them in batches: documents are grouped by
+partition key and each group is written as one transactional batch. The queue
+is bounded, so producers wait (backpressure) instead of growing memory without
+limit when Cosmos is throttling, and failed batches are retried with jittered
+exponential backoff. ``close`` drains everything still queued.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config import get_settings
+import asyncio
+import random
+import logging
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Cosmos DB rejects transactional batches with more than 100 operations
+MAX_BATCH_OPERATIONS = 100
+
+# Status codes that will not succeed on retry
+_PERMANENT_ERRORS = (400, 401, 403, 404, 409, 413)
+
+BatchWriter = Callable[[Any, List[Dict[str, Any]]], Awaitable[None]]
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of documents flushed in per-partition batches.
+
+    Args:
+        write_batch: Coroutine writing a list of documents that share a
+            partition key, e.g. as one Cosmos transactional batch
+        partition_key_field: Document field holding the partition key
+    """
+
+    def __init__(
+        self,
+        write_batch: BatchWriter,
+        partition_key_field: str = "userId",
+        max_pending: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_retries: Optional[int] = None
+    ):
+        self.write_batch = write_batch
+        self.partition_key_field = partition_key_field
+        self.max_pending = max_pending or settings.write_behind_max_pending
+        self.batch_size = min(batch_size or settings.write_behind_batch_size, MAX_BATCH_OPERATIONS)
+        self.flush_interval = (
+            flush_interval if flush_interval is not None
+            else settings.write_behind_flush_interval_ms / 1000
+        )
+        self.max_retries = settings.write_behind_max_retries if max_retries is None else max_retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """Start the flush worker on the running event loop."""
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._worker = asyncio.create_task(self._run())
+
+    async def put(self, document: Dict[str, Any]):
+        """Queue a document; waits only while the queue is full."""
+        if self._worker is None:
+            self.start()
+        await self._queue.put(document)
+
+    async def close(self, timeout: float = 10.0):
+        """Flush everything still queued, then stop the worker."""
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Write-behind queue not drained on shutdown", extra={"lost": self.pending})
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+        self._worker = None
+        self._queue = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "written": self.written,
+            "batches": self.batches,
+            "retries": self.retries,
+            "dropped": self.dropped,
+        }
+
+    async def _run(self):
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            # Collect whatever else arrives within the flush interval
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _flush(self, documents: List[Dict[str, Any]]):
+        """Write documents grouped by partition, preserving order within each."""
+        groups: Dict[Any, List[Dict[str, Any]]] = {}
+        for document in documents:
+            groups.setdefault(document.get(self.partition_key_field), []).append(document)
+
+        writes = []
+        for partition_key, group in groups.items():
+            for start in range(0, len(group), self.batch_size):
+                writes.append(self._write_with_retry(partition_key, group[start:start + self.batch_size]))
+        await asyncio.gather(*writes)
+
+    async def _write_with_retry(self, partition_key: Any, documents: List[Dict[str, Any]]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.write_batch(partition_key, documents)
+                self.written += len(documents)
+                self.batches += 1
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                status = getattr(e, "status_code", None)
+                if status in _PERMANENT_ERRORS or attempt == self.max_retries:
+                    self.dropped += len(documents)
+                    logger.error("Error storing messages: %s", e, extra={"count": len(documents)})
+                    return
+                self.retries += 1
+                await asyncio.sleep(_retry_delay(e, attempt))
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's retry-after."""
+    delay = random.uniform(0, min(5.0, 0.1 * 2 ** attempt))
+    headers = getattr(getattr(error, "response", None), "headers", None) or getattr(error, "headers", None) or {}
+    try:
+        retry_after_ms = float(headers.get("x-ms-retry-after-ms", 0))
+    except (TypeError, ValueError, AttributeError):
+        retry_after_ms = 0
+    return max(delay, retry_after_ms / 1000)
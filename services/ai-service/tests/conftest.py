@@ -0,0 +1,13 @@
+"""
+Shared test setup: the service modules import settings and the Agent
+Framework at import time, so the benchmark stand-ins are installed first.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fakes  # noqa: E402
+
+fakes.install()
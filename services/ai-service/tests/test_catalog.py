@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+from services.catalog import BUNDLED_CATALOG_PATH, GATEWAY_CATALOG_PATH, ProductCatalog, default_catalog_path
+
+
+def test_bundled_catalog_loads():
+    catalog = ProductCatalog(path=BUNDLED_CATALOG_PATH)
+    catalog.load()
+    assert len(catalog) > 0
+
+
+@pytest.mark.skipif(not os.path.exists(GATEWAY_CATALOG_PATH), reason="gateway sources not checked out")
+def test_checkout_reads_the_gateway_catalog():
+    assert default_catalog_path() == GATEWAY_CATALOG_PATH
+
+
+@pytest.mark.skipif(not os.path.exists(GATEWAY_CATALOG_PATH), reason="gateway sources not checked out")
+def test_bundled_catalog_is_generated_from_the_gateway():
+    with open(BUNDLED_CATALOG_PATH, encoding="utf-8") as bundled, open(GATEWAY_CATALOG_PATH, encoding="utf-8") as gateway:
+        assert bundled.read() == gateway.read(), "data/products.json is stale; run scripts/sync_catalog.py"
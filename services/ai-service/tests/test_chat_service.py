@@ -0,0 +1,164 @@
+import asyncio
+import time
+
+import pytest
+
+from benchmarks import fakes
+from benchmarks.snapshots import make_snapshot
+from services import chat_service
+from services.admission import AdmissionController, AdmissionRejected
+from services.chat_service import ChatService
+from services.snapshot_index import SnapshotIndex
+from services.storage import MemoryStorage
+
+QUESTION = "which shoes go with jeans?"
+
+
+@pytest.fixture(autouse=True)
+def instant_agent(monkeypatch):
+    monkeypatch.setattr(fakes.AgentProfile, "ttft_ms", 0.0)
+    monkeypatch.setattr(fakes.AgentProfile, "tokens_per_second", 0.0)
+
+
+def make_service() -> ChatService:
+    service = ChatService()
+    service.storage = MemoryStorage()
+    return service
+
+
+async def drain(events):
+    return [event async for event in events]
+
+
+def slow_context(service: ChatService, seconds: float):
+    build_context = service.context_provider.build_context
+
+    def build(snapshot):
+        time.sleep(seconds)
+        return build_context(snapshot)
+
+    service.context_provider.build_context = build
+
+
+def test_degraded_answers_are_not_cached(monkeypatch):
+    monkeypatch.setattr(chat_service.settings, "context_stage_timeout_ms", 10)
+
+    async def scenario():
+        service = make_service()
+        slow_context(service, 0.1)
+        try:
+            await service.process_chat("user-1", QUESTION, make_snapshot(10))
+            assert len(service.response_cache) == 0
+
+            events = await drain(service.stream_chat("user-2", QUESTION, make_snapshot(10)))
+            assert events[-1]["event"] == "done"
+            assert len(service.response_cache) == 0
+        finally:
+            await service.close()
+
+    asyncio.run(scenario())
+
+
+def test_turn_keeps_its_snapshot_when_the_session_moves_on():
+    async def scenario():
+        service = make_service()
+        try:
+            first = await service.process_chat("user-1", QUESTION, make_snapshot(10))
+            session_id = first["session_id"]
+            results = await asyncio.gather(
+                service.process_chat("user-1", "which shoes under $100 go with jeans?", make_snapshot(20), session_id),
+                service.process_chat("user-1", "anything for running?", make_snapshot(30), session_id)
+            )
+            assert [result["snapshot_version"] for result in results] == [2, 3]
+        finally:
+            await service.close()
+
+    asyncio.run(scenario())
+
+
+def test_admission_only_applies_to_agent_turns():
+    async def scenario():
+        service = make_service()
+        service.admission = AdmissionController(max_concurrency=1, max_queue=0, max_per_user=1)
+        try:
+            first = await service.process_chat("user-1", QUESTION, make_snapshot(10))
+            session_id = first["session_id"]
+            busy = service.admission.admit("user-1")
+
+            # Local answers go through while the user is at their limit
+            local = await service.process_chat("user-1", "cheapest shoes", make_snapshot(10), session_id)
+            assert local["snapshot_version"] == 2
+
+            delta = {"base_version": 2, "removed": ["bench-0001"]}
+            with pytest.raises(AdmissionRejected):
+                await service.process_chat("user-1", QUESTION, delta, session_id)
+            with pytest.raises(AdmissionRejected):
+                await drain(service.stream_chat("user-1", "anything for running?", delta, session_id))
+            assert service.admission.stats()["rejected"] == 2
+            assert service.snapshot_store.get(session_id).version == 2
+
+            # The rejected delta can be resent unchanged once there is room
+            busy.close()
+            events = await drain(service.stream_chat("user-1", "anything for running?", delta, session_id))
+            assert events[-1]["data"]["snapshot_version"] == 3
+        finally:
+            await service.close()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_duplicate_streams_share_one_run():
+    async def scenario():
+        service = make_service()
+        run_stream = service.agent_runtime.run_stream
+        runs = []
+
+        def counting_run_stream(*args, **kwargs):
+            runs.append(args)
+            return run_stream(*args, **kwargs)
+
+        service.agent_runtime.run_stream = counting_run_stream
+        try:
+            original, retry = await asyncio.gather(
+                drain(service.stream_chat("user-1", QUESTION, make_snapshot(10), idempotency_key="retry-me")),
+                drain(service.stream_chat("user-1", QUESTION, make_snapshot(10), idempotency_key="retry-me"))
+            )
+            assert len(runs) == 1
+            assert original[-1] == retry[-1]
+            session_id = original[-1]["data"]["session_id"]
+        finally:
+            await service.close()
+        assert len(await service.storage.recent_messages(session_id, "user-1", 10)) == 2
+
+    asyncio.run(scenario())
+
+
+def test_local_answers_respect_hidden_categories():
+    async def scenario():
+        service = make_service()
+        snapshot = make_snapshot(30)
+        index = SnapshotIndex.from_snapshot(snapshot)
+        formal = [index.ids[row] for row in range(index.size) if index.categories[index.category[row]] == "formal"]
+        await service.storage.upsert_preferences(
+            "user-no-formal", {"id": "user-no-formal", "userId": "user-no-formal", "hidden_categories": ["formal"]}
+        )
+        answer = service.fast_path.answer
+        answered = []
+
+        def counting_answer(index, query):
+            answered.append(query)
+            return answer(index, query)
+
+        service.fast_path.answer = counting_answer
+        try:
+            result = await service.process_chat("user-no-formal", "best deals", snapshot)
+            assert len(answered) == 1
+            assert formal and not any(f"(#{product_id})" in result["response"] for product_id in formal)
+
+            # A follow-up depends on the earlier answer and goes to the agent
+            await service.process_chat("user-no-formal", "and under $50?", snapshot, result["session_id"])
+            assert len(answered) == 1
+        finally:
+            await service.close()
+
+    asyncio.run(scenario())
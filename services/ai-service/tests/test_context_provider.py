@@ -0,0 +1,10 @@
+from services.context_provider import ProductRenderer
+
+
+def test_cached_lines_keep_the_price_type():
+    renderer = ProductRenderer(max_entries=16)
+    product = {"id": "shoe-001", "name": "Runner", "category": "athletic", "discount": 10}
+    assert "Price: $100 " in renderer.line({**product, "price": 100}) + " "
+    assert "Price: $100.0 " in renderer.line({**product, "price": 100.0}) + " "
+    assert "| $100 |" in renderer.row({**product, "price": 100})
+    assert "| $100.0 |" in renderer.row({**product, "price": 100.0})
@@ -0,0 +1,90 @@
+import pytest
+
+from benchmarks.snapshots import make_snapshot
+from services.fast_path import FastPathResponder
+from services.snapshot_index import MAX_LISTED, SnapshotIndex, parse_query
+
+CATEGORIES = ["casual", "athletic", "formal"]
+
+
+def classify(message: str) -> bool:
+    return FastPathResponder(min_confidence=0.85).classify(message, parse_query(message, CATEGORIES))
+
+
+@pytest.mark.parametrize("message", [
+    "show me all the shoes that are not on sale",
+    "are there any shoes that don't have a discount?",
+    "any shoes under $100 except casual ones?",
+    "shoes without a discount",
+    "casual shoes excluding ones on sale",
+    "show non-discounted shoes",
+    "hide casual shoes",
+    "shoes under $100 other than athletic",
+    "no sale shoes please",
+])
+def test_negated_questions_go_to_the_agent(message):
+    assert not classify(message)
+
+
+@pytest.mark.parametrize("message", [
+    "show discounted casual shoes under $150",
+    "cheapest shoes",
+    "shoes for no more than $100",
+    "shoes no more than $100",
+    "casual shoes no more than $120",
+])
+def test_structural_questions_are_answered_locally(message):
+    assert classify(message)
+
+
+@pytest.mark.parametrize("message, filters", [
+    ("shoes no more than $100", {"max_price": 100}),
+    ("casual shoes no more than $120", {"category": "casual", "max_price": 120}),
+    ("shoes for work", {"category": "work"}),
+])
+def test_price_phrases_become_filters(message, filters):
+    query = parse_query(message, CATEGORIES + ["work"])
+    assert FastPathResponder().filters_for(query) == filters
+
+
+def test_verbs_are_not_categories():
+    assert parse_query("do these work?", CATEGORIES + ["work"]) is None
+
+
+@pytest.mark.parametrize("message", ["shoes over $200 under $100", "shoes over $100 and under $100"])
+def test_impossible_price_ranges_go_to_the_agent(message):
+    assert not classify(message)
+
+
+def test_follow_ups():
+    responder = FastPathResponder()
+    assert responder.follow_up("and under $50?")
+    assert responder.follow_up("show me those on sale")
+    assert not responder.follow_up("cheapest shoes")
+
+
+def test_personalize_applies_hidden_categories_and_customer_type():
+    responder = FastPathResponder()
+    query = responder.personalize(parse_query("cheapest shoes", CATEGORIES), {"hidden_categories": ["Formal"], "is_b2b": True})
+    assert (query.excluded_categories, query.customer_type) == (["formal"], "b2b")
+
+    # Preferred categories are a weighting only the agent can apply
+    assert responder.personalize(parse_query("cheapest shoes", CATEGORIES), {"preferred_categories": ["casual"]}) is None
+    assert responder.personalize(parse_query("formal shoes", CATEGORIES), {"hidden_categories": ["formal"]}) is None
+
+
+@pytest.mark.parametrize("message, filters", [
+    ("most expensive shoes on sale", {"has_discount": True}),
+    ("cheapest discounted shoes", {"has_discount": True}),
+    ("best deals", None),
+])
+def test_sorted_queries_keep_the_discount_filter(message, filters):
+    assert FastPathResponder().filters_for(parse_query(message, CATEGORIES)) == filters
+
+
+def test_grouped_answer_is_capped():
+    index = SnapshotIndex.from_snapshot(make_snapshot(400))
+    query = parse_query("casual shoes", list(index.categories))
+    response, _ = FastPathResponder().answer(index, query)
+    assert response.count("• ") == MAX_LISTED
+    assert f"and {len(index.query(query)) - MAX_LISTED} more" in response
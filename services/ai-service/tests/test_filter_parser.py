@@ -0,0 +1,37 @@
+import pytest
+
+from benchmarks import fakes
+from services.filter_parser import FilterBlockParser
+
+MESSAGES = [
+    fakes.ANSWER,
+    "Here you go:\n\n\n\n```filters\n{\"category\": \"casual\", \"max_price\": 100}\n```\n\nEnjoy!",
+    "No block here, just `code` and ``ticks``\n\n\n\nand blank lines.",
+    "Unterminated ```filters\n{\"category\": \"casual\"}",
+    "```filtersx is not a fence ```filters \n\n{\"has_discount\": true}\n```",
+    "Two blocks ```filters\n{\"category\": \"casual\"}\n```\n and ```filters\n{\"category\": \"formal\"}\n``` end",
+]
+
+
+def feed_in_chunks(message: str, size: int):
+    parser = FilterBlockParser()
+    events = []
+    for start in range(0, len(message), size):
+        events += parser.feed(message[start:start + size])
+    events += parser.close()
+    return parser.text, parser.filters, events
+
+
+@pytest.mark.parametrize("message", MESSAGES)
+@pytest.mark.parametrize("size", [1, 2, 3, 4, 7, 16])
+def test_chunking_does_not_change_the_result(message, size):
+    text, filters, events = feed_in_chunks(message, size)
+    assert (text, filters) == FilterBlockParser.parse(message)
+    assert "".join(value for kind, value in events if kind == "text") == text
+
+
+def test_blocks_are_hidden_and_only_the_first_sets_filters():
+    text, filters = FilterBlockParser.parse(MESSAGES[5])
+    assert filters == {"category": "casual"}
+    assert text == "Two blocks and end"
+    assert FilterBlockParser.parse(MESSAGES[1]) == ("Here you go:\n\nEnjoy!", {"category": "casual", "max_price": 100.0})
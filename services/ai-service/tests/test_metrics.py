@@ -0,0 +1,26 @@
+import threading
+
+from services.metrics import Histogram
+
+
+def test_render_while_observing_from_threads():
+    histogram = Histogram("test_threaded_seconds", "Observed from worker threads", labels=("worker",))
+    stop = threading.Event()
+
+    def observe(worker: int):
+        label = 0
+        while not stop.is_set():
+            label = (label + 1) % 100
+            histogram.observe(0.01, worker=f"{worker}-{label}")
+
+    threads = [threading.Thread(target=observe, args=(worker,)) for worker in range(2)]
+    for thread in threads:
+        thread.start()
+    try:
+        for _ in range(20):
+            histogram.render()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert histogram.render()[0].startswith("# HELP test_threaded_seconds")
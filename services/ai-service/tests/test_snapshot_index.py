@@ -0,0 +1,56 @@
+import pytest
+
+from benchmarks.snapshots import make_snapshot
+from services.snapshot_index import SnapshotIndex, parse_query
+
+
+def test_discount_or_more_is_a_lower_bound():
+    query = parse_query("shoes with 20% discount or more")
+    assert query.min_discount == 20
+    assert query.min_discount_inclusive
+    assert query.exact_discount is None
+
+
+def test_discount_lower_bound_phrasings():
+    for message in ("at least 20% discount", "20% discount and up", "20% off or more", "20%+ discount"):
+        query = parse_query(message)
+        assert (query.min_discount, query.exact_discount) == (20, None), message
+
+
+def test_exact_discount():
+    assert parse_query("shoes with 20% discount").exact_discount == 20
+    assert parse_query("exactly 20% off").exact_discount == 20
+
+
+def price_bounds(message):
+    query = parse_query(message)
+    return query.min_price, query.min_price_inclusive, query.max_price, query.max_price_inclusive
+
+
+@pytest.mark.parametrize("message, bounds", [
+    ("no more than $100", (None, True, 100, True)),
+    ("shoes not more than $100", (None, True, 100, True)),
+    ("no less than $100", (100, True, None, True)),
+    ("no less than $50 and no more than $150", (50, True, 150, True)),
+    ("under $1,000", (None, True, 1000, False)),
+    ("between $1,000 and $1,250.50", (1000, True, 1250.5, True)),
+])
+def test_price_phrases(message, bounds):
+    assert price_bounds(message) == bounds
+
+
+@pytest.mark.parametrize("message", ["over 20 percent off", "more than 20 per cent off", "over 20% off"])
+def test_percentages_are_not_prices(message):
+    query = parse_query(message)
+    assert (query.min_price, query.max_price) == (None, None)
+    assert (query.min_discount, query.min_discount_inclusive) == (20, False)
+
+
+def test_contradictory_bounds_are_not_claimed_complete():
+    index = SnapshotIndex.from_snapshot(make_snapshot(20))
+    query = parse_query("shoes over $200 under $100")
+    assert query.contradictory
+    matches = index.format_matches(query)
+    assert "complete" not in matches
+    assert "contradict" in matches
+    assert "complete" in index.format_matches(parse_query("shoes under $100"))
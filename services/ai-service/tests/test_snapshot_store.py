@@ -0,0 +1,25 @@
+import pytest
+
+from benchmarks.snapshots import make_snapshot
+from services.snapshot_store import SnapshotResyncRequired, SnapshotStore
+
+
+@pytest.mark.parametrize("delta", [
+    {"moved": ["bench-0001"]},
+    {"moved": "bench-0001"},
+    {"added": {"visible": "bench-0001"}},
+    {"added": {"visible": [["bench-0001"]]}},
+    {"added": ["bench-0001"]},
+    {"removed": "bench-0001"},
+    {"removed": {"bench-0001": True}},
+    {"removed": [{"id": "bench-0001"}]},
+])
+def test_malformed_deltas_require_a_resync(delta):
+    store = SnapshotStore()
+    state = store.apply("s1", make_snapshot(10))
+    fingerprint = state.fingerprint
+
+    with pytest.raises(SnapshotResyncRequired):
+        store.apply("s1", {"base_version": state.version, **delta})
+    assert store.get("s1").version == state.version
+    assert store.get("s1").fingerprint == fingerprint
@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+import pytest
+
+from benchmarks import fakes
+from services import storage
+from services.storage import CosmosStorage, MemoryStorage, SQLiteStorage, TieredStorage
+
+
+@pytest.fixture
+def cosmos(monkeypatch):
+    # use_in_memory_cosmos patches these module globals; restore them afterwards
+    for name in ("get_container", "get_cosmos_client", "close_cosmos_client"):
+        monkeypatch.setattr(storage, name, getattr(storage, name))
+    return fakes.use_in_memory_cosmos()
+
+
+@pytest.fixture
+def make_backend(cosmos, tmp_path):
+    def make(name: str):
+        if name == "cosmos":
+            return CosmosStorage()
+        if name == "memory":
+            return MemoryStorage()
+        if name == "sqlite":
+            return SQLiteStorage(path=os.path.join(tmp_path, "local.sqlite3"))
+        return TieredStorage(SQLiteStorage(path=os.path.join(tmp_path, "tier.sqlite3")), CosmosStorage())
+
+    return make
+
+
+def message(n: int, session_id: str = "s1", user_id: str = "user-1"):
+    return {
+        "id": f"{session_id}-m{n}",
+        "sessionId": session_id,
+        "userId": user_id,
+        "role": "user" if n % 2 else "assistant",
+        "content": f"message {n}",
+        "timestamp": f"2026-01-01T00:00:{n:02d}",
+    }
+
+
+@pytest.mark.parametrize("name", storage.STORAGE_BACKENDS)
+def test_backend_contract(make_backend, name):
+    async def scenario():
+        backend = make_backend(name)
+        await backend.start()
+        try:
+            await backend.write_session_documents("user-1", [message(n) for n in (3, 1, 2, 4)])
+            await backend.write_session_documents("user-2", [message(1, "s2", "user-2")])
+            summary = {"id": "summary-s1", "userId": "user-1", "type": "summary", "text": "Likes boots"}
+            await backend.write_session_documents("user-1", [summary])
+
+            recent = await backend.recent_messages("s1", "user-1", 3)
+            assert [m["content"] for m in recent] == ["message 2", "message 3", "message 4"]
+            assert [m["id"] for m in await backend.recent_messages("s2", None, 10)] == ["s2-m1"]
+            assert await backend.recent_messages("s1", "user-2", 10) == []
+
+            assert (await backend.read_session_document("user-1", "summary-s1"))["text"] == "Likes boots"
+            assert await backend.read_session_document("user-1", "missing") is None
+
+            assert await backend.read_preferences("user-1") is None
+            preferences = {"id": "user-1", "userId": "user-1", "style": "casual"}
+            assert (await backend.upsert_preferences("user-1", preferences))["style"] == "casual"
+            assert (await backend.read_preferences("user-1"))["style"] == "casual"
+            assert backend.stats()["backend"] == name
+        finally:
+            await backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_tiered_writes_through_and_refills_after_pruning(cosmos, tmp_path):
+    async def scenario():
+        local = SQLiteStorage(path=os.path.join(tmp_path, "tier.sqlite3"))
+        backend = TieredStorage(local, CosmosStorage(), retention_seconds=0)
+        await backend.start()
+        try:
+            await backend.write_session_documents("user-1", [message(1), message(2)])
+            await backend.upsert_preferences("user-1", {"id": "user-1", "userId": "user-1", "style": "formal"})
+            await backend.remote_writer.close()
+            assert len(cosmos["chat-sessions"]) == 2
+
+            # Everything local is past a zero retention; Cosmos keeps it
+            assert await local.prune(0) == 3
+            assert await local.recent_messages("s1", "user-1", 10) == []
+
+            recent = await backend.recent_messages("s1", "user-1", 10)
+            assert [m["id"] for m in recent] == ["s1-m1", "s1-m2"]
+            assert (await backend.read_preferences("user-1"))["style"] == "formal"
+            assert backend.stats()["remote_reads"] == 2
+
+            # The misses refilled the local tier
+            assert len(await local.recent_messages("s1", "user-1", 10)) == 2
+            await backend.read_preferences("user-1")
+            assert backend.stats()["local_hits"] == 1
+        finally:
+            await backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_tiered_preferences_expire_locally(cosmos, tmp_path):
+    async def scenario():
+        backend = TieredStorage(SQLiteStorage(path=os.path.join(tmp_path, "tier.sqlite3")), CosmosStorage(), preferences_ttl_seconds=0.05)
+        await backend.start()
+        try:
+            await backend.upsert_preferences("user-1", {"id": "user-1", "userId": "user-1", "style": "formal"})
+            # Another replica updates the remote
+            await CosmosStorage().upsert_preferences("user-1", {"id": "user-1", "userId": "user-1", "style": "casual"})
+            assert (await backend.read_preferences("user-1"))["style"] == "formal"
+
+            await asyncio.sleep(0.1)
+            assert (await backend.read_preferences("user-1"))["style"] == "casual"
+            assert backend.stats()["remote_reads"] == 1
+        finally:
+            await backend.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from benchmarks.fakes import InMemoryContainer
+from services import write_behind
+from services.write_behind import WriteBehindQueue
+
+
+class FlakyError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(write_behind, "_retry_delay", lambda error, attempt: 0)
+
+
+def message(n: int, user_id: str = "user-1"):
+    return {"id": f"m{n}", "userId": user_id, "sessionId": "s1", "content": str(n)}
+
+
+class FlakyWriter:
+    """Writes to an in-memory container after failing a number of times."""
+
+    def __init__(self, failures: int = 0, status_code: int = 429):
+        self.container = InMemoryContainer("chat-sessions")
+        self.failures = failures
+        self.status_code = status_code
+        self.attempts = 0
+
+    async def __call__(self, partition_key, documents):
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            raise FlakyError(self.status_code)
+        operations = [("upsert", (document,)) for document in documents]
+        await self.container.execute_item_batch(operations, partition_key=partition_key)
+
+
+def test_transient_errors_are_retried():
+    async def scenario():
+        writer = FlakyWriter(failures=2)
+        queue = WriteBehindQueue(writer, max_retries=3, flush_interval=0)
+        await queue.put(message(1))
+        await queue.close()
+        return writer, queue
+
+    writer, queue = asyncio.run(scenario())
+    assert len(writer.container) == 1
+    assert queue.stats()["retries"] == 2
+    assert queue.stats()["dropped"] == 0
+
+
+@pytest.mark.parametrize("failures, status_code", [(1, 400), (5, 503)])
+def test_permanent_errors_and_exhausted_retries_drop_the_batch(failures, status_code):
+    async def scenario():
+        writer = FlakyWriter(failures=failures, status_code=status_code)
+        queue = WriteBehindQueue(writer, max_retries=2, flush_interval=0)
+        await queue.put(message(1))
+        await queue.close()
+        return writer, queue
+
+    writer, queue = asyncio.run(scenario())
+    assert len(writer.container) == 0
+    assert queue.stats()["dropped"] == 1
+    assert writer.attempts == (1 if status_code == 400 else 3)
+
+
+def test_full_queue_applies_backpressure():
+    async def scenario():
+        writer = FlakyWriter()
+        release = asyncio.Event()
+
+        async def blocked(partition_key, documents):
+            await release.wait()
+            await writer(partition_key, documents)
+
+        queue = WriteBehindQueue(blocked, max_pending=2, batch_size=1, flush_interval=0)
+        # The worker holds one document while the queue fills up behind it
+        for n in range(3):
+            await queue.put(message(n))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(queue.put(message(3)), 0.05)
+
+        release.set()
+        await queue.put(message(3))
+        await queue.close()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert len(writer.container) == 4
+
+
+def test_close_flushes_queued_documents_in_partition_batches():
+    async def scenario():
+        writer = FlakyWriter()
+        queue = WriteBehindQueue(writer, batch_size=3, flush_interval=0.05)
+        for n in range(5):
+            await queue.put(message(n, user_id=f"user-{n % 2}"))
+        await queue.close()
+        return writer, queue
+
+    writer, queue = asyncio.run(scenario())
+    assert len(writer.container) == 5
+    # Two flushes (three documents, then two), each split by user
+    assert queue.stats()["batches"] == 4
+    assert queue.stats()["written"] == 5
@@ -22,7 +22,8 @@ router.post('/', async (req, res) => {
       user_id: userId,
       message: message,
       dom_snapshot: dom_snapshot || null,
-      session_id: session_id || null
+      session_id: session_id || null,
+      idempotency_key: req.body.idempotency_key || req.get('Idempotency-Key') || null
     });
 
     res.json(response.data);
@@ -30,6 +31,9 @@ router.post('/', async (req, res) => {
     console.error('Error processing chat:', error.message);
     
     if (error.response) {
+      if (error.response.headers['retry-after']) {
+        res.set('Retry-After', error.response.headers['retry-after']);
+      }
       res.status(error.response.status).json({
         error: error.response.data.detail || 'Error processing chat'
       });
@@ -39,6 +43,77 @@ router.post('/', async (req, res) => {
   }
 });
 
+/**
+ * POST /api/chat/stream
+ * Stream chat response tokens as Server-Sent Events
+ */
+router.post('/stream', async (req, res) => {
+  try {
+    const { message, dom_snapshot, session_id } = req.body;
+    const userId = req.user.userId;
+
+    if (!message) {
+      return res.status(400).json({ error: 'Message is required' });
+    }
+
+    // Forward request to Python AI service and pipe the event stream through
+    const response = await axios.post(`${AI_SERVICE_URL}/process-chat/stream`, {
+      user_id: userId,
+      message: message,
+      dom_snapshot: dom_snapshot || null,
+      session_id: session_id || null,
+      idempotency_key: req.body.idempotency_key || req.get('Idempotency-Key') || null
+    }, { responseType: 'stream' });
+
+    res.setHeader('Content-Type', 'text/event-stream');
+    res.setHeader('Cache-Control', 'no-cache');
+    res.setHeader('X-Accel-Buffering', 'no');
+    res.flushHeaders();
+
+    // An upstream reset ends the response instead of raising on the stream
+    response.data.on('error', (error) => {
+      console.error('Error streaming chat:', error.message);
+      res.end();
+    });
+    response.data.pipe(res);
+    // The request body was already consumed by express.json, so watch the response
+    res.on('close', () => response.data.destroy());
+  } catch (error) {
+    console.error('Error streaming chat:', error.message);
+
+    if (error.response) {
+      // With responseType 'stream' the error body is a stream too
+      const body = await readJson(error.response.data);
+      if (error.response.headers['retry-after']) {
+        res.set('Retry-After', error.response.headers['retry-after']);
+      }
+      res.status(error.response.status).json({
+        error: (body && body.detail) || 'Error processing chat'
+      });
+    } else {
+      res.status(500).json({ error: 'Failed to communicate with AI service' });
+    }
+  }
+});
+
+/**
+ * Read a streamed response body as JSON, or null if it isn't JSON
+ */
+async function readJson(stream) {
+  if (!stream || typeof stream.on !== 'function') {
+    return stream || null;
+  }
+  try {
+    const chunks = [];
+    for await (const chunk of stream) {
+      chunks.push(chunk);
+    }
+    return JSON.parse(Buffer.concat(chunks).toString('utf8'));
+  } catch (error) {
+    return null;
+  }
+}
+
 /**
  * GET /api/chat/history/:sessionId
  * Get chat history for a session